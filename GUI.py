@@ -1,15 +1,31 @@
+import time
+STARTUP_BEGIN = time.perf_counter()
+
 import tkinter as tk
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk
+import importlib
 import threading
-from model_creation import process_dicom
-from featureExtraction import main
+import json
+import sys
+from jobs import JobRunner
 import os
 
+# Processing modules (pydicom, scipy, matplotlib, ...) are only imported after the first paint
+WARM_MODULES = ("session",)
+HEAVY_MODULES = ("pydicom", "scipy", "matplotlib", "featureExtraction", "model_creation")
+
+# Slices moved per mouse-wheel notch in the slice browser
+BROWSER_WHEEL_STEP = 1
+
 class App:
 
-    def __init__(self):
+    def __init__(self, measure_startup=False):
+        self.measure_startup = measure_startup
+        self.startup_seconds = None
+        self._session = None
+
         self.root = ctk.CTk()  
         self.root.title("DICOM Image 3D Model Maker")
         
@@ -50,28 +66,72 @@ class App:
         self.processButton = ctk.CTkButton(self.processingBtnFrame, text="Process DICOM", font=self.buttonFont, command=self.process_dicom)
         self.processButton.grid(row=1, column=1, padx=10, pady=20)
 
+        # Feature extraction runs on a worker thread; its events come back through root.after
+        self.jobs = JobRunner(self.root)
+        self.featureJob = None
+
+        # Idle callbacks run after the pending redraws, i.e. once the first frame is on screen
+        self.root.after_idle(self.record_startup)
+
         self.root.mainloop()
 
+    def record_startup(self):
+        self.startup_seconds = time.perf_counter() - STARTUP_BEGIN
+        metric = {
+            'startup_seconds': round(self.startup_seconds, 4),
+            'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in sys.modules],
+        }
+        if self.measure_startup:
+            print(f"Startup metric: {json.dumps(metric)}")
+            self.root.destroy()
+            return
+        threading.Thread(target=self.warm_modules, daemon=True).start()
+
+    def warm_modules(self):
+        # Import the processing stack in the background so the first click does not pay for it
+        for name in WARM_MODULES:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+
+    @property
+    def session(self):
+        # Decoded studies and their products stay resident across actions until their folder changes
+        if self._session is None:
+            from session import Session
+            self._session = Session()
+        return self._session
+
     def load_gif(self, gif_path, width=None, height=None):
-        self.gif_frames = []  
+        # Only the header is read here; each frame is decoded and resized the first time it is shown
+        self.gif = Image.open(gif_path)
+        self.gif_size = (width, height) if width and height else None
+        self.gif_cache = {}
         self.gif_index = 0  
 
-        gif = Image.open(gif_path)
-        for frame in range(0, gif.n_frames):
-            gif.seek(frame)
-            frame_image = gif.copy()
+        self.update_gif()
 
-            if width and height:
-                frame_image = frame_image.resize((width, height), Image.LANCZOS)
+    def gif_photo(self, index):
+        # Playback is cyclic, so every frame is kept once decoded; the set is bounded by the file
+        if index in self.gif_cache:
+            return self.gif_cache[index]
 
-            self.gif_frames.append(ImageTk.PhotoImage(frame_image))
+        self.gif.seek(index)
+        frame_image = self.gif.copy()
 
-        self.update_gif()
+        if self.gif_size:
+            # Bilinear keeps the one-off decode of each frame cheap on the Tk thread
+            frame_image = frame_image.resize(self.gif_size, Image.BILINEAR)
+
+        photo = ImageTk.PhotoImage(frame_image)
+        self.gif_cache[index] = photo
+        return photo
 
     def update_gif(self):
-        if self.gif_frames:
-            self.gif_label.config(image=self.gif_frames[self.gif_index])
-            self.gif_index = (self.gif_index + 1) % len(self.gif_frames)
+        if self.gif is not None:
+            self.gif_label.config(image=self.gif_photo(self.gif_index))
+            self.gif_index = (self.gif_index + 1) % self.gif.n_frames
             self.root.after(100, self.update_gif)
 
     def browse_folder(self):
@@ -116,6 +176,9 @@ class App:
             self.rightPanelLabel = ctk.CTkLabel(self.panelFrameLabel, text="Feature Image Preview", font=self.labelFont, width=700)
             self.rightPanelLabel.grid(row=0, column=1)
 
+            self.browserPanelLabel = ctk.CTkLabel(self.panelFrameLabel, text="Slice Browser", font=self.labelFont, width=540)
+            self.browserPanelLabel.grid(row=0, column=2)
+
             self.mainFrame = ctk.CTkFrame(self.featureWindow, width=1500)
             self.mainFrame.pack(padx=5)
 
@@ -128,13 +191,173 @@ class App:
             self.gridFrame = ctk.CTkFrame(self.rightPanel, width=700)
             self.gridFrame.pack(fill="x", expand=True)
 
+            self.browserPanel = ctk.CTkFrame(self.mainFrame, width=540)
+            self.browserPanel.grid(row=0, column=2, sticky="n")
+
+            self.statusFrame = ctk.CTkFrame(self.featureWindow)
+            self.statusFrame.pack(pady=10)
+
+            self.statusLabel = ctk.CTkLabel(self.statusFrame, text="Starting...", font=("Arial", 14), width=400)
+            self.statusLabel.grid(row=0, column=0, padx=10)
+
+            self.cancelButton = ctk.CTkButton(self.statusFrame, text="Cancel", font=self.buttonFont, command=self.cancel_extraction)
+            self.cancelButton.grid(row=0, column=1, padx=10)
+
+            self.featureWindow.protocol("WM_DELETE_WINDOW", self.close_feature_window)
+
             self.dicom_features = {}
+            self.previews = {}
+            self.close_slice_browser()
+
+            self.start_extraction(self.browseEntry.get())
+
+    def start_extraction(self, folder_path):
+        # Only one extraction at a time; a new one replaces the previous run
+        if self.featureJob is not None:
+            self.featureJob.cancel()
+
+        session = self.session
+        job = self.jobs.submit(
+            lambda job: session.study(folder_path).iter_features(callback=job.progress),
+            on_event=self.on_feature_event,
+            on_progress=self.on_feature_progress,
+            on_done=lambda: self.finish_extraction(job, "Done" if self.dicom_features else "No valid DICOM files found."),
+            on_error=lambda e: self.finish_extraction(job, "Failed", e),
+            on_cancel=lambda: self.finish_extraction(job, "Cancelled"),
+        )
+        self.featureJob = job
+
+    def on_feature_progress(self, stage, status):
+        if status != 'done':
+            self.statusLabel.configure(text=f"{stage.capitalize()}{' (cached)' if status == 'cached' else '...'}")
+
+    def on_feature_event(self, event):
+        # The feature table arrives first, then each preview image as soon as it is rendered
+        if event[0] == 'features':
+            self.dicom_features = event[1]
+            self.update_features_table()
+        elif event[0] == 'volume':
+            _, series_uid, (volume, voxel_size, metadata) = event
+            self.open_slice_browser(volume, voxel_size, metadata)
+        elif event[0] == 'preview':
+            _, name, image = event
+            self.previews[name] = image
+            self.add_preview_image(name, image)
+
+    def finish_extraction(self, job, status, error=None):
+        # A run that was replaced by a newer one no longer owns the window
+        if job is not self.featureJob:
+            return
+        self.featureJob = None
+        if not self.featureWindow.winfo_exists():
+            return
+        self.statusLabel.configure(text=status)
+        self.cancelButton.configure(state="disabled")
+        if error is not None:
+            messagebox.showerror('Extraction Error', f'Error: {error}')
+
+    def cancel_extraction(self):
+        if self.featureJob is not None:
+            self.featureJob.cancel()
+            self.statusLabel.configure(text="Cancelling...")
+
+    def close_feature_window(self):
+        self.cancel_extraction()
+        self.close_slice_browser()
+        self.featureWindow.destroy()
+
+    def open_slice_browser(self, volume, voxel_size, metadata):
+        # Slices are rendered from the in-memory volume; neighbours are prefetched on a background thread
+        from slice_browser import SliceRenderer
+        from preview import VIEWS
+
+        self.close_slice_browser()
+        for widget in self.browserPanel.winfo_children():
+            widget.destroy()
 
-            self.dicom_features = main(self.browseEntry.get())
-            if self.dicom_features is not None:
-                self.add_image_grid()
-                
-                self.update_features_table()  
+        self.sliceRenderer = SliceRenderer(volume, metadata, voxel_size)
+        self.browserView = "axial"
+        self.browserIndex = {view: self.sliceRenderer.num_slices(view) // 2 for view in VIEWS}
+        self.browserDrawPending = None
+
+        self.browserViewButton = ctk.CTkSegmentedButton(self.browserPanel, values=list(VIEWS), font=self.buttonFont, command=self.on_browser_view)
+        self.browserViewButton.set(self.browserView)
+        self.browserViewButton.pack(pady=5)
+
+        size = self.sliceRenderer.display_size
+        self.browserImage = tk.Label(self.browserPanel, bg="black")
+        self.browserImage.pack(padx=10)
+        self.browserImage.bind("<MouseWheel>", self.on_browser_wheel)
+        self.browserImage.bind("<Button-4>", self.on_browser_wheel)
+        self.browserImage.bind("<Button-5>", self.on_browser_wheel)
+
+        self.browserSliceLabel = ctk.CTkLabel(self.browserPanel, text="", font=("Arial", 14))
+        self.browserSliceLabel.pack()
+        self.browserSlice = ctk.CTkSlider(self.browserPanel, width=size, from_=0, to=1, command=self.on_browser_slice)
+        self.browserSlice.pack(pady=5)
+
+        # Window/level: centre over the volume's intensity range, width up to all of it
+        low, high = self.sliceRenderer.value_range()
+        vmin, vmax = self.sliceRenderer.window
+        span = max(high - low, 1)
+
+        self.browserWindowLabel = ctk.CTkLabel(self.browserPanel, text="", font=("Arial", 14))
+        self.browserWindowLabel.pack()
+        self.browserCenter = ctk.CTkSlider(self.browserPanel, width=size, from_=low, to=high, command=self.on_browser_window)
+        self.browserCenter.set((vmin + vmax) / 2)
+        self.browserCenter.pack(pady=5)
+        self.browserWidth = ctk.CTkSlider(self.browserPanel, width=size, from_=1, to=span, command=self.on_browser_window)
+        self.browserWidth.set(vmax - vmin)
+        self.browserWidth.pack(pady=5)
+
+        self.on_browser_view(self.browserView)
+        self.on_browser_window()
+
+    def close_slice_browser(self):
+        renderer = getattr(self, "sliceRenderer", None)
+        if renderer is not None:
+            renderer.close()
+            self.sliceRenderer = None
+
+    def on_browser_view(self, view):
+        self.browserView = view
+        last = self.sliceRenderer.num_slices(view) - 1
+        self.browserSlice.configure(to=max(last, 1), number_of_steps=max(last, 1))
+        self.browserSlice.set(self.browserIndex[view])
+        self.request_slice_draw()
+
+    def on_browser_slice(self, value):
+        self.browserIndex[self.browserView] = int(round(value))
+        self.request_slice_draw()
+
+    def on_browser_wheel(self, event):
+        step = -BROWSER_WHEEL_STEP if event.num == 4 or event.delta > 0 else BROWSER_WHEEL_STEP
+        last = self.sliceRenderer.num_slices(self.browserView) - 1
+        index = min(max(self.browserIndex[self.browserView] + step, 0), last)
+        self.browserIndex[self.browserView] = index
+        self.browserSlice.set(index)
+        self.request_slice_draw()
+
+    def on_browser_window(self, value=None):
+        center, width = self.browserCenter.get(), self.browserWidth.get()
+        self.sliceRenderer.set_window(center - width / 2, center + width / 2)
+        self.browserWindowLabel.configure(text=f"Level {center:.0f}   Window {width:.0f}")
+        self.request_slice_draw()
+
+    def request_slice_draw(self):
+        # Slider and wheel events arriving faster than Tk redraws collapse into one draw
+        if self.browserDrawPending is None:
+            self.browserDrawPending = self.root.after_idle(self.draw_slice)
+
+    def draw_slice(self):
+        self.browserDrawPending = None
+        if self.sliceRenderer is None or not self.browserImage.winfo_exists():
+            return
+        view, index = self.browserView, self.browserIndex[self.browserView]
+        photo = ImageTk.PhotoImage(self.sliceRenderer.image(view, index))
+        self.browserImage.configure(image=photo)
+        self.browserImage.image = photo
+        self.browserSliceLabel.configure(text=f"{view.capitalize()} slice {index + 1} / {self.sliceRenderer.num_slices(view)}")
 
     def process_dicom(self):
         filePresent = self.has_only_dcm_files(self.browseEntry.get())
@@ -147,21 +370,22 @@ class App:
             except:
                 pass
 
+            self.jobs.cancel_all()
             self.root.destroy()
 
+            # model_creation takes only a folder path, so it reads the series itself rather than the session's volume
+            from model_creation import process_dicom
             process_dicom(folder_path)
         
-    def add_image_grid(self):
-        image_paths = ["axial.png", "coronal.png", "sagittal.png", "surface_normals_axial.png"]
+    def add_preview_image(self, image_name, image):
+        image_names = ["axial", "coronal", "sagittal", "surface_normals_axial"]
+        index = image_names.index(image_name)
 
-        for index, image_path in enumerate(image_paths):
-            
-            image = Image.open(image_path).resize((350, 350))
-            photo = ImageTk.PhotoImage(image)
+        photo = ImageTk.PhotoImage(image.resize((350, 350)))
 
-            img_label = ctk.CTkLabel(self.gridFrame, image=photo, text="")
-            img_label.image = photo  
-            img_label.grid(row=index // 2, column=index % 2, padx=1, pady=1)
+        img_label = ctk.CTkLabel(self.gridFrame, image=photo, text="")
+        img_label.image = photo  
+        img_label.grid(row=index // 2, column=index % 2, padx=1, pady=1)
 
     def update_features_table(self):
         self.dicom_features.pop("FrameOfReferenceUID", None)
@@ -179,4 +403,4 @@ class App:
             value_label = ctk.CTkLabel(table_frame, text=str(value), font=("Arial", 14), width=200, height=40, corner_radius=10, fg_color="lightgray", text_color="black")
             value_label.grid(row=i + 1, column=1, padx=2, pady=5)
 
-GUI = App()
\ No newline at end of file
+GUI = App(measure_startup="--startup-metric" in sys.argv)
\ No newline at end of file
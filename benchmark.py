@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import importlib.util
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, CTImageStorage, generate_uid
+
+import featureExtraction
+
+STAGES = (
+    'process_dicom_directory', 'reconstruct_3d_volume', 'resample_volume', 'compute_surface_normals',
+    'apply_kmeans', 'refine_mask', 'level3_segment_teeth',
+)
+
+# Stages whose outputs each stage reads; these run untimed when not requested themselves.
+REQUIRES = {
+    'reconstruct_3d_volume': ('process_dicom_directory',),
+    'resample_volume': ('reconstruct_3d_volume',),
+    'compute_surface_normals': ('resample_volume',),
+    'apply_kmeans': ('reconstruct_3d_volume',),
+    'refine_mask': ('apply_kmeans',),
+    'level3_segment_teeth': ('reconstruct_3d_volume',),
+}
+
+# Phantom intensities in HU: air, soft tissue, bone and enamel-like teeth.
+AIR_HU = -1000
+TISSUE_HU = 40
+BONE_HU = 700
+TEETH_HU = 2000
+NOISE_HU = 30
+
+
+def phantom_slice(rows, cols, z, num_slices, rng):
+    """One CT-like axial slice in HU: a head-sized ellipse, a jaw arch and a ring of teeth."""
+    yy, xx = np.mgrid[:rows, :cols].astype(np.float32)
+    cy, cx = rows / 2, cols / 2
+    image = np.full((rows, cols), AIR_HU, dtype=np.float32)
+    image[((yy - cy) / (0.45 * rows)) ** 2 + ((xx - cx) / (0.45 * cols)) ** 2 <= 1] = TISSUE_HU
+
+    # The arch is a half ellipse; teeth sit on it in the middle third of the slices.
+    radius = np.hypot((yy - cy) / (0.3 * rows), (xx - cx) / (0.3 * cols))
+    arch = (np.abs(radius - 1) < 0.08) & (yy > cy)
+    image[arch] = BONE_HU
+    if num_slices // 3 <= z < 2 * num_slices // 3:
+        for angle in np.linspace(0.15 * np.pi, 0.85 * np.pi, 14):
+            ty, tx = cy + 0.3 * rows * np.sin(angle), cx + 0.3 * cols * np.cos(angle)
+            image[(yy - ty) ** 2 + (xx - tx) ** 2 <= (0.025 * min(rows, cols)) ** 2] = TEETH_HU
+
+    image += rng.normal(0, NOISE_HU, image.shape).astype(np.float32)
+    return image
+
+
+def generate_series(directory, rows=128, cols=128, slices=64, spacing=(0.4, 0.4, 0.8), dtype='int16',
+                    series=1, seed=0):
+    """
+    Write `series` synthetic CT series of `slices` files each into directory.
+
+    Pixels are stored as `dtype` ('int16' or 'uint16') with RescaleIntercept chosen so
+    the stored values fit. Returns the list of written file paths.
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in (np.dtype('int16'), np.dtype('uint16')):
+        raise ValueError(f"Unsupported synthetic dtype: {dtype}")
+    intercept = -1024 if dtype == np.dtype('int16') else AIR_HU - 24
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    study_uid = generate_uid()
+    paths = []
+
+    for s in range(series):
+        series_uid = generate_uid()
+        for z in range(slices):
+            hu = phantom_slice(rows, cols, z, slices, rng)
+            info = np.iinfo(dtype)
+            stored = np.clip(np.rint(hu - intercept), info.min, info.max).astype(dtype)
+
+            meta = FileMetaDataset()
+            meta.MediaStorageSOPClassUID = CTImageStorage
+            meta.MediaStorageSOPInstanceUID = generate_uid()
+            meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+            ds = Dataset()
+            ds.file_meta = meta
+            ds.SOPClassUID = CTImageStorage
+            ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+            ds.SeriesInstanceUID = series_uid
+            ds.StudyInstanceUID = study_uid
+            ds.FrameOfReferenceUID = study_uid
+            ds.PatientID = 'SYNTHETIC'
+            ds.Modality = 'CT'
+            ds.Rows, ds.Columns = rows, cols
+            ds.PixelSpacing = [spacing[0], spacing[1]]
+            ds.SliceThickness = spacing[2]
+            ds.SpacingBetweenSlices = spacing[2]
+            ds.SliceLocation = z * spacing[2]
+            ds.ImagePositionPatient = [0.0, 0.0, z * spacing[2]]
+            ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+            ds.InstanceNumber = z + 1
+            ds.PatientPosition = 'HFS'
+            ds.SamplesPerPixel = 1
+            ds.PhotometricInterpretation = 'MONOCHROME2'
+            ds.BitsAllocated = ds.BitsStored = 16
+            ds.HighBit = 15
+            ds.PixelRepresentation = 1 if dtype.kind == 'i' else 0
+            ds.RescaleIntercept = intercept
+            ds.RescaleSlope = 1
+            ds.RescaleType = 'HU'
+            ds.WindowCenter = 400
+            ds.WindowWidth = 2000
+            ds.PixelData = stored.tobytes()
+
+            path = os.path.join(directory, f"series{s:02d}_{z:05d}.dcm")
+            ds.save_as(path, enforce_file_format=True)
+            paths.append(path)
+    return paths
+
+
+def measure(func, *args, **kwargs):
+    """Run func once; return (result, wall seconds, peak bytes allocated while it ran)."""
+    tracemalloc.reset_peak()
+    start_current, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    return result, seconds, max(0, peak - start_current)
+
+
+def load_level3():
+    """Import 'level 3.py' (the space in its name rules out a normal import)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'level 3.py')
+    spec = importlib.util.spec_from_file_location('level_3', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _stage_functions(directory, index_dir):
+    """Callables per stage; each takes the outputs of the previous ones from `state`."""
+    def catalog(state):
+        index_path = os.path.join(index_dir, f"index-{time.time_ns()}.json")
+        state['series'] = featureExtraction.process_dicom_directory(directory, index_path=index_path)
+        state['slices'] = max(state['series'].values(), key=len)
+        return {'series': len(state['series']), 'files': sum(len(s) for s in state['series'].values())}
+
+    def reconstruct(state):
+        volume, voxel_size, _ = featureExtraction.reconstruct_3d_volume(state['slices'])
+        state['volume'], state['voxel_size'] = volume, voxel_size
+        return {'shape': list(volume.shape)}
+
+    def resample(state):
+        state['resampled'] = featureExtraction.resample_volume(state['volume'], state['voxel_size'])
+        return {'shape': list(state['resampled'].shape)}
+
+    def normals(state):
+        return {'shape': list(featureExtraction.compute_surface_normals(state['resampled']).shape)}
+
+    def kmeans(state):
+        level_1 = state['level_1']
+        normalized = level_1.normalize_volume(state['volume'])
+        state['kmeans_mask'] = level_1.apply_kmeans(normalized)
+        return {'voxels': int(state['kmeans_mask'].sum())}
+
+    def refine(state):
+        return {'voxels': int(state['level_1'].refine_mask(state['kmeans_mask']).sum())}
+
+    def level3(state):
+        level_3 = state['level_3']
+        voxelData = np.asarray(state['volume'].normalized()).transpose(1, 0, 2)
+        return {'voxels': int(level_3.segment_teeth(voxelData).sum())}
+
+    return dict(zip(STAGES, (catalog, reconstruct, resample, normals, kmeans, refine, level3)))
+
+
+def run_benchmarks(directory, stages=STAGES, repeat=1):
+    """
+    Time and memory-profile each requested stage on the series in directory.
+
+    Stages run in pipeline order; prerequisites that were not requested (e.g.
+    apply_kmeans for refine_mask) run once, untimed. Returns one record per
+    stage with the best and mean wall time over `repeat` runs and the peak traced
+    allocation, or an 'error' entry if the stage could not run.
+    """
+    index_dir = tempfile.mkdtemp(prefix='dental3d-bench-')
+    functions = _stage_functions(directory, index_dir)
+    wanted = set(stages)
+    needed = set(wanted)
+    for stage in reversed(STAGES):
+        if stage in needed:
+            needed.update(REQUIRES.get(stage, ()))
+    # Import the level scripts up front so their import time is not charged to a stage.
+    state = {}
+    if needed & {'apply_kmeans', 'refine_mask'}:
+        import level_1
+        state['level_1'] = level_1
+    if 'level3_segment_teeth' in needed:
+        state['level_3'] = load_level3()
+    results = []
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        for stage in STAGES:
+            if stage not in needed:
+                continue
+            if stage not in wanted:
+                functions[stage](state)
+                continue
+            record = {'stage': stage, 'repeat': repeat}
+            try:
+                times, peaks = [], []
+                for _ in range(repeat):
+                    info, seconds, peak = measure(functions[stage], state)
+                    times.append(seconds)
+                    peaks.append(peak)
+            except Exception as e:
+                record['error'] = f"{type(e).__name__}: {e}"
+            else:
+                record.update(info)
+                record['seconds_best'] = min(times)
+                record['seconds_mean'] = sum(times) / len(times)
+                record['peak_bytes'] = max(peaks)
+            results.append(record)
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+        shutil.rmtree(index_dir, ignore_errors=True)
+    return results
+
+
+def check_kmeans_engines(directory):
+    """
+    Teeth masks of apply_kmeans with the sklearn and histogram engines on the largest series in directory.
+
+    Returns both voxel counts and how many voxels differ; the histogram engine is
+    only a faster route to the same segmentation, so 'differing_voxels' should be 0.
+    """
+    import level_1
+
+    series = featureExtraction.process_dicom_directory(directory)
+    volume, _, _ = featureExtraction.reconstruct_3d_volume(max(series.values(), key=len))
+    normalized = level_1.normalize_volume(volume)
+    reference = level_1.apply_kmeans(normalized, engine='sklearn')
+    histogram = level_1.apply_kmeans(normalized, engine='histogram')
+    return {
+        'sklearn_voxels': int(reference.sum()),
+        'histogram_voxels': int(histogram.sum()),
+        'differing_voxels': int(np.count_nonzero(reference != histogram)),
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pydicom': pydicom.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DICOM pipeline on synthetic CT series.")
+    parser.add_argument('--rows', type=int, default=128)
+    parser.add_argument('--cols', type=int, default=128)
+    parser.add_argument('--slices', type=int, default=64)
+    parser.add_argument('--spacing', type=float, nargs=3, default=(0.4, 0.4, 0.8))
+    parser.add_argument('--dtype', choices=('int16', 'uint16'), default='int16')
+    parser.add_argument('--series', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--data-dir', help="Reuse or keep the generated series here instead of a temp dir")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    directory = args.data_dir or tempfile.mkdtemp(prefix='dental3d-series-')
+    try:
+        if not any(name.endswith('.dcm') for name in os.listdir(directory)):
+            generate_series(directory, args.rows, args.cols, args.slices, tuple(args.spacing), args.dtype,
+                            args.series, args.seed)
+        report = {
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'data_dir')},
+            'environment': environment(),
+            'results': run_benchmarks(directory, args.stages, args.repeat),
+        }
+        if 'apply_kmeans' in args.stages:
+            report['checks'] = {'kmeans_engines': check_kmeans_engines(directory)}
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    report = main(sys.argv[1:])
+    # A non-zero exit flags a check that failed, e.g. k-means engines that disagree
+    sys.exit(1 if report.get('checks', {}).get('kmeans_engines', {}).get('differing_voxels') else 0)
@@ -1,88 +1,50 @@
 import pydicom
 import os
-import numpy as np
-from scipy.ndimage import zoom
 import matplotlib.pyplot as plt
 import logging
-from collections import defaultdict
+import dicom_catalog
+import slice_loader
+from dicom_volume import DicomVolume
+from intensity_stats import IntensityStats
+from volume_cache import default_cache
+import resampling
+from pipeline import Pipeline
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def extract_dicom_info(filepath):
-    try:
-        ds = pydicom.dcmread(filepath)
-        
-        return {
-            'SOPInstanceUID': ds.get('SOPInstanceUID', None),
-            'SeriesInstanceUID': ds.get('SeriesInstanceUID', None),
-            'StudyInstanceUID': ds.get('StudyInstanceUID', None),
-            'PatientID': ds.get('PatientID', None),
-            'Modality': ds.get('Modality', None),
-            # Spatial Information
-            'ImagePositionPatient': ds.get('ImagePositionPatient', None),
-            'ImageOrientationPatient': ds.get('ImageOrientationPatient', None),
-            'SliceLocation': ds.get('SliceLocation', None),
-            'FrameOfReferenceUID': ds.get('FrameOfReferenceUID', None),
-            'PositionReferenceIndicator': ds.get('PositionReferenceIndicator', None),
-            # Dimension Information
-            'PixelSpacing': ds.get('PixelSpacing', None),
-            'SliceThickness': ds.get('SliceThickness', None),
-            'SpacingBetweenSlices': ds.get('SpacingBetweenSlices', None),
-            'Rows': ds.get('Rows', None),
-            'Columns': ds.get('Columns', None),
-            'NumberOfFrames': ds.get('NumberOfFrames', None),
-            # Pixel Data and Value Interpretation
-            'PixelData': ds.pixel_array,
-            'BitsAllocated': ds.get('BitsAllocated', None),
-            'BitsStored': ds.get('BitsStored', None),
-            'HighBit': ds.get('HighBit', None),
-            'PixelRepresentation': ds.get('PixelRepresentation', None),
-            'RescaleIntercept': ds.get('RescaleIntercept', 0),
-            'RescaleSlope': ds.get('RescaleSlope', 1),
-            'RescaleType': ds.get('RescaleType', None),
-            'WindowCenter': ds.get('WindowCenter', None),
-            'WindowWidth': ds.get('WindowWidth', None),
-            'PhotometricInterpretation': ds.get('PhotometricInterpretation', None),
-            # Additional Information
-            'InstanceNumber': ds.get('InstanceNumber', None),
-            'AcquisitionNumber': ds.get('AcquisitionNumber', None),
-            'PatientPosition': ds.get('PatientPosition', None),
-            'DerivationDescription': ds.get('DerivationDescription', None),
-            'TableHeight': ds.get('TableHeight', None),
-            'GantryDetectorTilt': ds.get('GantryDetectorTilt', None),
-        }
-    except Exception as e:
-        logging.error(f"Error reading file {filepath}: {str(e)}")
-        return None
+def process_dicom_directory(directory, index_path=None):
+    """Group the .dcm files below directory by series using header-only reads.
 
-def process_dicom_directory(directory):
-    slices = defaultdict(list)
-    for root, _, files in os.walk(directory):
-        for filename in files:
-            if filename.endswith('.dcm'):
-                filepath = os.path.join(root, filename)
-                dicom_info = extract_dicom_info(filepath)
-                if dicom_info:
-                    series_uid = dicom_info['SeriesInstanceUID']
-                    slices[series_uid].append(dicom_info)
-    
-    for series_uid in slices:
-        slices[series_uid].sort(key=lambda x: float(x['SliceLocation'] or 0))
-    
-    return slices
+    Returned slices carry a 'filepath' instead of 'PixelData'; pixels are
+    decoded in reconstruct_3d_volume, only for the series being built.
+    """
+    headers = dicom_catalog.scan_directory(directory, index_path=index_path)
+    return dicom_catalog.group_series(headers)
 
-def reconstruct_3d_volume(slices):
-    rows = slices[0]['Rows']
-    cols = slices[0]['Columns']
-    num_slices = len(slices)
-    
-    volume = np.zeros((rows, cols, num_slices))
-    
-    for i, slice_data in enumerate(slices):
-        pixel_array = slice_data['PixelData']
-        rescale_slope = slice_data['RescaleSlope']
-        rescale_intercept = slice_data['RescaleIntercept']
-        volume[:,:,i] = pixel_array * rescale_slope + rescale_intercept
+def reconstruct_3d_volume(slices, workers=None, executor='thread',
+                          max_inflight_bytes=slice_loader.DEFAULT_MAX_INFLIGHT_BYTES, cache=None):
+    # With a VolumeCache, a series seen before is memory-mapped instead of decoded again.
+    volume = None
+    if cache is not None:
+        cached = cache.load(slices)
+        if cached is not None:
+            return cached
+        volume = cache.allocate(slices)
+    staged = volume is not None
+    if not staged:
+        # Stored dtype, slice-major; RescaleSlope/Intercept are applied when the volume is read.
+        volume = DicomVolume.empty(slices)
+    
+    # Min/max/histogram are gathered per slice while decoding, for normalization without a rescan.
+    stats = IntensityStats(volume.raw.dtype)
+    try:
+        slice_loader.decode_series(slices, volume.raw, axis=0, workers=workers, executor=executor,
+                                   max_inflight_bytes=max_inflight_bytes, rescale=False, stats=stats)
+    except Exception:
+        if staged:
+            cache.discard(volume)
+        raise
+    volume.stats = stats
     
     pixel_spacing = slices[0]['PixelSpacing']
     slice_thickness = slices[0]['SliceThickness']
@@ -113,21 +75,36 @@ def reconstruct_3d_volume(slices):
         'GantryDetectorTilt': slices[0].get('GantryDetectorTilt'),
     }
     
+    if staged:
+        return cache.store(slices, volume, voxel_size, metadata)
+    
     return volume, voxel_size, metadata
 
-def resample_volume(volume, voxel_size, target_voxel_size=(1, 1, 1)):
-    zoom_factors = [old / new for old, new in zip(voxel_size, target_voxel_size)]
-    resampled_volume = zoom(volume, zoom_factors, order=1)
+def resample_volume(volume, voxel_size, target_voxel_size=None, workers=None):
+    """Resample to target_voxel_size (default: isotropic at the finest native spacing) as float32."""
+    resampled_volume = resampling.resample(volume, voxel_size, target_voxel_size, workers=workers)
+    return resampled_volume
+
+def resample_series(slices, volume, voxel_size, target_voxel_size=None, cache=None):
+    """resample_volume, reusing the resampled copy kept in the volume cache if there is one."""
+    target_voxel_size = resampling.resolve_target_spacing(voxel_size, target_voxel_size)
+    if cache is not None:
+        resampled_volume = cache.load_resampled(slices, target_voxel_size)
+        if resampled_volume is not None:
+            return resampled_volume
+    resampled_volume = resample_volume(volume, voxel_size, target_voxel_size)
+    if cache is not None:
+        resampled_volume = cache.store_resampled(slices, target_voxel_size, resampled_volume)
     return resampled_volume
 
-def visualize_3d_volume(volume, metadata):
+def visualize_3d_volume(volume, metadata, window=None):
     fig, axes = plt.subplots(1, 3, figsize=(15, 5))
     
-    window_center = metadata['WindowCenter']
-    window_width = metadata['WindowWidth']
-    if isinstance(window_center, pydicom.multival.MultiValue):
+    # window=(center, width) overrides the WindowCenter/WindowWidth from the headers.
+    window_center, window_width = window or (metadata['WindowCenter'], metadata['WindowWidth'])
+    if isinstance(window_center, (pydicom.multival.MultiValue, list)):
         window_center = window_center[0]
-    if isinstance(window_width, pydicom.multival.MultiValue):
+    if isinstance(window_width, (pydicom.multival.MultiValue, list)):
         window_width = window_width[0]
     
     vmin = window_center - window_width // 2
@@ -145,11 +122,41 @@ def visualize_3d_volume(volume, metadata):
     plt.tight_layout()
     plt.show()
 
+def build_pipeline(cache=None):
+    """Declare the load -> reconstruct -> resample -> render stages (see featureExtraction.build_pipeline)."""
+    pipeline = Pipeline(cache_dir=os.path.join(dicom_catalog.CACHE_ROOT, 'pipeline'), max_entries=16)
+    pipeline.source('directory', fingerprint=dicom_catalog.directory_fingerprint)
+
+    @pipeline.stage('series', inputs=('directory',))
+    def series(directory):
+        return process_dicom_directory(directory)
+
+    @pipeline.stage('slices', inputs=('series',), params={'series_uid': None})
+    def series_slices(series, series_uid):
+        return series[series_uid]
+
+    @pipeline.stage('volume', inputs=('slices',))
+    def volume(slices):
+        return reconstruct_3d_volume(slices, cache=cache)
+
+    @pipeline.stage('resampled', inputs=('slices', 'volume'), params={'target_voxel_size': None})
+    def resampled(slices, volume, target_voxel_size):
+        return resample_series(slices, volume[0], volume[1], target_voxel_size, cache=cache)
+
+    @pipeline.stage('render', inputs=('resampled', 'volume'), params={'window': None}, memoize=False)
+    def render(resampled, volume, window):
+        return visualize_3d_volume(resampled, volume[2], window)
+
+    return pipeline
+
 if __name__ == "__main__":
     dicom_directory = '/home/matrix/Downloads/DIcom gans/Data/raw'
     
+    pipeline = build_pipeline(default_cache())
+    
     logging.info("Processing DICOM files...")
-    series_slices = process_dicom_directory(dicom_directory)
+    keys = pipeline.source_keys(directory=dicom_directory)
+    series_slices = pipeline.run('series', keys=keys, directory=dicom_directory)
     
     if not series_slices:
         logging.warning("No valid DICOM files found.")
@@ -159,18 +166,19 @@ if __name__ == "__main__":
         for series_uid, slices in series_slices.items():
             logging.info(f"\nProcessing series {series_uid}")
             logging.info(f"Number of slices: {len(slices)}")
+            values = {'directory': dicom_directory, 'series_uid': series_uid}
             
             logging.info("Reconstructing 3D volume...")
-            volume, voxel_size, metadata = reconstruct_3d_volume(slices)
+            volume, voxel_size, metadata = pipeline.run('volume', keys=keys, **values)
             logging.info(f"Volume shape: {volume.shape}")
             logging.info(f"Voxel size: {voxel_size}")
             
             logging.info("Resampling volume...")
-            resampled_volume = resample_volume(volume, voxel_size)
+            resampled_volume = pipeline.run('resampled', keys=keys, **values)
             logging.info(f"Resampled volume shape: {resampled_volume.shape}")
             
             logging.info("Visualizing volume...")
-            visualize_3d_volume(resampled_volume, metadata)
+            pipeline.run('render', keys=keys, **values)
             
             logging.info("Additional Metadata:")
             for key, value in metadata.items():
@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+import logging
+from collections import defaultdict
+
+import pydicom
+
+# Shared on-disk cache root for catalog indexes (and later volume caches).
+# Kept outside the DICOM folder so the GUI's "only .dcm files" check still passes.
+CACHE_ROOT = os.environ.get(
+    'DENTAL3D_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'dental3d'),
+)
+
+INDEX_VERSION = 1
+
+# Header fields kept in the catalog: the per-slice DICOM attributes the pipeline reads, without PixelData.
+HEADER_FIELDS = (
+    'SOPInstanceUID', 'SeriesInstanceUID', 'StudyInstanceUID', 'PatientID', 'Modality',
+    'ImagePositionPatient', 'ImageOrientationPatient', 'SliceLocation', 'FrameOfReferenceUID',
+    'PositionReferenceIndicator',
+    'PixelSpacing', 'SliceThickness', 'SpacingBetweenSlices', 'Rows', 'Columns', 'NumberOfFrames',
+    'BitsAllocated', 'BitsStored', 'HighBit', 'PixelRepresentation', 'RescaleIntercept',
+    'RescaleSlope', 'RescaleType', 'WindowCenter', 'WindowWidth', 'PhotometricInterpretation',
+    'InstanceNumber', 'AcquisitionNumber', 'PatientPosition', 'DerivationDescription',
+    'TableHeight', 'GantryDetectorTilt',
+)
+
+HEADER_DEFAULTS = {'RescaleIntercept': 0, 'RescaleSlope': 1}
+
+
+def plain_value(value):
+    """Convert a pydicom element value into a JSON-serializable Python value."""
+    if value is None:
+        return None
+    if isinstance(value, (pydicom.multival.MultiValue, list, tuple)):
+        return [plain_value(v) for v in value]
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, (bytes, pydicom.sequence.Sequence)):
+        return None
+    return str(value)
+
+
+def read_header(filepath):
+    """Read the catalog header fields of a DICOM file without decoding pixel data."""
+    try:
+        ds = pydicom.dcmread(filepath, stop_before_pixels=True)
+    except Exception as e:
+        logging.error(f"Error reading file {filepath}: {str(e)}")
+        return None
+
+    header = {
+        field: plain_value(ds.get(field, HEADER_DEFAULTS.get(field)))
+        for field in HEADER_FIELDS
+    }
+    header['filepath'] = filepath
+    return header
+
+
+def read_pixel_data(filepath):
+    """Decode the pixel array of a single DICOM file."""
+    return pydicom.dcmread(filepath).pixel_array
+
+
+def default_index_path(directory):
+    digest = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_ROOT, 'catalog', f"{digest}.json")
+
+
+def _load_index(index_path, directory):
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION or index.get('directory') != os.path.abspath(directory):
+        return {}
+    return index.get('entries', {})
+
+
+def _save_index(index_path, directory, entries):
+    index = {
+        'version': INDEX_VERSION,
+        'directory': os.path.abspath(directory),
+        'entries': entries,
+    }
+    tmp_path = f"{index_path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        logging.warning(f"Unable to write DICOM catalog index {index_path}: {str(e)}")
+
+
+def _iter_dicom_files(directory):
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith('.dcm'):
+                        yield entry
+        except OSError as e:
+            logging.warning(f"Unable to list {current}: {str(e)}")
+
+
+def directory_fingerprint(directory):
+    """Cheap SHA-1 of the path, size and mtime of every .dcm file below directory (no file is opened)."""
+    digest = hashlib.sha1(os.path.abspath(directory).encode('utf-8'))
+    records = []
+    for entry in _iter_dicom_files(directory):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        records.append(f"{entry.path}\0{st.st_size}\0{st.st_mtime_ns}\n")
+    for record in sorted(records):
+        digest.update(record.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def scan_directory(directory, index_path=None):
+    """
+    Return {filepath: header} for every .dcm file below directory.
+
+    Headers are read with stop_before_pixels and persisted in an index keyed on
+    path, size and mtime, so a rescan only opens new or changed files.
+    Unreadable files are remembered too and map to None.
+    """
+    if index_path is None:
+        index_path = default_index_path(directory)
+
+    cached = _load_index(index_path, directory)
+    entries = {}
+    headers = {}
+    changed = False
+    reread = 0
+
+    for entry in _iter_dicom_files(directory):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        filepath = entry.path
+        previous = cached.get(filepath)
+        if previous and previous['size'] == st.st_size and previous['mtime_ns'] == st.st_mtime_ns:
+            record = previous
+        else:
+            record = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'header': read_header(filepath)}
+            changed = True
+            reread += 1
+        entries[filepath] = record
+        headers[filepath] = record['header']
+
+    if changed or len(entries) != len(cached):
+        _save_index(index_path, directory, entries)
+
+    logging.info(f"Catalog scan of {directory}: {len(entries)} files, {reread} (re)read")
+    return headers
+
+
+def group_series(headers):
+    """Group catalog headers by SeriesInstanceUID, sorted by SliceLocation."""
+    slices = defaultdict(list)
+    for header in headers.values():
+        if header:
+            slices[header['SeriesInstanceUID']].append(header)
+
+    for series_uid in slices:
+        slices[series_uid].sort(key=lambda x: float(x['SliceLocation'] or 0))
+
+    return slices
+
+
+def slice_pixels(slice_data):
+    """Return a slice's pixel array, decoding it from disk if the catalog only holds its header."""
+    pixel_array = slice_data.get('PixelData')
+    if pixel_array is None:
+        pixel_array = read_pixel_data(slice_data['filepath'])
+    return pixel_array
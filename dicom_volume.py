@@ -0,0 +1,126 @@
+import numpy as np
+
+import dicom_catalog
+from intensity_stats import volume_stats
+
+
+def stored_dtype(slice_data):
+    """Numpy dtype of a slice's stored pixel values, from BitsAllocated/PixelRepresentation."""
+    bits = slice_data.get('BitsAllocated')
+    signed = slice_data.get('PixelRepresentation') == 1
+    if bits in (8, 16, 32):
+        return np.dtype(f"{'int' if signed else 'uint'}{bits}")
+    return dicom_catalog.slice_pixels(slice_data).dtype
+
+
+class DicomVolume:
+    """
+    A reconstructed series kept in the scanner's stored dtype.
+
+    `raw` is stored slice-major, shape (num_slices, rows, cols), so every slice is one
+    contiguous block. `slope` and `intercept` hold each slice's RescaleSlope/Intercept.
+    Indexing, `shape` and `np.asarray` use the (rows, cols, num_slices) axis order the
+    rest of the pipeline expects and return rescaled float32 values, computed only for
+    the part that is read. `stats` holds the IntensityStats gathered while the
+    slices were decoded, if any.
+    """
+
+    dtype = np.dtype(np.float32)
+    ndim = 3
+
+    def __init__(self, raw, slope=1, intercept=0, stats=None):
+        self.raw = raw
+        self.stats = stats
+        num_slices = raw.shape[0]
+        self.slope = np.broadcast_to(np.asarray(slope, dtype=np.float32), (num_slices,)).copy()
+        self.intercept = np.broadcast_to(np.asarray(intercept, dtype=np.float32), (num_slices,)).copy()
+
+    @classmethod
+    def empty(cls, slices, dtype=None):
+        """Allocate an undecoded volume for a sorted list of catalog slices."""
+        if dtype is None:
+            dtype = stored_dtype(slices[0])
+        raw = np.empty((len(slices), slices[0]['Rows'], slices[0]['Columns']), dtype=dtype)
+        slope = [float(s['RescaleSlope']) for s in slices]
+        intercept = [float(s['RescaleIntercept']) for s in slices]
+        return cls(raw, slope, intercept)
+
+    @property
+    def shape(self):
+        num_slices, rows, cols = self.raw.shape
+        return (rows, cols, num_slices)
+
+    @property
+    def size(self):
+        return self.raw.size
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _uniform_rescale(self):
+        return bool(np.all(self.slope == self.slope[0]) and np.all(self.intercept == self.intercept[0]))
+
+    def intensity_stats(self):
+        """IntensityStats of the rescaled values; computed in one pass over `raw` if none were collected."""
+        if self.stats is None:
+            self.stats = volume_stats(self)
+        return self.stats
+
+    def normalized(self):
+        """
+        The volume min-max normalized to [0, 1], without touching the voxels.
+
+        The normalization is folded into each slice's slope and intercept, so the
+        result shares `raw` and is applied lazily when it is read, like the rescale.
+        """
+        lo, hi = self.intensity_stats().bounds
+        scale = 1.0 / (hi - lo) if hi > lo else 0.0
+        slope = self.slope.astype(np.float64) * scale
+        intercept = (self.intercept.astype(np.float64) - lo) * scale
+        return DicomVolume(self.raw, slope, intercept)
+
+    def slice(self, index):
+        """Rescaled float32 axial slice `index`, shape (rows, cols)."""
+        out = self.raw[index].astype(np.float32)
+        out *= self.slope[index]
+        out += self.intercept[index]
+        return out
+
+    def __getitem__(self, key):
+        view = self.raw.transpose(1, 2, 0)[key]
+        out = np.array(view, dtype=np.float32)
+        if self._uniform_rescale():
+            slope, intercept = self.slope[0], self.intercept[0]
+        else:
+            per_slice = (1, 1, len(self.slope))
+            slope = np.broadcast_to(self.slope.reshape(per_slice), self.shape)[key]
+            intercept = np.broadcast_to(self.intercept.reshape(per_slice), self.shape)[key]
+        if np.ndim(out) == 0:
+            return np.float32(out * slope + intercept)
+        out *= slope
+        out += intercept
+        return out
+
+    def to_array(self, dtype=np.float32):
+        """Rescale the whole volume in one vectorized pass; the result is slice-major in memory."""
+        out = np.empty(self.raw.shape, dtype=dtype)
+        np.multiply(self.raw, self.slope.astype(dtype)[:, None, None], out=out)
+        out += self.intercept.astype(dtype)[:, None, None]
+        return out.transpose(1, 2, 0)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            dtype = np.float32
+        return self.to_array(dtype)
+
+
+def as_float_array(volume):
+    """View any volume as a float ndarray without upcasting float32 inputs to float64."""
+    array = np.asarray(volume)
+    if not np.issubdtype(array.dtype, np.floating):
+        array = array.astype(np.float32)
+    return array
@@ -1,91 +1,50 @@
-import pydicom
 import os
-import numpy as np
-from scipy.ndimage import zoom, sobel
-import matplotlib.pyplot as plt
 import logging
-from collections import defaultdict
+import dicom_catalog
+import slice_loader
+from dicom_volume import DicomVolume
+from intensity_stats import IntensityStats
+from volume_cache import default_cache
+import resampling
+import surface_normals
+import preview
+from pipeline import Pipeline
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def extract_dicom_info(filepath):
+def process_dicom_directory(directory, index_path=None):
+    """Group the .dcm files below directory by series using header-only reads.
+
+    Returned slices carry a 'filepath' instead of 'PixelData'; pixels are
+    decoded in reconstruct_3d_volume, only for the series being built.
+    """
+    headers = dicom_catalog.scan_directory(directory, index_path=index_path)
+    return dicom_catalog.group_series(headers)
+
+def reconstruct_3d_volume(slices, workers=None, executor='thread',
+                          max_inflight_bytes=slice_loader.DEFAULT_MAX_INFLIGHT_BYTES, cache=None):
+    # With a VolumeCache, a series seen before is memory-mapped instead of decoded again.
+    volume = None
+    if cache is not None:
+        cached = cache.load(slices)
+        if cached is not None:
+            return cached
+        volume = cache.allocate(slices)
+    staged = volume is not None
+    if not staged:
+        # Stored dtype, slice-major; RescaleSlope/Intercept are applied when the volume is read.
+        volume = DicomVolume.empty(slices)
+    
+    # Min/max/histogram are gathered per slice while decoding, for normalization without a rescan.
+    stats = IntensityStats(volume.raw.dtype)
     try:
-        ds = pydicom.dcmread(filepath)
-        
-        dicom_features = {
-            'SOPInstanceUID': ds.get('SOPInstanceUID', None),
-            'SeriesInstanceUID': ds.get('SeriesInstanceUID', None),
-            'StudyInstanceUID': ds.get('StudyInstanceUID', None),
-            'PatientID': ds.get('PatientID', None),
-            'Modality': ds.get('Modality', None),
-            
-            'ImagePositionPatient': ds.get('ImagePositionPatient', None),
-            'ImageOrientationPatient': ds.get('ImageOrientationPatient', None),
-            'SliceLocation': ds.get('SliceLocation', None),
-            'FrameOfReferenceUID': ds.get('FrameOfReferenceUID', None),
-            'PositionReferenceIndicator': ds.get('PositionReferenceIndicator', None),
-            
-            'PixelSpacing': ds.get('PixelSpacing', None),
-            'SliceThickness': ds.get('SliceThickness', None),
-            'SpacingBetweenSlices': ds.get('SpacingBetweenSlices', None),
-            'Rows': ds.get('Rows', None),
-            'Columns': ds.get('Columns', None),
-            'NumberOfFrames': ds.get('NumberOfFrames', None),
-            
-            'PixelData': ds.pixel_array,
-            'BitsAllocated': ds.get('BitsAllocated', None),
-            'BitsStored': ds.get('BitsStored', None),
-            'HighBit': ds.get('HighBit', None),
-            'PixelRepresentation': ds.get('PixelRepresentation', None),
-            'RescaleIntercept': ds.get('RescaleIntercept', 0),
-            'RescaleSlope': ds.get('RescaleSlope', 1),
-            'RescaleType': ds.get('RescaleType', None),
-            'WindowCenter': ds.get('WindowCenter', None),
-            'WindowWidth': ds.get('WindowWidth', None),
-            'PhotometricInterpretation': ds.get('PhotometricInterpretation', None),
-            
-            'InstanceNumber': ds.get('InstanceNumber', None),
-            'AcquisitionNumber': ds.get('AcquisitionNumber', None),
-            'PatientPosition': ds.get('PatientPosition', None),
-            'DerivationDescription': ds.get('DerivationDescription', None),
-            'TableHeight': ds.get('TableHeight', None),
-            'GantryDetectorTilt': ds.get('GantryDetectorTilt', None),
-        }
-        
-        return dicom_features
-    except Exception as e:
-        logging.error(f"Error reading file {filepath}: {str(e)}")
-        return None
-
-def process_dicom_directory(directory):
-
-    slices = defaultdict(list)
-    for root, _, files in os.walk(directory):
-        for filename in files:
-            if filename.endswith('.dcm'):
-                filepath = os.path.join(root, filename)
-                dicom_info = extract_dicom_info(filepath)
-                if dicom_info:
-                    series_uid = dicom_info['SeriesInstanceUID']
-                    slices[series_uid].append(dicom_info)
-    
-    for series_uid in slices:
-        slices[series_uid].sort(key=lambda x: float(x['SliceLocation'] or 0))
-    
-    return slices
-
-def reconstruct_3d_volume(slices):
-    rows = slices[0]['Rows']
-    cols = slices[0]['Columns']
-    num_slices = len(slices)
-    
-    volume = np.zeros((rows, cols, num_slices))
-    
-    for i, slice_data in enumerate(slices):
-        pixel_array = slice_data['PixelData']
-        rescale_slope = slice_data['RescaleSlope']
-        rescale_intercept = slice_data['RescaleIntercept']
-        volume[:,:,i] = pixel_array * rescale_slope + rescale_intercept
+        slice_loader.decode_series(slices, volume.raw, axis=0, workers=workers, executor=executor,
+                                   max_inflight_bytes=max_inflight_bytes, rescale=False, stats=stats)
+    except Exception:
+        if staged:
+            cache.discard(volume)
+        raise
+    volume.stats = stats
     
     pixel_spacing = slices[0]['PixelSpacing']
     slice_thickness = slices[0]['SliceThickness']
@@ -114,125 +73,179 @@ def reconstruct_3d_volume(slices):
         'GantryDetectorTilt': slices[0].get('GantryDetectorTilt'),
     }
     
+    if staged:
+        return cache.store(slices, volume, voxel_size, metadata)
+    
     return volume, voxel_size, metadata
 
-def resample_volume(volume, voxel_size, target_voxel_size=(1, 1, 1)):
-    zoom_factors = [old / new for old, new in zip(voxel_size, target_voxel_size)]
-    resampled_volume = zoom(volume, zoom_factors, order=1)
+def resample_volume(volume, voxel_size, target_voxel_size=None, workers=None):
+    """Resample to target_voxel_size (default: isotropic at the finest native spacing) as float32."""
+    resampled_volume = resampling.resample(volume, voxel_size, target_voxel_size, workers=workers)
     return resampled_volume
 
-def compute_surface_normals(volume):
-    """Compute surface normals using Sobel operator."""
-    dx = sobel(volume, axis=0)
-    dy = sobel(volume, axis=1)
-    dz = sobel(volume, axis=2)
-    magnitude = np.sqrt(dx**2 + dy**2 + dz**2)
-    magnitude[magnitude == 0] = 1
-    normals = np.stack((dx/magnitude, dy/magnitude, dz/magnitude), axis=-1)
-    return normals
-
-def visualize_3d_volume(volume, metadata, normals=None):
-    fig, axes = plt.subplots(1, 3, figsize=(15, 5))
-    
-    window_center = metadata['WindowCenter']
-    window_width = metadata['WindowWidth']
-    if isinstance(window_center, pydicom.multival.MultiValue):
-        window_center = window_center[0]
-    if isinstance(window_width, pydicom.multival.MultiValue):
-        window_width = window_width[0]
-    
-    vmin = window_center - window_width // 2
-    vmax = window_center + window_width // 2
-    
-    axes[0].imshow(volume[:, :, volume.shape[2] // 2], cmap='gray', vmin=vmin, vmax=vmax)
-    axes[0].set_title('Axial')
-
-    axes[1].imshow(volume[:, volume.shape[1] // 2, :], cmap='gray', vmin=vmin, vmax=vmax)
-    axes[1].set_title('Coronal')
-
-    axes[2].imshow(volume[volume.shape[0] // 2, :, :], cmap='gray', vmin=vmin, vmax=vmax)
-    axes[2].set_title('Sagittal')
-    
-    plt.tight_layout()
-    
-    fig, ax = plt.subplots()
-    ax.imshow(volume[:, :, volume.shape[2] // 2], cmap='gray', vmin=vmin, vmax=vmax)
-    ax.axis('off')  
-    ax.set_title("Axial View")
-    fig.subplots_adjust(left=0, right=1, top=1, bottom=0)  
-    fig.savefig("axial.png", bbox_inches='tight', pad_inches=0.2)  
-
-    fig, ax = plt.subplots()
-    ax.imshow(volume[:, volume.shape[1] // 2, :], cmap='gray', vmin=vmin, vmax=vmax)
-    ax.axis('off')  
-    ax.set_title("Coronal View")
-    fig.subplots_adjust(left=0, right=1, top=1, bottom=0)  
-    fig.savefig("coronal.png", bbox_inches='tight', pad_inches=0.2)  
-
-    fig, ax = plt.subplots()
-    ax.imshow(volume[volume.shape[0] // 2, :, :], cmap='gray', vmin=vmin, vmax=vmax)
-    ax.axis('off')
-    ax.set_title("Sagittal View")
-    fig.subplots_adjust(left=0, right=1, top=1, bottom=0)  
-    fig.savefig("sagittal.png", bbox_inches='tight', pad_inches=0.2)  
-
-    plt.close('all')  
-
-    if normals is not None:
-        plt.figure(figsize=(10, 10))
-        plt.quiver(normals[:, :, volume.shape[2]//2, 0], normals[:, :, volume.shape[2]//2, 1], 
-                   normals[:, :, volume.shape[2]//2, 2], color='red')
-        plt.title("Surface Normals (Axial View)", fontsize=20)
-        
-        plt.subplots_adjust(left=0, right=1, top=1, bottom=0)  
+def resample_series(slices, volume, voxel_size, target_voxel_size=None, cache=None):
+    """resample_volume, reusing the resampled copy kept in the volume cache if there is one."""
+    target_voxel_size = resampling.resolve_target_spacing(voxel_size, target_voxel_size)
+    if cache is not None:
+        resampled_volume = cache.load_resampled(slices, target_voxel_size)
+        if resampled_volume is not None:
+            return resampled_volume
+    resampled_volume = resample_volume(volume, voxel_size, target_voxel_size)
+    if cache is not None:
+        resampled_volume = cache.store_resampled(slices, target_voxel_size, resampled_volume)
+    return resampled_volume
 
-        plt.savefig("surface_normals_axial.png", bbox_inches='tight')
-        plt.close('all')
+def compute_surface_normals(volume):
+    """Compute surface normals using Sobel operator.
+
+    This materializes the full (X, Y, Z, 3) field; surface_normals has per-slice,
+    ROI and boundary-only variants for when only part of it is needed.
+    """
+    return surface_normals.sobel_normals(volume)
+
+def visualize_3d_volume(volume, metadata, normals=None, window=None):
+    """Write axial.png, coronal.png, sagittal.png (and surface_normals_axial.png) and return the images.
+
+    Rendering goes through preview.render_previews: a window-level LUT straight to
+    uint8 and a decimated normals glyph view instead of per-pixel quiver arrows.
+    """
+    images = preview.render_previews(volume, metadata, normals, window)
+    preview.save_previews(images)
+    return images
         
-def main(dicom_directory):
+def build_pipeline(cache=None):
+    """
+    Declare the load -> reconstruct -> resample -> views/normals -> previews stages.
+
+    Run stages with pipeline.run(name, directory=..., series_uid=..., ...). The
+    directory is keyed on its file listing (path, size, mtime), so re-running with
+    e.g. a new target_voxel_size or window only recomputes the stages after it.
+    """
+    pipeline = Pipeline(cache_dir=os.path.join(dicom_catalog.CACHE_ROOT, 'pipeline'), max_entries=16)
+    pipeline.source('directory', fingerprint=dicom_catalog.directory_fingerprint)
+
+    @pipeline.stage('series', inputs=('directory',))
+    def series(directory):
+        return process_dicom_directory(directory)
+
+    @pipeline.stage('slices', inputs=('series',), params={'series_uid': None})
+    def series_slices(series, series_uid):
+        return series[series_uid]
+
+    @pipeline.stage('volume', inputs=('slices',))
+    def volume(slices):
+        return reconstruct_3d_volume(slices, cache=cache)
+
+    @pipeline.stage('resampled', inputs=('slices', 'volume'), params={'target_voxel_size': None})
+    def resampled(slices, volume, target_voxel_size):
+        return resample_series(slices, volume[0], volume[1], target_voxel_size, cache=cache)
+
+    @pipeline.stage('normals', inputs=('resampled',), persist=True)
+    def normals(resampled):
+        # Only the axial slice that gets plotted; the full field is never built.
+        return surface_normals.normals_for_slice(resampled, resampled.shape[2] // 2)
+
+    @pipeline.stage('views', inputs=('resampled', 'volume'), params={'window': None})
+    def views(resampled, volume, window):
+        return preview.render_views(resampled, volume[2], window)
+
+    @pipeline.stage('previews', inputs=('views', 'normals'))
+    def previews(views, normals):
+        images = dict(views)
+        images[preview.NORMALS_VIEW] = preview.render_normals(normals, views['axial'])
+        return images
+
+    return pipeline
+
+_pipelines = {}
+
+def get_pipeline(use_cache=True):
+    """The module's shared pipeline, so repeated main() calls (e.g. from the GUI) reuse its memo."""
+    if use_cache not in _pipelines:
+        _pipelines[use_cache] = build_pipeline(default_cache() if use_cache else None)
+    return _pipelines[use_cache]
+
+def iter_features(dicom_directory, use_cache=True, target_voxel_size=None, window=None, callback=None):
+    """
+    Run the pipeline on every series in dicom_directory, yielding results as they are ready.
+
+    For each series yields ('features', table) once the volume is resampled,
+    ('volume', series_uid, (volume, voxel_size, metadata)) for browsing its
+    slices, then ('preview', name, PIL image) for the axial, coronal and sagittal
+    views and finally the surface normals view. `callback(stage, status)` is passed to
+    Pipeline.run, so it sees every stage start; raising from it stops the run.
+    Yields nothing without DICOM files. Nothing is written to disk.
+    """
+    pipeline = get_pipeline(use_cache)
 
     logging.info("Processing DICOM files...")
-    series_slices = process_dicom_directory(dicom_directory)
+    # The folder is fingerprinted once here rather than on every run below
+    keys = pipeline.source_keys(directory=dicom_directory)
+    series_slices = pipeline.run('series', callback, keys, directory=dicom_directory)
     
     if not series_slices:
         logging.warning("No valid DICOM files found.")
-    else:
-        result = {}
-        logging.info(f"Processed {len(series_slices)} series.")
-        
-        for series_uid, slices in series_slices.items():
-            logging.info(f"\nProcessing series {series_uid}")
-            logging.info(f"Number of slices: {len(slices)}")
-            
-            logging.info("Reconstructing 3D volume...")
-            volume, voxel_size, metadata = reconstruct_3d_volume(slices)
-            logging.info(f"Volume shape: {volume.shape}")
-            logging.info(f"Voxel size: {voxel_size}")
-            
-            logging.info("Resampling volume...")
-            resampled_volume = resample_volume(volume, voxel_size)
-            logging.info(f"Resampled volume shape: {resampled_volume.shape}")
-            
-            logging.info("Computing surface normals...")
-            normals = compute_surface_normals(resampled_volume)
-            
-            logging.info("Visualizing volume and normals...")
-            visualize_3d_volume(resampled_volume, metadata, normals)
-            
-            result["Number of slices"] = len(slices)
-            result["Volume shape"] = volume.shape
-            result["Voxel size"] = voxel_size
-            result["Resampled volume shape"] = resampled_volume.shape
-            
-            logging.info("All Extracted DICOM Features:")
-            for key, value in metadata.items():
-                result[str(key)] = value
-                logging.info(f"{key}: {value}")
-    
-        #print(result)
-        return result
+        return
+
+    result = {}
+    logging.info(f"Processed {len(series_slices)} series.")
     
-    return None
+    for series_uid, slices in series_slices.items():
+        logging.info(f"\nProcessing series {series_uid}")
+        logging.info(f"Number of slices: {len(slices)}")
+        values = {'directory': dicom_directory, 'series_uid': series_uid,
+                  'target_voxel_size': target_voxel_size, 'window': window}
+        
+        logging.info("Reconstructing 3D volume...")
+        volume, voxel_size, metadata = pipeline.run('volume', callback, keys, **values)
+        logging.info(f"Volume shape: {volume.shape}")
+        logging.info(f"Voxel size: {voxel_size}")
+        
+        logging.info("Resampling volume...")
+        resampled_volume = pipeline.run('resampled', callback, keys, **values)
+        logging.info(f"Resampled volume shape: {resampled_volume.shape}")
+        
+        result["Number of slices"] = len(slices)
+        result["Volume shape"] = volume.shape
+        result["Voxel size"] = voxel_size
+        result["Resampled volume shape"] = resampled_volume.shape
+        
+        logging.info("All Extracted DICOM Features:")
+        for key, value in metadata.items():
+            result[str(key)] = value
+            logging.info(f"{key}: {value}")
+        yield 'features', dict(result)
+        yield 'volume', series_uid, (volume, voxel_size, metadata)
+
+        logging.info("Rendering previews...")
+        for name, image in pipeline.run('views', callback, keys, **values).items():
+            yield 'preview', name, image
+
+        logging.info("Computing surface normals...")
+        previews = pipeline.run('previews', callback, keys, **values)
+        yield 'preview', preview.NORMALS_VIEW, previews[preview.NORMALS_VIEW]
+
+def extract_features(dicom_directory, use_cache=True, target_voxel_size=None, window=None):
+    """
+    iter_features run to completion.
+
+    Returns (result, previews): the feature table of the last series and its
+    preview images as {name: PIL image}, or (None, None) without DICOM files.
+    """
+    result, previews = None, None
+    for event in iter_features(dicom_directory, use_cache, target_voxel_size, window):
+        if event[0] == 'features':
+            result, previews = event[1], {}
+        elif event[0] == 'preview':
+            previews[event[1]] = event[2]
+    return result, previews
+
+def main(dicom_directory, use_cache=True, target_voxel_size=None, window=None):
+    """extract_features, also writing the previews as axial.png, coronal.png, ... in the working directory."""
+    result, previews = extract_features(dicom_directory, use_cache, target_voxel_size, window)
+    if previews is not None:
+        preview.save_previews(previews)
+    return result
 
 if __name__ == "__main__":
     main('Data/raw')
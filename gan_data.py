@@ -0,0 +1,135 @@
+import os
+import hashlib
+import logging
+
+import numpy as np
+import tensorflow as tf
+
+import dicom_catalog
+
+IMAGE_SIZE = (128, 128)
+CACHE_VERSION = 1
+# Preprocessed slices live next to the other caches, one .npy per folder and image size.
+CACHE_DIR = os.path.join(dicom_catalog.CACHE_ROOT, 'gan')
+
+
+def list_dicom_files(dicom_dir):
+    """The .dcm files directly inside dicom_dir, sorted (the set load_dicom_images read)."""
+    return sorted(
+        os.path.join(dicom_dir, filename)
+        for filename in os.listdir(dicom_dir)
+        if filename.endswith(".dcm")
+    )
+
+
+def _cache_path(files, image_size):
+    # Keyed on every file's path, size and mtime, so adding or editing a slice rebuilds the cache.
+    digest = hashlib.sha1(f"{CACHE_VERSION}\0{image_size[0]}x{image_size[1]}\n".encode('utf-8'))
+    for filepath in files:
+        st = os.stat(filepath)
+        digest.update(f"{os.path.abspath(filepath)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+    return os.path.join(CACHE_DIR, f"{digest.hexdigest()}.npy")
+
+
+def _read_pixels(filepath):
+    return dicom_catalog.read_pixel_data(filepath.decode('utf-8')).astype(np.float32)
+
+
+def decode_image(filepath, image_size=IMAGE_SIZE):
+    """
+    One DICOM file as a (height, width, 1) float32 image in [0, 1].
+
+    pydicom decodes outside the graph; the bilinear resize and the per-image
+    min-max normalization run as TensorFlow ops. A constant image maps to 0.
+    """
+    image = tf.numpy_function(_read_pixels, [filepath], tf.float32)
+    image.set_shape([None, None])
+    image = tf.image.resize(image[..., tf.newaxis], image_size, method='bilinear')
+    low, high = tf.reduce_min(image), tf.reduce_max(image)
+    return tf.math.divide_no_nan(image - low, high - low)
+
+
+def decode_dataset(files, image_size=IMAGE_SIZE, deterministic=True):
+    """tf.data.Dataset of decode_image over `files`, decoded and resized on parallel calls."""
+    return tf.data.Dataset.from_tensor_slices(list(files)).map(
+        lambda filepath: decode_image(filepath, image_size),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=deterministic,
+    )
+
+
+def cached_images(dicom_dir, image_size=IMAGE_SIZE):
+    """
+    Every slice of dicom_dir preprocessed once to (n, height, width, 1) float32, memory-mapped.
+
+    The first call decodes the folder through decode_dataset and writes the
+    result to the cache; later calls only open it, so the dataset never has to
+    fit in RAM. Returns None if the cache cannot be written.
+    """
+    files = list_dicom_files(dicom_dir)
+    path = _cache_path(files, image_size)
+    try:
+        return np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        pass
+
+    tmp_path = f"{path}.tmp.npy"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        images = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                           shape=(len(files),) + tuple(image_size) + (1,))
+        for i, image in enumerate(decode_dataset(files, image_size).prefetch(tf.data.AUTOTUNE).as_numpy_iterator()):
+            images[i] = image
+        images.flush()
+        del images
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Unable to cache GAN training images in {CACHE_DIR}: {str(e)}")
+        return None
+    logging.info(f"Cached {len(files)} preprocessed images in {path}")
+    return np.load(path, mmap_mode='r')
+
+
+def make_dataset(dicom_dir, image_size=IMAGE_SIZE, batch_size=32, shuffle_buffer=None,
+                 use_cache=True, repeat=True, seed=None):
+    """
+    Shuffled batches of (batch_size, height, width, 1) real images for GAN training.
+
+    With use_cache the images come from cached_images: slice indices are
+    shuffled (shuffle_buffer defaults to all of them, which costs 8 bytes per
+    slice) and each batch is read from the memory-mapped cache on a parallel map
+    call. Without it, or if the cache cannot be written, file paths are shuffled
+    and every step decodes its files again through decode_dataset. Either way
+    batches are prefetched, so the next batch is ready while the current one trains.
+    """
+    images = cached_images(dicom_dir, image_size) if use_cache else None
+
+    if images is not None:
+        count = len(images)
+        dataset = tf.data.Dataset.range(count).shuffle(shuffle_buffer or count, seed=seed)
+        if repeat:
+            dataset = dataset.repeat()
+
+        def read_batch(indices):
+            # Sorted reads walk the memory-mapped file forwards
+            return images[np.sort(indices)]
+
+        dataset = dataset.batch(batch_size, drop_remainder=True).map(
+            lambda indices: tf.ensure_shape(
+                tf.numpy_function(read_batch, [indices], tf.float32),
+                (batch_size,) + tuple(image_size) + (1,)),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=False,
+        )
+    else:
+        files = list_dicom_files(dicom_dir)
+        dataset = tf.data.Dataset.from_tensor_slices(files).shuffle(shuffle_buffer or len(files), seed=seed)
+        if repeat:
+            dataset = dataset.repeat()
+        dataset = dataset.map(
+            lambda filepath: decode_image(filepath, image_size),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=False,
+        ).batch(batch_size, drop_remainder=True)
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,140 @@
+import threading
+
+import numpy as np
+
+# Distinct (RescaleSlope, RescaleIntercept) pairs with their own histogram; a series
+# rescaled per slice beyond this keeps only its bounds (a histogram is 512 KB at 16 bits).
+MAX_RESCALE_HISTOGRAMS = 4
+
+
+def _exact(dtype):
+    return dtype.kind in 'iu' and dtype.itemsize <= 2
+
+
+def summarize_slice(pixel_array):
+    """
+    Per-slice summary: (first_index, counts, minimum, maximum, size) of the stored values.
+
+    For 8/16-bit integers `counts` is the histogram of the stored bits read as
+    unsigned, trimmed to its occupied range starting at first_index; for other
+    dtypes it is None and only the extremes are kept. Cheap to pickle, so process
+    workers can return it alongside the slice they decoded.
+    """
+    pixel_array = np.asarray(pixel_array)
+    if not _exact(pixel_array.dtype):
+        return None, None, float(pixel_array.min()), float(pixel_array.max()), pixel_array.size
+    index = pixel_array.view(f"uint{pixel_array.dtype.itemsize * 8}").ravel()
+    counts = np.bincount(index, minlength=1 << (pixel_array.dtype.itemsize * 8))
+    occupied = np.flatnonzero(counts)
+    first, last = int(occupied[0]), int(occupied[-1])
+    return first, counts[first:last + 1], float(pixel_array.min()), float(pixel_array.max()), pixel_array.size
+
+
+class IntensityStats:
+    """
+    Running statistics of a series' rescaled intensities, fed one slice at a time.
+
+    Keeps the rescaled minimum and maximum and, for 8/16-bit stored data, one exact
+    histogram of stored values per (RescaleSlope, RescaleIntercept) pair, from
+    which histograms and percentiles of the rescaled values follow without another
+    pass over the volume. Past MAX_RESCALE_HISTOGRAMS distinct rescales the
+    histograms are dropped and only the bounds are kept. merge() is thread-safe.
+    """
+
+    def __init__(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.exact = _exact(self.dtype)
+        self.histograms = {}
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def merge(self, summary, slope=1.0, intercept=0.0):
+        first, counts, lo, hi, size = summary
+        slope, intercept = float(slope), float(intercept)
+        ends = (lo * slope + intercept, hi * slope + intercept)
+        with self._lock:
+            self.minimum = min(self.minimum, *ends)
+            self.maximum = max(self.maximum, *ends)
+            self.count += size
+            if counts is not None and self.exact:
+                key = (slope, intercept)
+                if key not in self.histograms and len(self.histograms) >= MAX_RESCALE_HISTOGRAMS:
+                    self.exact = False
+                    self.histograms.clear()
+                    return
+                if key not in self.histograms:
+                    self.histograms[key] = np.zeros(1 << (self.dtype.itemsize * 8), dtype=np.int64)
+                self.histograms[key][first:first + len(counts)] += counts
+
+    def update(self, pixel_array, slope=1.0, intercept=0.0):
+        self.merge(summarize_slice(pixel_array), slope, intercept)
+
+    @property
+    def bounds(self):
+        return self.minimum, self.maximum
+
+    def values(self):
+        """(rescaled values ascending, voxel counts) over every occupied stored value."""
+        if not self.histograms:
+            raise ValueError("No histogram: the stored dtype is not an 8/16-bit integer, "
+                             "or the series has more than MAX_RESCALE_HISTOGRAMS rescales")
+        stored = np.arange(1 << (self.dtype.itemsize * 8), dtype=f"uint{self.dtype.itemsize * 8}").view(self.dtype)
+        values, counts = [], []
+        for (slope, intercept), histogram in self.histograms.items():
+            occupied = np.flatnonzero(histogram)
+            values.append(stored[occupied].astype(np.float64) * slope + intercept)
+            counts.append(histogram[occupied])
+        values, counts = np.concatenate(values), np.concatenate(counts)
+        order = np.argsort(values, kind='stable')
+        return values[order], counts[order]
+
+    def percentile(self, q):
+        """Exact percentile(s) of the rescaled values (lower value at ties, like method='lower')."""
+        values, counts = self.values()
+        cumulative = np.cumsum(counts)
+        ranks = np.floor(np.asarray(q, dtype=np.float64) / 100 * (cumulative[-1] - 1))
+        return values[np.searchsorted(cumulative, ranks, side='right')]
+
+    def histogram(self, bins=256, range=None):
+        """np.histogram of the rescaled values, computed from the stored-value histograms."""
+        values, counts = self.values()
+        return np.histogram(values, bins=bins, range=range or self.bounds, weights=counts)
+
+    def to_arrays(self):
+        """Flat arrays for np.savez."""
+        keys = np.array(list(self.histograms), dtype=np.float64).reshape(-1, 2)
+        histograms = np.array(list(self.histograms.values()), dtype=np.int64)
+        return {
+            'dtype': np.array(self.dtype.str),
+            'bounds': np.array([self.minimum, self.maximum, self.count], dtype=np.float64),
+            'keys': keys,
+            'histograms': histograms,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        stats = cls(str(arrays['dtype']))
+        stats.minimum, stats.maximum, count = arrays['bounds']
+        stats.count = int(count)
+        for (slope, intercept), histogram in zip(arrays['keys'], arrays['histograms']):
+            stats.histograms[(float(slope), float(intercept))] = np.asarray(histogram)
+        return stats
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls.from_arrays(arrays)
+
+
+def volume_stats(volume):
+    """IntensityStats of a DicomVolume in one pass over its stored slices (when none were collected)."""
+    stats = IntensityStats(volume.raw.dtype)
+    for i in range(volume.raw.shape[0]):
+        stats.update(volume.raw[i], volume.slope[i], volume.intercept[i])
+    return stats
@@ -0,0 +1,124 @@
+import queue
+import logging
+import threading
+
+# Milliseconds between checks of the event queue from the Tk loop.
+DEFAULT_POLL_INTERVAL = 50
+
+
+class Cancelled(Exception):
+    """Raised inside a job's worker thread once the job has been cancelled."""
+
+
+class Job:
+    """
+    One background run of a generator function.
+
+    `func(job)` runs on a worker thread and yields events; each one is handed to
+    the runner's on_event callback on the Tk thread. Long steps inside `func`
+    should call job.check() (or pass job.progress as a Pipeline callback) so a
+    cancel takes effect at the next step boundary.
+    """
+
+    def __init__(self, runner, func):
+        self.runner = runner
+        self.func = func
+        self._cancel = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Ask the worker to stop; events it posts from now on are dropped."""
+        self._cancel.set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def progress(self, stage, status):
+        """Pipeline callback: posts (stage, status) to the UI and stops a cancelled job before the next stage."""
+        self.check()
+        self.runner._post(self, 'progress', (stage, status))
+
+    def _run(self):
+        try:
+            for event in self.func(self):
+                self.check()
+                self.runner._post(self, 'event', event)
+        except Cancelled:
+            self.runner._post(self, 'cancelled', None)
+        except Exception as e:
+            logging.exception("Background job failed")
+            self.runner._post(self, 'error', e)
+        else:
+            self.runner._post(self, 'cancelled' if self.cancelled else 'done', None)
+
+
+class JobRunner:
+    """
+    Runs jobs on worker threads and delivers their events on the Tk main loop.
+
+    Workers never touch Tk: they put (job, kind, payload) on a queue that the
+    runner drains with root.after every poll_interval ms while jobs are active,
+    calling the callbacks given to submit() from the Tk thread.
+    """
+
+    def __init__(self, root, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._events = queue.Queue()
+        self._callbacks = {}
+        self._polling = False
+
+    def submit(self, func, on_event=None, on_progress=None, on_done=None, on_error=None, on_cancel=None):
+        """Start `func(job)` on a worker thread and return its Job."""
+        job = Job(self, func)
+        self._callbacks[job] = {'event': on_event, 'progress': on_progress, 'done': on_done,
+                                'error': on_error, 'cancelled': on_cancel}
+        job.thread.start()
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_interval, self._poll)
+        return job
+
+    def cancel_all(self):
+        for job in list(self._callbacks):
+            job.cancel()
+
+    def _post(self, job, kind, payload):
+        self._events.put((job, kind, payload))
+
+    def _poll(self):
+        while True:
+            try:
+                job, kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+            callbacks = self._callbacks.get(job)
+            if callbacks is None:
+                continue
+            finished = kind in ('done', 'error', 'cancelled')
+            if finished:
+                del self._callbacks[job]
+                if kind == 'done' and job.cancelled:
+                    # Cancelled after its last step: its later events were dropped, so it did not complete
+                    kind = 'cancelled'
+            elif job.cancelled:
+                continue
+            callback = callbacks[kind]
+            if callback is None:
+                continue
+            if kind in ('event', 'error'):
+                callback(payload)
+            elif kind == 'progress':
+                callback(*payload)
+            else:
+                callback()
+
+        if self._callbacks:
+            self.root.after(self.poll_interval, self._poll)
+        else:
+            self._polling = False
@@ -0,0 +1,70 @@
+import numpy as np
+from sklearn.cluster import KMeans
+
+DEFAULT_BINS = 4096
+
+# Values are binned this many at a time so the bin-index array stays small.
+CHUNK_SIZE = 1 << 22
+
+
+def _chunks(flat):
+    for start in range(0, flat.size, CHUNK_SIZE):
+        yield flat[start:start + CHUNK_SIZE]
+
+
+def histogram_stats(values, bins=DEFAULT_BINS):
+    """
+    Per-bin count and sum of `values` over `bins` equal-width bins.
+
+    Sums are of the actual values, not bin centres, so each bin is represented by
+    the exact mean of its values. Returns (counts, sums, edges).
+    """
+    flat = np.asarray(values).ravel()
+    lo = min(float(chunk.min()) for chunk in _chunks(flat))
+    hi = max(float(chunk.max()) for chunk in _chunks(flat))
+    edges = np.linspace(lo, hi, bins + 1)
+    scale = bins / (hi - lo) if hi > lo else 0.0
+
+    counts = np.zeros(bins, dtype=np.int64)
+    sums = np.zeros(bins, dtype=np.float64)
+    for chunk in _chunks(flat):
+        chunk = chunk.astype(np.float64)
+        index = np.minimum(((chunk - lo) * scale).astype(np.intp), bins - 1)
+        counts += np.bincount(index, minlength=bins)
+        sums += np.bincount(index, weights=chunk, minlength=bins)
+    return counts, sums, edges
+
+
+def histogram_kmeans(values, n_clusters=3, bins=DEFAULT_BINS, random_state=0):
+    """
+    sklearn KMeans (k-means++ seeding, Lloyd iterations) of `values`, run on their histogram.
+
+    Each occupied bin becomes one point at the mean of its values, weighted by its
+    count, so the fit sees the same distribution as a fit on every voxel, to within
+    one bin, at the cost of `bins` points. Like any Lloyd run this converges to the
+    local optimum its seeds lead to, which is what level_1 has always segmented
+    with, not necessarily the minimum-variance split.
+
+    Returns (centroids, thresholds): ascending cluster means and the n_clusters - 1
+    decision boundaries between them (midpoints, where nearest-centroid assignment
+    switches). Fewer clusters come back only if the data occupies fewer bins than
+    n_clusters.
+    """
+    counts, sums, _ = histogram_stats(values, bins)
+    occupied = counts > 0
+    counts, means = counts[occupied], sums[occupied] / counts[occupied]
+    n_clusters = min(n_clusters, len(counts))
+
+    kmeans = KMeans(n_clusters=n_clusters, random_state=random_state)
+    kmeans.fit(means.reshape(-1, 1), sample_weight=counts)
+    centroids = np.sort(kmeans.cluster_centers_.ravel())
+    thresholds = (centroids[:-1] + centroids[1:]) / 2
+    return centroids, thresholds
+
+
+def assign_labels(volume, thresholds):
+    """Cluster index of every voxel (0 = lowest centroid) in one vectorized pass."""
+    labels = np.zeros(np.shape(volume), dtype=np.uint8)
+    for threshold in thresholds:
+        labels += np.asarray(volume) > threshold
+    return labels
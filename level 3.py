@@ -1,147 +1,314 @@
 import vtk
 import numpy as np
-from skimage import filters, morphology
-from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 import os
+import sys
+import json
+import time
+import argparse
+import logging
 import matplotlib.pyplot as plt
 
-# Load DICOM images
-reader = vtk.vtkDICOMImageReader()
-reader.SetDirectoryName(r'D:\\downloads\\GUI Code\\CAPSTONE\\DIcom gans\\Data\\raw')  # Update with your DICOM folder path
-reader.Update()
-
-# Extract image data
-imageData = reader.GetOutput()
-extent = imageData.GetExtent()
-spacing = imageData.GetSpacing()
-dimensions = (extent[1] - extent[0] + 1, extent[3] - extent[2] + 1, extent[5] - extent[4] + 1)
-
-# Convert image data to NumPy array
-voxelData = vtk_to_numpy(imageData.GetPointData().GetScalars())
-voxelData = voxelData.reshape(dimensions, order='F')
-
-# Normalize voxel data
-voxelData = (voxelData - np.min(voxelData)) / (np.max(voxelData) - np.min(voxelData))
-
-# Apply intensity thresholding to isolate teeth (adjust thresholds)
-low_threshold = 0.4  # Adjust based on intensity distribution for teeth
-high_threshold = 0.8  # Adjust for the upper bound
-teeth_mask = np.logical_and(voxelData > low_threshold, voxelData < high_threshold)
-
-# Apply Gaussian smoothing to refine mask
-smoothed_mask = filters.gaussian(teeth_mask, sigma=2.0) > 0.5  # Increase sigma for smoother transitions
-
-# Apply morphological closing to fill small holes
-refined_mask = morphology.binary_closing(smoothed_mask, morphology.ball(3))  # Increase size of structuring element
-
-# Further morphological operations for refinement
-refined_mask = morphology.binary_dilation(refined_mask, morphology.ball(1))  # Dilation to preserve structures
-
-# Convert refined mask back to VTK
-segmentedArray = refined_mask.astype(np.uint8)
-segmentedVTKData = numpy_to_vtk(segmentedArray.ravel(order='F'), deep=True)
-segmentedImageData = vtk.vtkImageData()
-segmentedImageData.SetDimensions(dimensions)
-segmentedImageData.SetSpacing(spacing)
-segmentedImageData.GetPointData().SetScalars(segmentedVTKData)
-
-# PSNR Calculation
-def calculate_psnr(original, reconstructed):
-    # Ensure the images are the same size
-    assert original.shape == reconstructed.shape, "Original and reconstructed images must have the same dimensions"
-    
-    # Compute Mean Squared Error (MSE)
-    mse = np.mean((original - reconstructed) ** 2)
-    if mse == 0:
-        return float('inf')  # No noise, perfect reconstruction
-    
-    # Compute PSNR
-    max_pixel = 1.0  # Since the images are normalized between 0 and 1
-    psnr_value = 10 * np.log10((max_pixel ** 2) / mse)
-    return psnr_value
+from featureExtraction import process_dicom_directory, reconstruct_3d_volume
+from volume_cache import default_cache
+import mask_morphology
+import metrics
+import roi
+import smoothing
+import surface_mesh
+import vtk_bridge
+
+# Default batch-mode views as 'name:azimuth:elevation' (degrees from the default camera)
+DEFAULT_VIEWS = ("front:0:0", "left:90:0", "back:180:0", "right:270:0", "top:0:60")
+
+
+def load_volume(dicom_directory, normalize=False):
+    """
+    Load the largest series in dicom_directory on VTK's (x, y, z) = (column, row, slice) grid.
+    Decoded once, then memory-mapped from the shared volume cache.
+    With normalize=True the voxels come out in [0, 1], normalized from the decode-time
+    intensity stats while they are rescaled, with no extra pass.
+    Returns (voxelData, spacing).
+    """
+    series_slices = process_dicom_directory(dicom_directory)
+    slices = max(series_slices.values(), key=len)
+    volume, voxel_size, _ = reconstruct_3d_volume(slices, cache=default_cache())
+    if normalize:
+        volume = volume.normalized()
+
+    voxelData = np.asarray(volume).transpose(1, 0, 2)
+    spacing = (voxel_size[1], voxel_size[0], voxel_size[2])
+    return voxelData, spacing
+
+
+# Normalize voxel data (pass out=voxelData to normalize a float array in place)
+def normalize_volume(voxelData, out=None):
+    if out is None:
+        out = np.empty(voxelData.shape, dtype=np.float32)
+    return smoothing.normalize_inplace(voxelData, out=out)
+
+
+def segment_teeth(voxelData, low_threshold=0.4, high_threshold=0.8, sigma=2.0):
+    """Threshold -> Gaussian smoothing -> closing -> dilation on normalized voxel data."""
+    # Apply intensity thresholding to isolate teeth (adjust thresholds)
+    teeth_mask = smoothing.band_mask(voxelData, low_threshold, high_threshold)
+
+    # Apply Gaussian smoothing to refine mask (float32, slab by slab; the smoothed field is never kept)
+    smoothed_mask = smoothing.smooth_threshold(teeth_mask, sigma, 0.5)  # Increase sigma for smoother transitions
+
+    # Apply morphological closing to fill small holes (same result as skimage's binary_closing(ball(3)))
+    refined_mask = mask_morphology.binary_closing(mask_morphology.PackedMask.pack(smoothed_mask), 3)  # Increase radius of the ball
+
+    # Further morphological operations for refinement
+    refined_mask = mask_morphology.binary_dilation(refined_mask, 1)  # Dilation to preserve structures
+    return refined_mask.unpack()
+
+
+def segment_teeth_roi(voxelData, low_threshold=0.4, high_threshold=0.8, sigma=2.0, factor=roi.DEFAULT_FACTOR, margin=None):
+    """
+    segment_teeth on normalized voxel data, run only inside the box where the
+    threshold band shows up on a factor-times downsampled proxy.
+    Returns (refined_mask, metadata) with metadata['roi'] the crop box.
+    """
+    if margin is None:
+        # Reach of the Gaussian (truncated at 4 sigma), the closing of radius 3 and the dilation of radius 1
+        margin = roi.filter_margin([np.ceil(4 * sigma), 2 * 3, 1], factor)
+    return roi.coarse_to_fine(
+        voxelData,
+        detect=lambda proxy: np.logical_and(proxy > low_threshold, proxy < high_threshold),
+        segment=lambda crop: segment_teeth(crop, low_threshold, high_threshold, sigma),
+        factor=factor,
+        margin=margin,
+    )
+
+
+# Convert refined mask back to VTK (the boolean mask is shared as uint8, copied at most once into VTK order)
+def mask_to_vtk(refined_mask, spacing):
+    return vtk_bridge.to_image_data(refined_mask, spacing)
+
 
 # Compute PSNR for the whole dataset
-psnr_values = []
-for i in range(dimensions[2]):  # Iterate over slices (z-axis)
-    original_slice = voxelData[:, :, i]
-    reconstructed_slice = refined_mask[:, :, i].astype(np.float32)  # Ensure the mask is float for PSNR calculation
-    psnr_value = calculate_psnr(original_slice, reconstructed_slice)
-    psnr_values.append(psnr_value)
+def slice_psnr(voxelData, refined_mask):
+    """PSNR of every z slice of the mask against the normalized data, in batched chunks."""
+    quality = metrics.evaluate(voxelData, refined_mask, data_range=1.0, metrics=('psnr',))
+    return quality['slices']['psnr'].tolist()
+
+
+# Per-slice and whole-volume PSNR/SSIM/Dice/IoU of the mask against the normalized data
+def evaluate_segmentation(voxelData, refined_mask):
+    return metrics.evaluate(voxelData, refined_mask, data_range=1.0, metrics=('psnr', 'ssim', 'dice', 'iou'))
+
 
 # Plot PSNR Graph
-plt.figure(figsize=(10, 6))
-plt.plot(np.arange(dimensions[2]), psnr_values, marker='o', color='b')
-plt.title("PSNR Values Across Slices")
-plt.xlabel("Slice Number")
-plt.ylabel("PSNR (dB)")
-plt.grid(True)
-plt.show()
-
-# Volume Mapper for visualization
-volumeMapper = vtk.vtkSmartVolumeMapper()
-volumeMapper.SetInputData(segmentedImageData)
-
-# Volume Properties
-volumeProperty = vtk.vtkVolumeProperty()
-volumeProperty.SetInterpolationTypeToLinear()
-volumeProperty.ShadeOn()
-
-# Adjust opacity and color transfer functions
-opacityTransferFunction = vtk.vtkPiecewiseFunction()
-opacityTransferFunction.AddPoint(0, 0.0)  # Background is transparent
-opacityTransferFunction.AddPoint(1, 1.0)  # Teeth are fully opaque
-
-colorTransferFunction = vtk.vtkColorTransferFunction()
-colorTransferFunction.AddRGBPoint(0, 0.0, 0.0, 0.0)  # Black for background
-colorTransferFunction.AddRGBPoint(1, 1.0, 1.0, 1.0)  # White for teeth
-
-volumeProperty.SetScalarOpacity(opacityTransferFunction)
-volumeProperty.SetColor(colorTransferFunction)
-
-# Volume Actor
-volume = vtk.vtkVolume()
-volume.SetMapper(volumeMapper)
-volume.SetProperty(volumeProperty)
-
-# Renderer
-renderer = vtk.vtkRenderer()
-renderer.AddVolume(volume)
-renderer.SetBackground(0, 0, 0)  # Black background
-
-# Render Window
-renderWindow = vtk.vtkRenderWindow()
-renderWindow.AddRenderer(renderer)
-renderWindow.SetSize(800, 800)
-
-# Camera settings for better viewing
-camera = renderer.GetActiveCamera()
-camera.SetViewUp(0, 0, -1)
-camera.SetPosition(-200, -200, 300)
-camera.SetFocalPoint(0, 0, 0)
-renderer.ResetCamera()
+def plot_psnr(psnr_values):
+    plt.figure(figsize=(10, 6))
+    plt.plot(np.arange(len(psnr_values)), psnr_values, marker='o', color='b')
+    plt.title("PSNR Values Across Slices")
+    plt.xlabel("Slice Number")
+    plt.ylabel("PSNR (dB)")
+    plt.grid(True)
+    plt.show()
+
+
+def build_render_window(segmentedImageData, offscreen=False, size=(800, 800)):
+    # Volume Mapper for visualization
+    volumeMapper = vtk.vtkSmartVolumeMapper()
+    volumeMapper.SetInputData(segmentedImageData)
+
+    # Volume Properties
+    volumeProperty = vtk.vtkVolumeProperty()
+    volumeProperty.SetInterpolationTypeToLinear()
+    volumeProperty.ShadeOn()
+
+    # Adjust opacity and color transfer functions
+    opacityTransferFunction = vtk.vtkPiecewiseFunction()
+    opacityTransferFunction.AddPoint(0, 0.0)  # Background is transparent
+    opacityTransferFunction.AddPoint(1, 1.0)  # Teeth are fully opaque
+
+    colorTransferFunction = vtk.vtkColorTransferFunction()
+    colorTransferFunction.AddRGBPoint(0, 0.0, 0.0, 0.0)  # Black for background
+    colorTransferFunction.AddRGBPoint(1, 1.0, 1.0, 1.0)  # White for teeth
+
+    volumeProperty.SetScalarOpacity(opacityTransferFunction)
+    volumeProperty.SetColor(colorTransferFunction)
+
+    # Volume Actor
+    volume = vtk.vtkVolume()
+    volume.SetMapper(volumeMapper)
+    volume.SetProperty(volumeProperty)
+
+    # Renderer
+    renderer = vtk.vtkRenderer()
+    renderer.AddVolume(volume)
+    renderer.SetBackground(0, 0, 0)  # Black background
+
+    # Render Window (offscreen windows need no display and never show on screen)
+    renderWindow = vtk.vtkRenderWindow()
+    renderWindow.SetOffScreenRendering(int(offscreen))
+    renderWindow.AddRenderer(renderer)
+    renderWindow.SetSize(*size)
+
+    reset_camera(renderer)
+    return renderWindow
+
+
+# Camera settings for better viewing, fitted to the data currently in the renderer
+def reset_camera(renderer):
+    camera = renderer.GetActiveCamera()
+    camera.SetViewUp(0, 0, -1)
+    camera.SetPosition(-200, -200, 300)
+    camera.SetFocalPoint(0, 0, 0)
+    renderer.ResetCamera()
+
 
 # Export rendering as PNG
-export_folder = "./static/vtk"
-if not os.path.exists(export_folder):
-    os.makedirs(export_folder)
+def export_png(renderWindow, export_folder="./static/vtk"):
+    if not os.path.exists(export_folder):
+        os.makedirs(export_folder)
+
+    output_path = os.path.join(export_folder, "dental_structure.png")
+
+    exporter = vtk.vtkWindowToImageFilter()
+    exporter.SetInput(renderWindow)
+    exporter.Update()
+
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(output_path)
+    writer.SetInputData(exporter.GetOutput())
+    writer.Write()
+    return output_path
+
+
+def parse_view(spec):
+    """'name:azimuth:elevation' (degrees, relative to the default camera) -> (name, azimuth, elevation)."""
+    name, azimuth, elevation = spec.split(':')
+    return name, float(azimuth), float(elevation)
+
+
+class BatchRenderer:
+    """
+    Offscreen renderer for many studies in a row.
+
+    One render window, renderer, volume mapper and PNG writer are built once and
+    reused: each study only swaps the mapper's input, then every view in `views`
+    ((name, azimuth, elevation) tuples) is rendered and written, with no interactor.
+    """
+
+    def __init__(self, views=DEFAULT_VIEWS, size=(800, 800)):
+        self.views = [parse_view(v) if isinstance(v, str) else tuple(v) for v in views]
+        self.renderWindow = build_render_window(vtk.vtkImageData(), offscreen=True, size=size)
+        self.renderer = self.renderWindow.GetRenderers().GetFirstRenderer()
+        self.volumeMapper = self.renderer.GetVolumes().GetLastProp().GetMapper()
+
+        self.exporter = vtk.vtkWindowToImageFilter()
+        self.exporter.SetInput(self.renderWindow)
+        self.exporter.ReadFrontBufferOff()
+        self.writer = vtk.vtkPNGWriter()
+        self.writer.SetInputConnection(self.exporter.GetOutputPort())
+
+    def render(self, segmentedImageData, export_folder, prefix="dental_structure"):
+        """Render every view of one study into export_folder; returns ({view: path}, render seconds)."""
+        os.makedirs(export_folder, exist_ok=True)
+        start = time.perf_counter()
+        self.volumeMapper.SetInputData(segmentedImageData)
+        reset_camera(self.renderer)
+        camera = self.renderer.GetActiveCamera()
+        home = (camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp())
+
+        outputs = {}
+        for name, azimuth, elevation in self.views:
+            camera.SetPosition(home[0])
+            camera.SetFocalPoint(home[1])
+            camera.SetViewUp(home[2])
+            camera.Azimuth(azimuth)
+            camera.Elevation(elevation)
+            camera.OrthogonalizeViewUp()
+            self.renderer.ResetCameraClippingRange()
+            self.renderWindow.Render()
+
+            outputs[name] = os.path.join(export_folder, f"{prefix}_{name}.png")
+            self.exporter.Modified()
+            self.writer.SetFileName(outputs[name])
+            self.writer.Write()
+        return outputs, time.perf_counter() - start
+
+
+def render_studies(dicom_directories, export_folder="./static/vtk", views=DEFAULT_VIEWS, size=(800, 800)):
+    """
+    Load, segment and render each study offscreen with one shared BatchRenderer.
+
+    Images go to export_folder/<study name>/. Returns one report per study with
+    the image paths and the load/segment and render times in seconds, or with
+    'error' if that study failed; the remaining studies are still rendered.
+    """
+    renderer = BatchRenderer(views, size)
+    reports = []
+    for dicom_directory in dicom_directories:
+        study = os.path.basename(os.path.normpath(dicom_directory))
+        try:
+            start = time.perf_counter()
+            voxelData, spacing = load_volume(dicom_directory, normalize=True)
+            refined_mask, _ = segment_teeth_roi(voxelData)
+            segmentedImageData = mask_to_vtk(refined_mask, spacing)
+            segment_seconds = time.perf_counter() - start
+
+            images, render_seconds = renderer.render(segmentedImageData, os.path.join(export_folder, study))
+        except Exception as e:
+            logging.error(f"{study}: failed: {str(e)}")
+            reports.append({'study': dicom_directory, 'error': str(e)})
+            continue
+        print(f"{study}: segmented in {segment_seconds:.2f}s, rendered {len(images)} views in {render_seconds:.2f}s")
+        reports.append({
+            'study': dicom_directory,
+            'images': images,
+            'segment_seconds': segment_seconds,
+            'render_seconds': render_seconds,
+        })
+    return reports
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Segment and render dental CBCT studies.")
+    parser.add_argument('studies', nargs='*',
+                        help="DICOM directories to render offscreen (batch mode); none opens the interactive viewer")
+    parser.add_argument('--output', default="./static/vtk", help="folder for the rendered images")
+    parser.add_argument('--views', nargs='+', default=list(DEFAULT_VIEWS), metavar='NAME:AZIMUTH:ELEVATION',
+                        help="camera angles in degrees, relative to the default camera")
+    parser.add_argument('--size', nargs=2, type=int, default=[800, 800], metavar=('WIDTH', 'HEIGHT'))
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.studies:
+        reports = render_studies(args.studies, args.output, args.views, tuple(args.size))
+        print(json.dumps(reports, indent=2))
+        sys.exit(1 if any('error' in report for report in reports) else 0)
+
+    # Load DICOM images
+    dicom_directory = r'D:\\downloads\\GUI Code\\CAPSTONE\\DIcom gans\\Data\\raw'  # Update with your DICOM folder path
+    voxelData, spacing = load_volume(dicom_directory, normalize=True)
+    refined_mask, segmentation_metadata = segment_teeth_roi(voxelData)
+    print(f"ROI: {segmentation_metadata['roi']}")
+    segmentedImageData = mask_to_vtk(refined_mask, spacing)
 
-output_path = os.path.join(export_folder, "dental_structure.png")
+    quality = evaluate_segmentation(voxelData, refined_mask)
+    print("Volume metrics: " + ", ".join(f"{name}={value:.4f}" for name, value in quality['volume'].items()))
+    plot_psnr(quality['slices']['psnr'])
 
-exporter = vtk.vtkWindowToImageFilter()
-exporter.SetInput(renderWindow)
-exporter.Update()
+    renderWindow = build_render_window(segmentedImageData)
+    output_path = export_png(renderWindow)
 
-writer = vtk.vtkPNGWriter()
-writer.SetFileName(output_path)
-writer.SetInputData(exporter.GetOutput())
-writer.Write()
+    print(f"Dental structure 3D model saved as {output_path}.")
 
-print(f"Dental structure 3D model saved as {output_path}.")
+    # Surface mesh for CAD/printing tools, decimated to about two voxels per cell
+    mesh_path = os.path.join(os.path.dirname(output_path), "dental_structure.stl")
+    vertices, faces = surface_mesh.export_surface(refined_mask, mesh_path, spacing, cell_size=2 * min(spacing))
+    print(f"Dental surface mesh ({len(faces)} triangles) saved as {mesh_path}.")
 
-# Render Window Interactor for interactive visualization
-renderWindow.Render()
-renderWindowInteractor = vtk.vtkRenderWindowInteractor()
-renderWindowInteractor.SetRenderWindow(renderWindow)
+    # Render Window Interactor for interactive visualization
+    renderWindow.Render()
+    renderWindowInteractor = vtk.vtkRenderWindowInteractor()
+    renderWindowInteractor.SetRenderWindow(renderWindow)
 
-print("Interactive model rendering started...")
-renderWindowInteractor.Start()
\ No newline at end of file
+    print("Interactive model rendering started...")
+    renderWindowInteractor.Start()
@@ -1,55 +1,76 @@
 import numpy as np
-import pydicom
 from sklearn.cluster import KMeans
-from skimage import morphology
-from skimage.transform import resize
 import pyvista as pv
 
+from featureExtraction import process_dicom_directory, reconstruct_3d_volume
+from dicom_volume import DicomVolume
+from volume_cache import default_cache, source_fingerprint
+import kmeans1d
+import mask_morphology
+import roi
+import smoothing
+import surface_mesh
+import pyramid
+import vtk_bridge
+
 
 # Step 1: Extract and Normalize DICOM Data
-def extract_dicom_features(directory):
+def extract_dicom_features(directory, use_cache=True):
     """
     Extracts 3D volume and metadata from DICOM files in a directory.
+    A series that was decoded before is memory-mapped from the shared volume cache.
+    Also returns the series' source fingerprint (None without source files), which
+    keys results derived from the volume without hashing their contents.
     """
-    import os
-
-    # Read DICOM files
-    files = sorted([os.path.join(directory, f) for f in os.listdir(directory)])
-    slices = [pydicom.dcmread(file) for file in files]
-
-    # Stack slices to form a 3D volume
-    volume = np.stack([s.pixel_array for s in slices], axis=-1).astype(np.float32)
+    series_slices = process_dicom_directory(directory)
+    slices = max(series_slices.values(), key=len)
 
-    # Extract metadata
-    pixel_spacing = slices[0].PixelSpacing  # [x, y]
-    slice_thickness = slices[0].SliceThickness  # z
-    spacing = (*pixel_spacing, slice_thickness)  # Spacing for all three dimensions
+    cache = default_cache() if use_cache else None
+    volume, spacing, _ = reconstruct_3d_volume(slices, cache=cache)
 
-    print(f"Pixel Spacing: {pixel_spacing}, Slice Thickness: {slice_thickness}")
-    return volume, spacing
+    print(f"Voxel Spacing: {spacing}")
+    return volume, spacing, source_fingerprint(slices)
 
 
 # Step 2: Normalize the Volume Data
 def normalize_volume(volume):
     """
-    Normalizes the volume intensities to the range [0, 1].
+    Normalizes the volume intensities to the range [0, 1] as float32.
+    A DicomVolume is normalized from the min/max gathered while it was decoded,
+    in the same single pass that rescales it.
     """
-    return (volume - np.min(volume)) / (np.max(volume) - np.min(volume))
+    if isinstance(volume, DicomVolume):
+        return np.asarray(volume.normalized())
+    return smoothing.normalize_inplace(volume, out=np.empty(np.shape(volume), dtype=np.float32))
 
 
 # Step 3: Apply K-Means Clustering
-def apply_kmeans(volume, n_clusters=3):
+def apply_kmeans(volume, n_clusters=3, engine='sklearn', bins=kmeans1d.DEFAULT_BINS):
     """
-    Applies K-Means clustering to the flattened volume data.
+    Applies K-Means clustering to the voxel intensities and returns the teeth (brightest) cluster mask.
+
+    engine='sklearn' runs sklearn KMeans on every voxel; engine='histogram' runs the
+    same KMeans on a `bins`-bin intensity histogram and labels the volume with one
+    threshold (benchmark.check_kmeans_engines compares the two masks).
     """
+    if engine == 'histogram':
+        # The teeth cluster is everything nearer the top centroid than the one below it.
+        _, thresholds = kmeans1d.histogram_kmeans(volume, n_clusters, bins)
+        if len(thresholds) == 0:
+            return np.ones(volume.shape, dtype=np.uint8)
+        return (volume > thresholds[-1]).astype(np.uint8)
+    if engine != 'sklearn':
+        raise ValueError(f"Unknown k-means engine: {engine}")
+
     voxel_flat = volume.ravel().reshape(-1, 1)
     kmeans = KMeans(n_clusters=n_clusters, random_state=0)
     kmeans.fit(voxel_flat)
     clustered = kmeans.labels_.reshape(volume.shape)
 
-    # Determine the cluster corresponding to teeth by intensity
-    cluster_means = [volume[clustered == i].mean() for i in range(n_clusters)]
-    teeth_cluster = np.argmax(cluster_means)
+    # Determine the cluster corresponding to teeth by intensity (one pass over the labels)
+    cluster_sums = np.bincount(kmeans.labels_, weights=voxel_flat.ravel(), minlength=n_clusters)
+    cluster_counts = np.bincount(kmeans.labels_, minlength=n_clusters)
+    teeth_cluster = np.argmax(cluster_sums / np.maximum(cluster_counts, 1))
 
     # Create binary mask for teeth
     teeth_mask = (clustered == teeth_cluster).astype(np.uint8)
@@ -57,87 +78,143 @@ def apply_kmeans(volume, n_clusters=3):
 
 
 # Step 4: Apply Morphological Operations
+# Ball radii of refine_mask's closing and opening; segment_teeth_roi pads its crop by their reach.
+CLOSING_RADIUS = 3
+OPENING_RADIUS = 2
+
+
 def refine_mask(mask):
     """
     Applies morphological operations to refine the segmentation mask.
+    Same result as skimage's binary_closing(ball(3)) then binary_opening(ball(2)),
+    computed on a bit-packed mask with decomposed balls.
     """
-    mask = morphology.binary_closing(mask, morphology.ball(3))
-    mask = morphology.binary_opening(mask, morphology.ball(2))
-    return mask
+    mask = mask_morphology.PackedMask.pack(mask)
+    mask = mask_morphology.binary_closing(mask, CLOSING_RADIUS)
+    mask = mask_morphology.binary_opening(mask, OPENING_RADIUS)
+    return mask.unpack()
 
 
-# Step 5: Downsample the Volume
-def downsample_volume(volume, scale_factor):
+# Step 4b: Coarse-to-Fine Segmentation
+def segment_teeth_roi(volume, factor=roi.DEFAULT_FACTOR, margin=None):
     """
-    Downsamples the volume by a given scale factor.
-    If the volume is boolean, it is cast to uint8 before resizing.
+    Finds the teeth on a factor-times downsampled proxy, then runs apply_kmeans and
+    refine_mask only inside that padded box. Returns (mask, metadata), the mask in
+    full-volume coordinates and metadata['roi'] describing the crop box.
+    Clusters are fitted to the cropped intensities, not the whole field of view.
     """
-    # Cast boolean volume to uint8
-    if volume.dtype == np.bool_:
-        volume = volume.astype(np.uint8)
-
-    new_shape = (
-        int(volume.shape[0] * scale_factor),
-        int(volume.shape[1] * scale_factor),
-        int(volume.shape[2] * scale_factor)
+    if margin is None:
+        margin = roi.filter_margin([2 * CLOSING_RADIUS, 2 * OPENING_RADIUS], factor)
+    return roi.coarse_to_fine(
+        volume,
+        detect=lambda proxy: apply_kmeans(proxy).astype(bool),
+        segment=lambda crop: refine_mask(apply_kmeans(crop)),
+        factor=factor,
+        margin=margin,
     )
 
-    # Use interpolation order appropriate for the data type
-    return resize(volume, new_shape, order=1, preserve_range=True, anti_aliasing=False)
-
 
 # Step 6: Convert to PyVista Volume and Visualize
-def visualize_volume(mask, spacing, scale_factor=0.5):
+def _pyramid_grid(level, factor, spacing):
     """
-    Visualizes the 3D volume using PyVista with downsampling to optimize memory usage.
+    PyVista ImageData for one pyramid level, normalized to [0, 1].
     """
-    # Downsample the mask for memory efficiency
-    downsampled_mask = downsample_volume(mask, scale_factor)
+    level = np.asarray(level)
+    if level.dtype != np.bool_:
+        level = np.asarray(level, dtype=np.float32)
+        low, high = level.min(), level.max()
+        if high > low and (low != 0 or high != 1):
+            level = np.asfortranarray((level - low) / (high - low))
 
-    # Ensure the mask is normalized
-    downsampled_mask = (downsampled_mask - downsampled_mask.min()) / (downsampled_mask.max() - downsampled_mask.min())
+    # Spacing corresponds to [z, y, x] in PyVista.
+    # Pyramid levels are Fortran-ordered, so their scalars are shared with VTK, not copied;
+    # the full-resolution boolean mask goes in as uint8 with a single reordering copy
+    return vtk_bridge.to_pyvista(level, spacing=[s * factor for s in spacing[::-1]], name="Segmentation")
 
-    # Adjust spacing for the downsampled data
-    adjusted_spacing = [s * scale_factor for s in spacing[::-1]]
 
-    # Create a PyVista ImageData
-    grid = pv.ImageData()
-    grid.dimensions = downsampled_mask.shape
-    grid.spacing = adjusted_spacing  # Spacing corresponds to [z, y, x] in PyVista
-    grid.point_data["Segmentation"] = downsampled_mask.ravel(order="F").astype(np.float32)
+def visualize_volume(mask, spacing, scale_factor=0.5, refine_interval=200, key=None):
+    """
+    Visualizes the 3D volume using PyVista, progressively.
+    The coarsest level of the mask's cached pyramid (8x) is shown immediately and
+    swapped for finer levels every refine_interval ms, down to 1/scale_factor.
+    `key` identifies the mask's content for the pyramid cache (see pyramid.get_pyramid).
+    """
+    volume_pyramid = pyramid.get_pyramid(mask, key=key)
+    finest = volume_pyramid.factors[np.argmin([abs(f * scale_factor - 1) for f in volume_pyramid.factors])]
+    levels = volume_pyramid.coarse_to_fine(finest)
 
     # Debug information
-    print(f"Grid dimensions: {grid.dimensions}")
+    factor, level = levels[0]
+    grid = _pyramid_grid(level, factor, spacing)
+    print(f"Grid dimensions: {grid.dimensions} (1/{factor}, refining to 1/{finest})")
     print(f"Grid spacing: {grid.spacing}")
-    print(f"Unique values in the mask: {np.unique(downsampled_mask)}")
 
-    # Render the volume
+    # Render the coarsest volume right away
     plotter = pv.Plotter()
-    plotter.add_volume(
-        grid,
+    volume_options = dict(
         cmap="viridis",  # Change to a preferred colormap
         opacity=[0, 1],  # Adjust opacity transfer function
         show_scalar_bar=True
     )
+    state = {'actor': plotter.add_volume(grid, **volume_options)}
+
+    def refine(step):
+        if step + 1 >= len(levels):
+            return
+        factor, level = levels[step + 1]
+        plotter.remove_actor(state['actor'], render=False)
+        state['actor'] = plotter.add_volume(_pyramid_grid(level, factor, spacing), **volume_options)
+        plotter.render()
+
+    if len(levels) > 1:
+        plotter.add_timer_event(max_steps=len(levels) - 1, duration=refine_interval, callback=refine)
     plotter.show()
 
 
 
 
+# Step 7: Extract a Surface Mesh
+def export_surface(mask, spacing, path="teeth.stl", cell_size=None):
+    """
+    Runs chunked marching cubes on the mask and writes a binary STL/PLY (by extension).
+    cell_size (mm) decimates by vertex clustering; defaults to twice the finest spacing.
+    Returns (vertices, faces).
+    """
+    if cell_size is None:
+        cell_size = 2 * min(spacing)
+    vertices, faces = surface_mesh.export_surface(mask, path, spacing, cell_size=cell_size)
+    print(f"Surface mesh: {len(vertices)} vertices, {len(faces)} triangles -> {path}")
+    return vertices, faces
+
+
+def visualize_surface(vertices, faces):
+    """
+    Renders a (decimated) surface mesh, which stays interactive where volume rendering does not.
+    """
+    mesh = pv.PolyData(vertices, np.hstack([np.full((len(faces), 1), 3), faces]).ravel())
+    plotter = pv.Plotter()
+    plotter.add_mesh(mesh, color="white", smooth_shading=True)
+    plotter.show()
+
+
 # Main Process
 if __name__ == "__main__":
     # Step 1: Load DICOM Data
     dicom_directory = "D:\\downloads\\GUI Code\\CAPSTONE\\DIcom gans\\Data\\raw"  # Replace with your DICOM directory
-    raw_volume, voxel_spacing = extract_dicom_features(dicom_directory)
+    raw_volume, voxel_spacing, fingerprint = extract_dicom_features(dicom_directory)
 
     # Step 2: Normalize Volume
     normalized_volume = normalize_volume(raw_volume)
 
-    # Step 3: Segment the Teeth Region
-    teeth_mask = apply_kmeans(normalized_volume)
-
-    # Step 4: Refine the Segmentation Mask
-    refined_mask = refine_mask(teeth_mask)
+    # Steps 3-4: Segment and Refine the Teeth Region inside the detected ROI
+    refined_mask, segmentation_metadata = segment_teeth_roi(normalized_volume)
+    print(f"ROI: {segmentation_metadata['roi']}")
 
     # Step 5: Visualize the 3D Mask with Downsampling
-    visualize_volume(refined_mask, voxel_spacing, scale_factor=0.5)
+    # The mask is keyed by its source series and the segmentation that produced it
+    mask_key = ('level_1.segment_teeth_roi', fingerprint) if fingerprint is not None else None
+    visualize_volume(refined_mask, voxel_spacing, scale_factor=0.5, key=mask_key)
+
+    # Step 6: Export and Show the Tooth Surface
+    vertices, faces = export_surface(refined_mask, voxel_spacing, "teeth.stl")
+    visualize_surface(vertices, faces)
@@ -1,20 +1,19 @@
 import vtk
 import numpy as np
-from skimage.metrics import peak_signal_noise_ratio as psnr, structural_similarity as ssim
 import matplotlib.pyplot as plt
 
+import metrics
+import vtk_bridge
+
 # Function to generate synthetic ground truth for evaluation
 def generate_ground_truth(image_data):
     dims = image_data.GetDimensions()
     synthetic_data = np.random.randint(0, 256, size=(dims[2], dims[1], dims[0]), dtype=np.uint8)
     return synthetic_data
 
-# Convert VTK image data to NumPy array
+# View VTK image data as a (z, y, x) NumPy array sharing the VTK buffer
 def vtk_to_numpy(image_data):
-    dims = image_data.GetDimensions()
-    numpy_data = vtk.util.numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
-    numpy_data = numpy_data.reshape(dims[2], dims[1], dims[0])
-    return numpy_data
+    return vtk_bridge.image_data_to_numpy(image_data).transpose(2, 1, 0)
 
 # Create the DICOM reader
 reader = vtk.vtkDICOMImageReader()
@@ -39,26 +38,39 @@ resampled_numpy = vtk_to_numpy(resampled_data)
 # Generate synthetic ground truth data for evaluation
 ground_truth = generate_ground_truth(resampled_data)
 
-# Evaluate metrics
-accuracy = np.mean(resampled_numpy == ground_truth) * 100  # Simplified metric for demonstration
-psnr_value = psnr(ground_truth, resampled_numpy, data_range=255)
-ssim_value = ssim(ground_truth, resampled_numpy, data_range=255, multichannel=False)
+# Evaluate metrics slice by slice in bounded chunks (axis 0 is z in the VTK array order);
+# ssim_3d=True gives the same whole-volume SSIM as a single 3-D structural_similarity call
+quality = metrics.evaluate(ground_truth, resampled_numpy, data_range=255, axis=0,
+                           metrics=('accuracy', 'psnr', 'ssim'), ssim_3d=True)
+accuracy = quality['volume']['accuracy'] * 100  # Simplified metric for demonstration
+psnr_value = quality['volume']['psnr']
+ssim_value = quality['volume']['ssim']
 
 print(f"Accuracy: {accuracy:.2f}%")
 print(f"PSNR: {psnr_value:.2f}")
 print(f"SSIM: {ssim_value:.4f}")
 
 # Plotting the metrics
-metrics = ["Accuracy", "PSNR", "SSIM"]
+metric_names = ["Accuracy", "PSNR", "SSIM"]
 values = [accuracy, psnr_value, ssim_value]
 
 plt.figure(figsize=(8, 6))
-plt.bar(metrics, values, color=['blue', 'orange', 'green'])
+plt.bar(metric_names, values, color=['blue', 'orange', 'green'])
 plt.title("Model Evaluation Metrics")
 plt.ylabel("Values")
 plt.ylim(0, 100)
 plt.show()
 
+# Per-slice curves from the same evaluation
+fig, (psnr_axis, ssim_axis) = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
+psnr_axis.plot(quality['slices']['psnr'], color='orange')
+psnr_axis.set_ylabel("PSNR (dB)")
+ssim_axis.plot(quality['slices']['ssim'], color='green')
+ssim_axis.set_ylabel("SSIM")
+ssim_axis.set_xlabel("Slice Number")
+fig.suptitle("Metrics Across Slices")
+plt.show()
+
 # Additional Notes:
 # The ground truth here is synthetic and generated for evaluation purposes.
 # Replace it with actual ground truth data if available for more accurate evaluation.
@@ -0,0 +1,200 @@
+import os
+from math import isqrt
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+METHODS = ('auto', 'decompose', 'edt')
+
+# Above this radius 'auto' switches from row decomposition to a distance transform.
+EDT_MIN_RADIUS = 8
+
+# Output planes (along axis 0) handed to each thread at a time.
+SLAB_SIZE = 16
+
+
+def ball_rows(radius):
+    """
+    Decompose skimage.morphology.ball(radius) into rows along the last axis.
+
+    Returns [(d0, d1, half_width)]: the ball is the union of the segments
+    {(d0, d1, d2) : |d2| <= half_width}, i.e. every offset with
+    d0**2 + d1**2 + d2**2 <= radius**2.
+    """
+    rows = []
+    for d0 in range(-radius, radius + 1):
+        for d1 in range(-radius, radius + 1):
+            rest = radius * radius - d0 * d0 - d1 * d1
+            if rest >= 0:
+                rows.append((d0, d1, isqrt(rest)))
+    return rows
+
+
+class PackedMask:
+    """A 3-D boolean mask with 8 voxels per byte along the last axis (np.packbits order)."""
+
+    def __init__(self, data, shape):
+        self.data = data
+        self.shape = tuple(shape)
+
+    @classmethod
+    def pack(cls, mask):
+        mask = np.asarray(mask)
+        if mask.dtype != np.bool_:
+            mask = mask != 0
+        return cls(np.packbits(mask, axis=-1), mask.shape)
+
+    def unpack(self):
+        return np.unpackbits(self.data, axis=-1, count=self.shape[-1]).view(np.bool_)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def invert(self):
+        out = PackedMask(np.invert(self.data), self.shape)
+        _clear_padding(out.data, self.shape[-1])
+        return out
+
+
+def _clear_padding(data, length):
+    pad = data.shape[-1] * 8 - length
+    if pad:
+        data[..., -1] &= np.uint8((0xFF << pad) & 0xFF)
+
+
+def _shift_bits(data, k):
+    """Move every bit k voxels along the last axis (towards higher indices for k > 0), zero-filled."""
+    out = np.zeros_like(data)
+    nbytes = data.shape[-1]
+    q, b = divmod(abs(k), 8)
+    if q >= nbytes:
+        return out
+    if k > 0:
+        src = data[..., :nbytes - q]
+        out[..., q:] = src >> b
+        if b:
+            out[..., q + 1:] |= src[..., :-1] << (8 - b)
+    else:
+        src = data[..., q:]
+        out[..., :nbytes - q] = src << b
+        if b:
+            out[..., :nbytes - q - 1] |= src[..., 1:] >> (8 - b)
+    return out
+
+
+def _resolve_workers(workers):
+    return workers if workers is not None else (os.cpu_count() or 1)
+
+
+def _run_slabs(run, length, workers):
+    bounds = list(range(0, length, SLAB_SIZE)) + [length]
+    ranges = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    workers = max(1, min(_resolve_workers(workers), len(ranges)))
+    if workers == 1:
+        for lo, hi in ranges:
+            run(lo, hi)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(run, lo, hi) for lo, hi in ranges]:
+            future.result()
+
+
+def _dilate_decomposed(packed, radius, workers):
+    data = packed.data
+    n0, n1 = data.shape[:2]
+    out = np.zeros_like(data)
+    rows = ball_rows(radius)
+
+    def run(lo, hi):
+        in_lo, in_hi = max(0, lo - radius), min(n0, hi + radius)
+        block = data[in_lo:in_hi]
+        # spread[w] is the block dilated by the segment [-w, w] along the last axis.
+        spread = [block]
+        for w in range(1, radius + 1):
+            spread.append(spread[-1] | _shift_bits(block, w) | _shift_bits(block, -w))
+        target = out[lo:hi]
+        for d0, d1, w in rows:
+            # target[z, y] |= spread[w][z + d0, y + d1], with zeros outside the volume
+            z_lo, z_hi = max(lo, in_lo - d0), min(hi, in_hi - d0)
+            y_lo, y_hi = max(0, -d1), min(n1, n1 - d1)
+            if z_lo >= z_hi or y_lo >= y_hi:
+                continue
+            target[z_lo - lo:z_hi - lo, y_lo:y_hi] |= \
+                spread[w][z_lo + d0 - in_lo:z_hi + d0 - in_lo, y_lo + d1:y_hi + d1]
+
+    _run_slabs(run, n0, workers)
+    _clear_padding(out, packed.shape[-1])
+    return PackedMask(out, packed.shape)
+
+
+def _dilate_edt(packed, radius, workers):
+    # A voxel is in the dilation iff some mask voxel lies within `radius`;
+    # squared distances are integers, so compare against radius**2 + 0.5.
+    mask = packed.unpack()
+    n0 = mask.shape[0]
+    out = np.zeros(mask.shape, dtype=bool)
+    limit = radius * radius + 0.5
+
+    def run(lo, hi):
+        in_lo, in_hi = max(0, lo - radius), min(n0, hi + radius)
+        window = mask[in_lo:in_hi]
+        if not window.any():
+            return
+        distance = distance_transform_edt(~window)
+        out[lo:hi] = (distance * distance <= limit)[lo - in_lo:hi - in_lo]
+
+    _run_slabs(run, n0, workers)
+    return PackedMask.pack(out)
+
+
+def dilate(packed, radius, workers=None, method='auto'):
+    """Dilate a PackedMask by ball(radius); voxels outside the volume count as background."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown morphology method: {method}")
+    if radius <= 0:
+        return PackedMask(packed.data.copy(), packed.shape)
+    if method == 'edt' or (method == 'auto' and radius >= EDT_MIN_RADIUS):
+        return _dilate_edt(packed, radius, workers)
+    return _dilate_decomposed(packed, radius, workers)
+
+
+def erode(packed, radius, workers=None, method='auto'):
+    """Erode a PackedMask by ball(radius); voxels outside the volume count as foreground."""
+    # The ball is symmetric, so erosion is the complement of dilating the complement.
+    return dilate(packed.invert(), radius, workers, method).invert()
+
+
+def _as_packed(mask):
+    return mask if isinstance(mask, PackedMask) else PackedMask.pack(mask)
+
+
+def _result(packed, like):
+    return packed if isinstance(like, PackedMask) else packed.unpack()
+
+
+def binary_dilation(mask, radius, workers=None, method='auto'):
+    """Same result as skimage.morphology.binary_dilation(mask, ball(radius)).
+
+    `mask` may be a bool/uint8 array (a bool array is returned) or a PackedMask
+    (a PackedMask is returned).
+    """
+    return _result(dilate(_as_packed(mask), radius, workers, method), mask)
+
+
+def binary_erosion(mask, radius, workers=None, method='auto'):
+    """Same result as skimage.morphology.binary_erosion(mask, ball(radius))."""
+    return _result(erode(_as_packed(mask), radius, workers, method), mask)
+
+
+def binary_closing(mask, radius, workers=None, method='auto'):
+    """Same result as skimage.morphology.binary_closing(mask, ball(radius))."""
+    packed = dilate(_as_packed(mask), radius, workers, method)
+    return _result(erode(packed, radius, workers, method), mask)
+
+
+def binary_opening(mask, radius, workers=None, method='auto'):
+    """Same result as skimage.morphology.binary_opening(mask, ball(radius))."""
+    packed = erode(_as_packed(mask), radius, workers, method)
+    return _result(dilate(packed, radius, workers, method), mask)
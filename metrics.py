@@ -0,0 +1,217 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.ndimage import uniform_filter1d
+
+METRICS = ('psnr', 'ssim', 'dice', 'iou', 'accuracy')
+
+# Slices per chunk; each chunk holds a few float copies of itself (plus an SSIM halo).
+DEFAULT_CHUNK_SIZE = 16
+
+# structural_similarity defaults (skimage): uniform 7x7 window, sample covariance.
+DEFAULT_WIN_SIZE = 7
+K1, K2 = 0.01, 0.03
+
+
+def _take(array, axis, lo, hi, dtype):
+    # Works for ndarrays, memmaps and DicomVolume, which only support basic indexing.
+    key = [slice(None)] * 3
+    key[axis] = slice(lo, hi)
+    # Slice-first and contiguous, so the in-plane filters run along contiguous planes.
+    return np.ascontiguousarray(np.moveaxis(np.asarray(array[tuple(key)], dtype=dtype), axis, 0))
+
+
+def _work_dtype(reference, test):
+    # Like skimage: float32 when neither input needs more precision, float64 otherwise.
+    dtype = np.result_type(reference.dtype, test.dtype)
+    return np.float32 if dtype in (np.bool_, np.float16, np.float32) else np.float64
+
+
+def _data_range(reference, data_range):
+    if data_range is not None:
+        return float(data_range)
+    dtype = np.dtype(reference.dtype)
+    if dtype == np.bool_:
+        return 1.0
+    if np.issubdtype(dtype, np.integer):
+        return float(np.iinfo(dtype).max - np.iinfo(dtype).min)
+    raise ValueError("data_range is required for floating point volumes")
+
+
+def _ssim_map(moments, data_range, num_points):
+    # skimage's formula evaluated in place on the (already cropped) moments, which it consumes.
+    ux, uy, uxx, uyy, uxy = moments
+    cov_norm = num_points / (num_points - 1)
+    c1, c2 = (K1 * data_range) ** 2, (K2 * data_range) ** 2
+    tmp = ux * ux
+    uxx -= tmp
+    uxx *= cov_norm                  # vx
+    np.multiply(uy, uy, out=tmp)
+    uyy -= tmp
+    uyy *= cov_norm                  # vy
+    np.multiply(ux, uy, out=tmp)
+    uxy -= tmp
+    uxy *= cov_norm                  # vxy
+    uxx += uyy
+    uxx += c2                        # B2
+    uxy *= 2
+    uxy += c2                        # A2
+    tmp *= 2
+    tmp += c1                        # A1
+    tmp *= uxy
+    ux *= ux
+    uy *= uy
+    ux += uy
+    ux += c1                         # B1
+    ux *= uxx
+    tmp /= ux
+    return tmp
+
+
+def _binary(values, threshold):
+    return values > threshold
+
+
+class _Chunk:
+    """Per-slice sums of one chunk, from which both slice and volume metrics follow."""
+
+    def __init__(self, x, y, metrics, threshold):
+        if 'psnr' in metrics:
+            diff = x - y
+            self.sse = np.einsum('kij,kij->k', diff, diff, dtype=np.float64)
+        if 'accuracy' in metrics:
+            self.equal = np.count_nonzero(x == y, axis=(1, 2))
+        if 'dice' in metrics or 'iou' in metrics:
+            bx, by = _binary(x, threshold), _binary(y, threshold)
+            self.intersection = np.count_nonzero(bx & by, axis=(1, 2))
+            self.union_sizes = np.count_nonzero(bx, axis=(1, 2)) + np.count_nonzero(by, axis=(1, 2))
+
+
+def _chunk_ssim(x, y, in_lo, lo, hi, depth, data_range, win_size, ssim_3d):
+    """
+    (per-slice 2-D SSIM of [lo, hi), sum and count of the 3-D SSIM map over the same slices).
+
+    x and y hold slices [in_lo, ...), which with ssim_3d must include a halo of
+    win_size // 2 slices around [lo, hi) where the volume has them.
+    """
+    pad = (win_size - 1) // 2
+    moments = []
+    for product in (x, y, x * x, y * y, x * y):
+        for filter_axis in (1, 2):
+            product = uniform_filter1d(product, win_size, axis=filter_axis)
+        moments.append(product)
+    inner = slice(pad, -pad or None)
+    keep = slice(lo - in_lo, hi - in_lo)
+
+    volume_sum, volume_count = 0.0, 0
+    first, last = max(lo, pad), min(hi, depth - pad)
+    if ssim_3d and depth >= win_size and last > first:
+        # The in-plane moments filtered once more along the slice axis are the 3-D ones;
+        # the halo makes the chunk's result equal to filtering the whole volume.
+        window = slice(first - in_lo, last - in_lo)
+        volume_moments = [uniform_filter1d(m, win_size, axis=0)[window, inner, inner] for m in moments]
+        volume_map = _ssim_map(volume_moments, data_range, win_size ** 3)
+        volume_sum, volume_count = float(volume_map.sum(dtype=np.float64)), volume_map.size
+
+    slice_map = _ssim_map([m[keep, inner, inner] for m in moments], data_range, win_size ** 2)
+    return slice_map.mean(axis=(1, 2), dtype=np.float64), volume_sum, volume_count
+
+
+def _psnr(sse, count, data_range):
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(data_range ** 2 / (np.asarray(sse, dtype=np.float64) / count))
+
+
+def _overlap(intersection, sizes, iou):
+    intersection = np.asarray(intersection, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    denominator = sizes - intersection if iou else sizes / 2
+    # Two empty masks agree perfectly.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, intersection / np.where(denominator > 0, denominator, 1), 1.0)
+
+
+def evaluate(reference, test, data_range=None, axis=2, metrics=METRICS, threshold=0.5,
+             chunk_size=DEFAULT_CHUNK_SIZE, workers=None, win_size=DEFAULT_WIN_SIZE, ssim_3d=False):
+    """
+    Per-slice and whole-volume quality metrics of `test` against `reference`.
+
+    Slices are taken along `axis` and processed in chunks of `chunk_size` on
+    `workers` threads, each chunk vectorized over all its slices, so memory stays
+    bounded by the chunk rather than the volume. Like skimage, the work is done in
+    float32 when both inputs are at most float32 and in float64 otherwise.
+    `metrics` picks from METRICS:
+
+    - psnr: 10 log10(data_range^2 / MSE); `data_range` defaults to the integer dtype range.
+    - ssim: skimage's structural_similarity defaults (uniform window, sample covariance),
+      2-D per slice, equal to running skimage on each slice. The volume value is the
+      mean over slices, or with ssim_3d=True skimage's 3-D SSIM of the whole volume
+      (chunks then re-read a halo of win_size // 2 slices on each side).
+    - dice / iou: overlap of `> threshold` masks; both masks empty counts as 1.
+    - accuracy: fraction of voxels with exactly equal values.
+
+    Returns {'slices': {metric: array over slices}, 'volume': {metric: float}}.
+    """
+    if reference.shape != test.shape:
+        raise ValueError("Reference and test volumes must have the same dimensions")
+    axis = axis % 3
+    metrics = tuple(metrics)
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metrics: {sorted(unknown)}")
+    depth = reference.shape[axis]
+    plane = [n for a, n in enumerate(reference.shape) if a != axis]
+    if 'psnr' in metrics or 'ssim' in metrics:
+        data_range = _data_range(reference, data_range)
+    if 'ssim' in metrics and min(plane) < win_size:
+        raise ValueError(f"Slices of shape {tuple(plane)} are smaller than the SSIM window ({win_size})")
+
+    halo = (win_size - 1) // 2 if 'ssim' in metrics and ssim_3d else 0
+    dtype = _work_dtype(reference, test)
+
+    def run(lo, hi):
+        # Each chunk is read (and converted to float64) once, with the SSIM halo if any.
+        in_lo, in_hi = max(0, lo - halo), min(depth, hi + halo)
+        x, y = _take(reference, axis, in_lo, in_hi, dtype), _take(test, axis, in_lo, in_hi, dtype)
+        keep = slice(lo - in_lo, hi - in_lo)
+        chunk = _Chunk(x[keep], y[keep], metrics, threshold)
+        if 'ssim' in metrics:
+            chunk.ssim = _chunk_ssim(x, y, in_lo, lo, hi, depth, data_range, win_size, ssim_3d)
+        return chunk
+
+    ranges = [(lo, min(lo + chunk_size, depth)) for lo in range(0, depth, chunk_size)]
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(ranges)))
+    if workers == 1:
+        chunks = [run(lo, hi) for lo, hi in ranges]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(lambda r: run(*r), ranges))
+
+    def gather(name):
+        return np.concatenate([getattr(chunk, name) for chunk in chunks])
+
+    pixels = plane[0] * plane[1]
+    slices, volume = {}, {}
+    if 'psnr' in metrics:
+        sse = gather('sse')
+        slices['psnr'] = _psnr(sse, pixels, data_range)
+        volume['psnr'] = float(_psnr(sse.sum(), pixels * depth, data_range))
+    if 'ssim' in metrics:
+        slices['ssim'] = np.concatenate([chunk.ssim[0] for chunk in chunks])
+        if ssim_3d:
+            count = sum(chunk.ssim[2] for chunk in chunks)
+            volume['ssim'] = sum(chunk.ssim[1] for chunk in chunks) / count if count else float('nan')
+        else:
+            volume['ssim'] = float(slices['ssim'].mean())
+    for name, iou in (('dice', False), ('iou', True)):
+        if name in metrics:
+            intersection, sizes = gather('intersection'), gather('union_sizes')
+            slices[name] = _overlap(intersection, sizes, iou)
+            volume[name] = float(_overlap(intersection.sum(), sizes.sum(), iou))
+    if 'accuracy' in metrics:
+        equal = gather('equal')
+        slices['accuracy'] = equal / pixels
+        volume['accuracy'] = float(equal.sum() / (pixels * depth))
+    return {'slices': slices, 'volume': volume}
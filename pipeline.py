@@ -0,0 +1,289 @@
+import os
+import mmap
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from dicom_volume import DicomVolume
+
+# Bytes of in-memory (not memory-mapped) arrays the memo may hold at once.
+DEFAULT_MAX_MEMO_BYTES = 1 << 30
+# Bytes of persisted stage outputs kept in cache_dir; least recently used files go first.
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 ** 2
+
+
+def content_hash(value):
+    """Stable SHA-1 of a parameter or input value (arrays by content, containers recursively)."""
+    digest = hashlib.sha1()
+    _update_hash(digest, value)
+    return digest.hexdigest()
+
+
+def _update_hash(digest, value):
+    if isinstance(value, DicomVolume):
+        digest.update(b'DicomVolume')
+        for part in (value.raw, value.slope, value.intercept):
+            _update_hash(digest, part)
+    elif isinstance(value, np.ndarray):
+        digest.update(f"ndarray{value.dtype.str}{value.shape}".encode('utf-8'))
+        digest.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, dict):
+        digest.update(b'dict')
+        for key in sorted(value, key=str):
+            _update_hash(digest, str(key))
+            _update_hash(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode('utf-8'))
+        for item in value:
+            _update_hash(digest, item)
+    else:
+        digest.update(f"{type(value).__name__}:{value!r}".encode('utf-8'))
+
+
+def memory_size(value):
+    """
+    Approximate RAM held by a value: array bytes, recursively through containers.
+
+    Memory-mapped arrays (e.g. VolumeCache entries) and views of them count as
+    zero, since the page cache rather than the memo keeps their data.
+    """
+    if isinstance(value, DicomVolume):
+        return memory_size(value.raw) + value.slope.nbytes + value.intercept.nbytes
+    if isinstance(value, np.ndarray):
+        base = value
+        while base is not None:
+            if isinstance(base, (np.memmap, mmap.mmap)):
+                return 0
+            base = getattr(base, 'base', None)
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(memory_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(memory_size(item) for item in value)
+    return 0
+
+
+class Stage:
+    """
+    One declared step of a Pipeline.
+
+    `func` is called with its `inputs` (names of other stages or of run-time
+    sources) and its `params` as keyword arguments. Params have defaults that
+    Pipeline.run can override by name. persist=True also pickles the output to
+    the pipeline's cache_dir; memoize=False marks side-effect stages (e.g.
+    writing image files) that must run every time.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, persist=False, memoize=True):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = dict(params or {})
+        self.persist = persist
+        self.memoize = memoize
+
+
+class Pipeline:
+    """
+    Stages with content-hashed keys and memoized outputs.
+
+    A stage's key hashes its name, its effective params and the keys of its
+    inputs; run-time sources are hashed by value, or by a fingerprint function
+    registered with source(). Keys are resolved before anything is computed, so
+    changing one param only recomputes the stages downstream of it. The memo
+    keeps at most max_entries outputs and max_bytes of in-memory arrays
+    (memory_size), dropping the least recently used first, and is safe to
+    share between threads (e.g. a GUI worker and a cancelled run that is still
+    finishing its current stage). Persisted outputs in cache_dir are likewise
+    evicted least recently used first beyond max_disk_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=32, max_bytes=DEFAULT_MAX_MEMO_BYTES,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.stages = OrderedDict()
+        self.sources = {}
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memo = OrderedDict()
+        self._sizes = {}
+        self._memo_bytes = 0
+        self._lock = threading.Lock()
+
+    def source(self, name, fingerprint=None):
+        """Declare a run-time input; fingerprint(value) replaces hashing the value itself."""
+        self.sources[name] = fingerprint
+
+    def add(self, name, func, inputs=(), params=None, persist=False, memoize=True):
+        self.stages[name] = Stage(name, func, inputs, params, persist, memoize)
+        return self.stages[name]
+
+    def stage(self, name, inputs=(), params=None, persist=False, memoize=True):
+        """Decorator form of add()."""
+        def register(func):
+            self.add(name, func, inputs, params, persist, memoize)
+            return func
+        return register
+
+    def _params(self, stage, values):
+        return {key: values.get(key, default) for key, default in stage.params.items()}
+
+    def key(self, name, values, _keys=None):
+        """Content key of a stage (or source) for the given run-time values."""
+        keys = {} if _keys is None else _keys
+        if name in keys:
+            return keys[name]
+        if name not in self.stages:
+            if name not in values:
+                raise KeyError(f"Missing pipeline input: {name}")
+            fingerprint = self.sources.get(name)
+            value = values[name]
+            keys[name] = content_hash(fingerprint(value) if fingerprint else value)
+            return keys[name]
+        stage = self.stages[name]
+        parts = [name, self._params(stage, values)]
+        parts.extend(self.key(input_name, values, keys) for input_name in stage.inputs)
+        keys[name] = content_hash(parts)
+        return keys[name]
+
+    def source_keys(self, **values):
+        """
+        Keys of the given sources, to pass as run(keys=...).
+
+        Fingerprinting a source (e.g. stat-ing every file of a directory) then
+        happens once for a series of runs over the same inputs.
+        """
+        keys = {}
+        for name in values:
+            self.key(name, values, keys)
+        return keys
+
+    def run(self, target, callback=None, keys=None, **values):
+        """
+        Return the output of stage `target`, computing only stages whose key changed.
+
+        `values` supplies sources and param overrides. `callback(stage_name, status)`
+        is called with status 'start', 'done' or 'cached' as stages are resolved.
+        `keys` are already resolved source keys (see source_keys).
+        """
+        keys = dict(keys or {})
+        self.key(target, values, keys)
+        return self._resolve(target, values, keys, callback, {})
+
+    def _resolve(self, name, values, keys, callback, resolved):
+        if name not in self.stages:
+            return values[name]
+        if name in resolved:
+            return resolved[name]
+        stage = self.stages[name]
+        key = keys[name]
+
+        if stage.memoize:
+            found, value = self._lookup(stage, key)
+            if found:
+                if callback:
+                    callback(name, 'cached')
+                resolved[name] = value
+                return value
+
+        inputs = {input_name: self._resolve(input_name, values, keys, callback, resolved)
+                  for input_name in stage.inputs}
+        if callback:
+            callback(name, 'start')
+        value = stage.func(**inputs, **self._params(stage, values))
+        if stage.memoize:
+            self._store(stage, key, value)
+        if callback:
+            callback(name, 'done')
+        resolved[name] = value
+        return value
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _lookup(self, stage, key):
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return True, self._memo[key]
+        if stage.persist and self.cache_dir:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return False, None
+            try:
+                # The mtime orders persisted outputs for eviction
+                os.utime(self._disk_path(key))
+            except OSError:
+                pass
+            self._remember(key, value)
+            return True, value
+        return False, None
+
+    def _store(self, stage, key, value):
+        self._remember(key, value)
+        if stage.persist and self.cache_dir:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = f"{self._disk_path(key)}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError as e:
+                logging.warning(f"Unable to persist pipeline stage {stage.name}: {str(e)}")
+                return
+            self._evict_disk(keep=self._disk_path(key))
+
+    def _evict_disk(self, keep=None):
+        """Remove the least recently used persisted outputs until cache_dir fits in max_disk_bytes."""
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def _remember(self, key, value):
+        size = memory_size(value)
+        with self._lock:
+            self._memo_bytes += size - self._sizes.get(key, 0)
+            self._memo[key] = value
+            self._sizes[key] = size
+            self._memo.move_to_end(key)
+            # The newest output always stays, even if it alone is over max_bytes
+            while len(self._memo) > 1 and (len(self._memo) > self.max_entries or self._memo_bytes > self.max_bytes):
+                old_key, _ = self._memo.popitem(last=False)
+                self._memo_bytes -= self._sizes.pop(old_key)
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+            self._sizes.clear()
+            self._memo_bytes = 0
@@ -0,0 +1,163 @@
+import io
+import os
+from functools import lru_cache
+
+import numpy as np
+import pydicom
+from PIL import Image, ImageDraw
+
+from dicom_volume import DicomVolume
+
+VIEWS = ('axial', 'coronal', 'sagittal')
+# Axis of a (rows, cols, slices) volume that each view's slice index runs along.
+VIEW_AXES = {'axial': 2, 'coronal': 1, 'sagittal': 0}
+NORMALS_VIEW = 'surface_normals_axial'
+
+# Roughly this many glyphs along the longer side of the normals view.
+DEFAULT_MAX_GLYPHS = 48
+NORMALS_IMAGE_SIZE = 512
+NORMALS_COLOR = (255, 0, 0)
+
+
+def window_bounds(metadata, window=None):
+    """(vmin, vmax) of the display window; window=(center, width) overrides the header values."""
+    window_center, window_width = window or (metadata['WindowCenter'], metadata['WindowWidth'])
+    if isinstance(window_center, (pydicom.multival.MultiValue, list)):
+        window_center = window_center[0]
+    if isinstance(window_width, (pydicom.multival.MultiValue, list)):
+        window_width = window_width[0]
+    return window_center - window_width // 2, window_center + window_width // 2
+
+
+def _to_uint8(values, vmin, vmax):
+    # Same binning as matplotlib's 256-entry 'gray' colormap with Normalize(vmin, vmax).
+    scale = np.float32(256.0 / max(float(vmax) - float(vmin), 1e-6))
+    out = np.subtract(values, np.float32(vmin), dtype=np.float32)
+    out *= scale
+    np.floor(out, out=out)
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+
+@lru_cache(maxsize=16)
+def window_lut(dtype, vmin, vmax, slope=1.0, intercept=0.0):
+    """
+    uint8 display value for every stored value of an 8- or 16-bit integer dtype.
+
+    The table is indexed by the stored bits read as unsigned, so a plane maps with
+    lut[plane.view(unsigned)] and the rescale + window arithmetic runs once per
+    possible value instead of once per pixel.
+    """
+    dtype = np.dtype(dtype)
+    index_dtype = np.dtype(f"uint{dtype.itemsize * 8}")
+    stored = np.arange(2 ** (dtype.itemsize * 8), dtype=index_dtype).view(dtype)
+    return _to_uint8(stored.astype(np.float32) * np.float32(slope) + np.float32(intercept), vmin, vmax)
+
+
+def apply_window(image, vmin, vmax, slope=1.0, intercept=0.0):
+    """Map a 2-D plane of stored (or already rescaled, slope=1/intercept=0) values to uint8."""
+    image = np.asarray(image)
+    if image.dtype.kind in 'iu' and image.dtype.itemsize <= 2:
+        lut = window_lut(image.dtype.str, float(vmin), float(vmax), float(slope), float(intercept))
+        return lut[image.view(f"uint{image.dtype.itemsize * 8}")]
+    if slope != 1 or intercept != 0:
+        image = image * np.float32(slope) + np.float32(intercept)
+    return _to_uint8(image, vmin, vmax)
+
+
+def plane(volume, view, index):
+    """
+    (plane, slope, intercept) of slice `index` of a view of a (rows, cols, slices) volume.
+
+    axial planes run along the slices, coronal along the columns and sagittal
+    along the rows (see VIEW_AXES). DicomVolumes with one rescale for the whole
+    series hand out their stored-dtype planes so apply_window can use a LUT;
+    anything else is read as float.
+    """
+    if isinstance(volume, DicomVolume) and volume._uniform_rescale():
+        raw = volume.raw
+        slope, intercept = float(volume.slope[0]), float(volume.intercept[0])
+        if view == 'axial':
+            return raw[index], slope, intercept
+        if view == 'coronal':
+            return raw[:, :, index].T, slope, intercept
+        return raw[:, index, :].T, slope, intercept
+    key = [slice(None)] * 3
+    key[VIEW_AXES[view]] = index
+    return np.asarray(volume[tuple(key)]), 1.0, 0.0
+
+
+def orthogonal_planes(volume):
+    """{view: (plane, slope, intercept)} for the middle axial, coronal and sagittal planes."""
+    return {view: plane(volume, view, volume.shape[VIEW_AXES[view]] // 2) for view in VIEWS}
+
+
+def render_views(volume, metadata, window=None):
+    """Windowed grayscale PIL images of the middle axial, coronal and sagittal planes."""
+    vmin, vmax = window_bounds(metadata, window)
+    return {
+        view: Image.fromarray(apply_window(plane, vmin, vmax, slope, intercept), mode='L')
+        for view, (plane, slope, intercept) in orthogonal_planes(volume).items()
+    }
+
+
+def render_normals(normals, background=None, max_glyphs=DEFAULT_MAX_GLYPHS, size=NORMALS_IMAGE_SIZE):
+    """
+    Glyph view of one plane of normals, shape (rows, cols, 3).
+
+    Normals are sampled on a grid of about max_glyphs per side and each one is
+    drawn as a line from its cell centre along the in-plane part of the vector
+    (component 0 down the rows, component 1 across the columns). `background`
+    is an optional grayscale image of the same plane to draw over.
+    """
+    normals = np.asarray(normals)
+    rows, cols = normals.shape[:2]
+    step = max(1, -(-max(rows, cols) // max_glyphs))
+    zoom = size / max(rows, cols)
+    width, height = max(1, int(round(cols * zoom))), max(1, int(round(rows * zoom)))
+
+    if background is None:
+        canvas = Image.new('RGB', (width, height), (255, 255, 255))
+    else:
+        canvas = background.convert('RGB').resize((width, height), Image.BILINEAR)
+    draw = ImageDraw.Draw(canvas)
+
+    centres_r = np.arange(step // 2, rows, step)
+    centres_c = np.arange(step // 2, cols, step)
+    sampled = normals[centres_r][:, centres_c]
+    length = 0.45 * step * zoom
+    y0 = (centres_r[:, None] + 0.5) * zoom
+    x0 = (centres_c[None, :] + 0.5) * zoom
+    y1 = y0 + sampled[..., 0] * length
+    x1 = x0 + sampled[..., 1] * length
+    for segment in np.stack(np.broadcast_arrays(x0, y0, x1, y1), axis=-1).reshape(-1, 4):
+        draw.line(segment.tolist(), fill=NORMALS_COLOR, width=1)
+    return canvas
+
+
+def render_previews(volume, metadata, normals=None, window=None, max_glyphs=DEFAULT_MAX_GLYPHS):
+    """The preview images the GUI shows, as {name: PIL image}, without touching the disk."""
+    images = render_views(volume, metadata, window)
+    if normals is not None:
+        # Either the full (X, Y, Z, 3) field or just the axial mid-slice (X, Y, 3).
+        if normals.ndim == 4:
+            normals = normals[:, :, volume.shape[2] // 2]
+        images[NORMALS_VIEW] = render_normals(normals, images['axial'], max_glyphs)
+    return images
+
+
+def to_png_bytes(image):
+    """Encode a PIL image as PNG in memory."""
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def save_previews(images, directory='.'):
+    """Write each preview as <name>.png (axial.png, coronal.png, ...) and return the paths."""
+    paths = []
+    for name, image in images.items():
+        path = os.path.join(directory, f"{name}.png")
+        image.save(path)
+        paths.append(path)
+    return paths
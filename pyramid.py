@@ -0,0 +1,148 @@
+import os
+import shutil
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+import dicom_catalog
+from pipeline import content_hash
+
+DEFAULT_FACTORS = (2, 4, 8)
+
+# Pyramids of the most recently used arrays kept in memory and on disk.
+MEMORY_ENTRIES = 4
+DISK_ENTRIES = 16
+
+
+def reduce2(array):
+    """
+    2x block mean along every axis (trailing odd planes dropped), as float32.
+
+    Boolean/uint8 masks are summed as small integers first, so a level of a
+    binary mask holds exact occupancy fractions (0, 1/8, ..., 1).
+    """
+    array = np.asarray(array)
+    n0, n1, n2 = (max(1, n // 2) for n in array.shape)
+    trimmed = array[:2 * n0, :2 * n1, :2 * n2]
+    # An axis of length 1 reads its only plane twice, which keeps the mean exact.
+    offsets = [(0, 1) if n >= 2 else (0, 0) for n in array.shape]
+    integer = trimmed.dtype == np.bool_ or trimmed.dtype == np.uint8
+    total = np.zeros((n0, n1, n2), dtype=np.uint16 if integer else np.float32)
+    for i in offsets[0]:
+        for j in offsets[1]:
+            for k in offsets[2]:
+                total += trimmed[i::2, j::2, k::2]
+    if integer:
+        return total.astype(np.float32) * np.float32(1 / 8)
+    total *= np.float32(1 / 8)
+    return total
+
+
+class Pyramid:
+    """
+    Mipmap levels of a 3-D array: level[1] is the array itself, level[f] is f times smaller per axis.
+
+    Reduced levels are float32 and Fortran-ordered, so `ravel(order='F')` (the
+    layout VTK/PyVista grids expect) is a view rather than a copy.
+    """
+
+    def __init__(self, base, levels):
+        self.levels = {1: base}
+        self.levels.update(levels)
+
+    @classmethod
+    def build(cls, array, factors=DEFAULT_FACTORS):
+        levels = {}
+        current, current_factor = array, 1
+        for factor in sorted(factors):
+            # Each level is reduced from the previous one, so 8x costs 1/64 of the 2x pass.
+            while current_factor < factor:
+                current = reduce2(current)
+                current_factor *= 2
+            levels[factor] = np.asfortranarray(current)
+        return cls(array, levels)
+
+    @property
+    def factors(self):
+        return sorted(self.levels)
+
+    def level(self, factor):
+        """The level closest to `factor`."""
+        return self.levels[min(self.levels, key=lambda f: abs(np.log2(f) - np.log2(max(factor, 1))))]
+
+    def coarse_to_fine(self, finest=1):
+        """(factor, array) pairs from the coarsest level down to `finest`."""
+        return [(f, self.levels[f]) for f in sorted(self.levels, reverse=True) if f >= finest]
+
+
+_memory = OrderedDict()
+
+
+def _cache_dir(key):
+    return os.path.join(dicom_catalog.CACHE_ROOT, 'pyramids', key)
+
+
+def _load(key, factors):
+    levels = {}
+    for factor in factors:
+        try:
+            levels[factor] = np.load(os.path.join(_cache_dir(key), f"level_{factor}.npy"), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+    try:
+        os.utime(_cache_dir(key))
+    except OSError:
+        pass
+    return levels
+
+
+def _save(key, pyramid):
+    directory = _cache_dir(key)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for factor, level in pyramid.levels.items():
+            if factor == 1:
+                continue
+            tmp_path = os.path.join(directory, f"level_{factor}.tmp.npy")
+            np.save(tmp_path, level)
+            os.replace(tmp_path, os.path.join(directory, f"level_{factor}.npy"))
+    except OSError as e:
+        logging.warning(f"Unable to cache pyramid in {directory}: {str(e)}")
+        return
+    _evict()
+
+
+def _evict():
+    root = os.path.dirname(_cache_dir('x'))
+    entries = sorted((os.path.getmtime(os.path.join(root, name)), name) for name in os.listdir(root))
+    for _, name in entries[:-DISK_ENTRIES]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def get_pyramid(array, factors=DEFAULT_FACTORS, persist=True, key=None):
+    """
+    Pyramid of `array`, built once per distinct content.
+
+    Pyramids are kept in a small in-memory LRU and, with persist=True, as .npy
+    files under the cache root that later runs memory-map instead of rebuilding.
+    `key` is any hashable value that changes whenever the array's content does,
+    such as the source fingerprint and the steps that produced it; without one
+    the array's bytes are hashed.
+    """
+    key = content_hash([key if key is not None else np.asarray(array), sorted(factors)])
+    if key in _memory:
+        _memory.move_to_end(key)
+        return Pyramid(array, _memory[key])
+
+    levels = _load(key, factors) if persist else None
+    if levels is None:
+        pyramid = Pyramid.build(array, factors)
+        levels = {f: level for f, level in pyramid.levels.items() if f != 1}
+        if persist:
+            _save(key, pyramid)
+
+    _memory[key] = levels
+    while len(_memory) > MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+    return Pyramid(array, levels)
@@ -0,0 +1,212 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from dicom_volume import as_float_array
+
+# Spacings closer than this (relative) are treated as equal.
+SPACING_RTOL = 1e-6
+
+DOWNSAMPLE_MODES = ('mean', 'decimate', 'linear')
+
+
+def zoom_shape(shape, zoom_factors):
+    """Output shape scipy.ndimage.zoom would produce for these factors."""
+    return tuple(int(round(n * f)) for n, f in zip(shape, zoom_factors))
+
+
+def resolve_target_spacing(voxel_size, target_voxel_size=None, scale=None):
+    """
+    Turn a target spacing request into an absolute (x, y, z) spacing in mm.
+
+    target_voxel_size may be a 3-tuple, a single number (isotropic), or None /
+    'isotropic' for isotropic at the finest native spacing. Alternatively `scale`
+    (a number or 3-tuple) gives the target relative to the native voxel size,
+    e.g. scale=2 halves the resolution on every axis.
+    """
+    voxel_size = tuple(float(v) for v in voxel_size)
+    if scale is not None:
+        return tuple(v * float(s) for v, s in zip(voxel_size, np.broadcast_to(scale, 3)))
+    if target_voxel_size is None or target_voxel_size == 'isotropic':
+        return (min(voxel_size),) * 3
+    if np.isscalar(target_voxel_size):
+        return (float(target_voxel_size),) * 3
+    return tuple(float(v) for v in target_voxel_size)
+
+
+def axis_weights(in_len, out_len, dtype=np.float32):
+    """
+    Linear interpolation taps for one axis, with zoom's corner-aligned mapping.
+
+    Output index k samples input coordinate k * (in_len - 1) / (out_len - 1),
+    clamped to the last input index.
+    """
+    step = (in_len - 1) / (out_len - 1) if out_len > 1 else 0.0
+    coords = np.minimum(np.arange(out_len, dtype=np.float64) * step, in_len - 1)
+    i0 = np.floor(coords).astype(np.intp)
+    i1 = np.minimum(i0 + 1, in_len - 1)
+    w1 = coords - i0
+    return i0, i1, (1.0 - w1).astype(dtype), w1.astype(dtype)
+
+
+class ResamplePlan:
+    """
+    Per-axis resampling steps for one volume shape and spacing change.
+
+    Each axis gets one step: 'skip' when it is already at the target spacing,
+    'mean' (block average) or 'decimate' for integer downsampling factors, and
+    'linear' otherwise. Axes are processed one at a time, those that shrink the
+    data most first, and every step only ever needs a single input plane range.
+    """
+
+    def __init__(self, shape, voxel_size, target_voxel_size=None, scale=None,
+                 downsample='mean', dtype=np.float32):
+        if downsample not in DOWNSAMPLE_MODES:
+            raise ValueError(f"Unknown downsample mode: {downsample}")
+        self.in_shape = tuple(int(n) for n in shape)
+        self.voxel_size = tuple(float(v) for v in voxel_size)
+        self.target_spacing = resolve_target_spacing(voxel_size, target_voxel_size, scale)
+        self.dtype = np.dtype(dtype)
+
+        self.steps = []
+        for n, old, new in zip(self.in_shape, self.voxel_size, self.target_spacing):
+            factor = old / new
+            block = int(round(1 / factor))
+            if abs(factor - 1) <= SPACING_RTOL:
+                self.steps.append(('skip', n))
+            elif downsample != 'linear' and block >= 2 and abs(block * factor - 1) <= SPACING_RTOL and n >= block:
+                self.steps.append((downsample, block))
+            else:
+                self.steps.append(('linear', max(1, int(round(n * factor)))))
+
+        self.out_shape = tuple(self._out_len(axis) for axis in range(3))
+        self.order = sorted(range(3), key=lambda axis: self.out_shape[axis] / self.in_shape[axis])
+        self._taps = {
+            axis: axis_weights(self.in_shape[axis], self.out_shape[axis], self.dtype)
+            for axis, (kind, _) in enumerate(self.steps) if kind == 'linear'
+        }
+
+    def _out_len(self, axis):
+        kind, arg = self.steps[axis]
+        if kind in ('skip', 'linear'):
+            return arg
+        return self.in_shape[axis] // arg
+
+    def source_range(self, axis, start, stop):
+        """Input index range [lo, hi) along `axis` needed for outputs [start, stop)."""
+        kind, arg = self.steps[axis]
+        if kind == 'skip':
+            return start, stop
+        if kind == 'linear':
+            i0, i1, _, _ = self._taps[axis]
+            return int(i0[start]), int(i1[stop - 1]) + 1
+        if kind == 'mean':
+            return start * arg, stop * arg
+        return start * arg, (stop - 1) * arg + 1
+
+    def apply_axis(self, array, axis, start=0, stop=None, offset=0, workers=1):
+        """
+        Run this axis' step on `array`, producing outputs [start, stop) along `axis`.
+
+        `array` holds input indices [offset, offset + array.shape[axis]) of that axis
+        and the full extent of the others. Work is split across `workers` threads
+        along another axis; the per-voxel arithmetic does not depend on the split.
+        """
+        if stop is None:
+            stop = self.out_shape[axis]
+        kind, arg = self.steps[axis]
+        if kind == 'skip' and start == offset and stop - start == array.shape[axis]:
+            return array.astype(self.dtype, copy=False)
+        src = np.moveaxis(array, axis, 0)
+        dst = np.empty((stop - start,) + src.shape[1:], dtype=self.dtype)
+
+        def run(cols):
+            s, d = src[:, cols], dst[:, cols]
+            if kind == 'skip':
+                d[...] = s[start - offset:stop - offset]
+            elif kind == 'linear':
+                i0, i1, w0, w1 = (tap[start:stop] for tap in self._taps[axis])
+                tmp = np.empty(d.shape[1:], dtype=self.dtype)
+                for k in range(len(d)):
+                    np.multiply(s[i0[k] - offset], w0[k], out=d[k], casting='unsafe')
+                    np.multiply(s[i1[k] - offset], w1[k], out=tmp, casting='unsafe')
+                    d[k] += tmp
+            elif kind == 'mean':
+                scale = self.dtype.type(1.0 / arg)
+                for k in range(len(d)):
+                    first = (start + k) * arg - offset
+                    d[k] = s[first]
+                    for m in range(1, arg):
+                        d[k] += s[first + m]
+                    d[k] *= scale
+            else:
+                d[...] = s[start * arg - offset:(stop - 1) * arg + 1 - offset:arg]
+
+        _run_chunked(run, dst.shape[1] if dst.ndim > 1 else 1, workers)
+        return np.moveaxis(dst, 0, axis)
+
+    @property
+    def is_identity(self):
+        """True when every axis is a skip, so the steps would hand back their input."""
+        return all(kind == 'skip' for kind, _ in self.steps)
+
+    def apply(self, array, workers=None):
+        """Resample a whole in-memory volume; the result never aliases `array`."""
+        if self.is_identity:
+            return np.array(array, dtype=self.dtype)
+        workers = _resolve_workers(workers)
+        for axis in self.order:
+            array = self.apply_axis(array, axis, workers=workers)
+        return array
+
+    def iter_z_slabs(self, volume, slab_size, workers=None):
+        """
+        Yield (z_start, slab) over the output z axis, reading only the input planes each slab needs.
+
+        Slabs go through exactly the per-voxel steps apply() performs, so stacking
+        them reproduces apply(volume) bit for bit. Slabs never alias `volume`.
+        """
+        workers = _resolve_workers(workers)
+        z_position = self.order.index(2)
+        for start in range(0, self.out_shape[2], slab_size):
+            stop = min(start + slab_size, self.out_shape[2])
+            lo, hi = self.source_range(2, start, stop)
+            planes = as_float_array(volume[:, :, lo:hi])
+            if self.is_identity:
+                planes = np.array(planes, dtype=self.dtype)
+            for axis in self.order[:z_position]:
+                planes = self.apply_axis(planes, axis, workers=workers)
+            planes = self.apply_axis(planes, 2, start, stop, offset=lo, workers=workers)
+            for axis in self.order[z_position + 1:]:
+                planes = self.apply_axis(planes, axis, workers=workers)
+            yield start, planes
+
+
+def _resolve_workers(workers):
+    return workers if workers is not None else (os.cpu_count() or 1)
+
+
+def _run_chunked(run, length, workers):
+    workers = max(1, min(workers, length))
+    if workers == 1:
+        run(slice(None))
+        return
+    bounds = np.linspace(0, length, workers + 1).astype(int)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, slice(lo, hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        for future in futures:
+            future.result()
+
+
+def resample(volume, voxel_size, target_voxel_size=None, scale=None, downsample='mean',
+             dtype=np.float32, workers=None):
+    """
+    Resample a volume to a new voxel spacing and return it as `dtype` (float32 by default).
+
+    See resolve_target_spacing for the ways to give the target, and ResamplePlan for
+    how each axis is handled. Axes already at the target spacing are left untouched.
+    """
+    volume = as_float_array(volume)
+    plan = ResamplePlan(volume.shape, voxel_size, target_voxel_size, scale, downsample, dtype)
+    return plan.apply(volume, workers=workers)
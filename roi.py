@@ -0,0 +1,102 @@
+import numpy as np
+
+from dicom_volume import as_float_array
+from resampling import ResamplePlan
+
+DEFAULT_FACTOR = 4
+DEFAULT_MARGIN = 8
+
+# Axial planes per slab when building the proxy, so lazy volumes are read piecewise.
+PROXY_SLAB_SIZE = 32
+
+
+def downsample_proxy(volume, factor=DEFAULT_FACTOR):
+    """Block-mean proxy of a volume, factor times smaller per axis (trailing partial blocks dropped)."""
+    plan = ResamplePlan(volume.shape, (1, 1, 1), scale=factor, downsample='mean')
+    slabs = [slab for _, slab in plan.iter_z_slabs(volume, PROXY_SLAB_SIZE)]
+    return np.concatenate(slabs, axis=2)
+
+
+def bounding_box(mask):
+    """Tight box around the True voxels of a 3-D mask as (start, stop) tuples, or None if empty."""
+    mask = np.asarray(mask, dtype=bool)
+    start, stop = [], []
+    for axis in range(mask.ndim):
+        hits = np.flatnonzero(mask.any(axis=tuple(a for a in range(mask.ndim) if a != axis)))
+        if len(hits) == 0:
+            return None
+        start.append(int(hits[0]))
+        stop.append(int(hits[-1]) + 1)
+    return tuple(start), tuple(stop)
+
+
+def scale_box(box, factor, margin, shape, proxy_shape):
+    """Map a proxy box to full-resolution slices, padded by `margin` voxels and clipped to `shape`."""
+    start, stop = box
+    slices = []
+    for lo, hi, n, proxy_n in zip(start, stop, shape, proxy_shape):
+        full_hi = n if hi >= proxy_n else hi * factor
+        slices.append(slice(max(0, lo * factor - margin), min(n, full_hi + margin)))
+    return tuple(slices)
+
+
+def filter_margin(reaches, factor=DEFAULT_FACTOR):
+    """
+    Padding for a crop box: the summed reach in voxels of the filters a segment
+    applies in sequence, plus one proxy block for the coarse box edge. A ball
+    closing or opening of radius r reaches 2r (a dilation and an erosion).
+    """
+    return int(sum(reaches)) + factor
+
+
+def locate(volume, detect, factor=DEFAULT_FACTOR, margin=DEFAULT_MARGIN):
+    """
+    Find the region of interest on a downsampled proxy.
+
+    `detect(proxy)` returns a boolean mask of the structure on the proxy. Returns a
+    tuple of slices into `volume`; the whole volume if the proxy would be too small
+    or nothing is detected.
+    """
+    whole = tuple(slice(0, n) for n in volume.shape)
+    if min(volume.shape) < 2 * factor:
+        return whole
+    proxy = downsample_proxy(volume, factor)
+    box = bounding_box(detect(proxy))
+    if box is None:
+        return whole
+    return scale_box(box, factor, margin, volume.shape, proxy.shape)
+
+
+def paste(crop_mask, box, shape):
+    """Place a mask computed on volume[box] into an all-False mask of the full shape."""
+    full = np.zeros(shape, dtype=bool)
+    full[box] = crop_mask
+    return full
+
+
+def box_metadata(box, shape, factor=DEFAULT_FACTOR, margin=DEFAULT_MARGIN):
+    """JSON-friendly description of a crop box, for the segmentation output metadata."""
+    size = [sl.stop - sl.start for sl in box]
+    return {
+        'start': [sl.start for sl in box],
+        'stop': [sl.stop for sl in box],
+        'shape': size,
+        'fraction': float(np.prod(size) / np.prod(shape)),
+        'factor': factor,
+        'margin': margin,
+    }
+
+
+def coarse_to_fine(volume, detect, segment, factor=DEFAULT_FACTOR, margin=DEFAULT_MARGIN):
+    """
+    Run `segment` at full resolution only inside the box `detect` finds on a proxy.
+
+    `segment(crop)` gets the cropped float volume and returns its mask. Returns
+    (mask, metadata): the mask in full-volume coordinates and {'roi': box_metadata}.
+    `margin` should cover the reach of the segment's filters so results near the
+    box edge match a full-volume run.
+    """
+    box = locate(volume, detect, factor, margin)
+    crop_mask = segment(as_float_array(volume[box]))
+    mask = paste(crop_mask, box, volume.shape)
+    return mask, {'roi': box_metadata(box, volume.shape, factor, margin)}
@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import OrderedDict
+
+import dicom_catalog
+import featureExtraction
+
+# Studies (selected folders) kept decoded in memory at once.
+DEFAULT_MAX_STUDIES = 2
+
+
+class Study:
+    """
+    Everything derived from one DICOM folder at one fingerprint.
+
+    Holds the events of the first complete feature extraction (feature table,
+    decoded volume, preview images) so every later extraction replays them
+    instead of decoding again. Products are stored under the study's lock, so a
+    GUI worker and the Tk thread see a consistent set.
+    """
+
+    def __init__(self, directory, fingerprint, use_cache=True):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.use_cache = use_cache
+        self.products = {}
+        self._lock = threading.RLock()
+
+    def put(self, name, value):
+        with self._lock:
+            self.products[name] = value
+
+    def iter_features(self, callback=None):
+        """
+        featureExtraction.iter_features for this folder, replayed from memory after the first complete run.
+
+        Events are recorded as they stream past; only a run that finishes is kept,
+        so a cancelled extraction simply starts over next time.
+        """
+        with self._lock:
+            events = self.products.get('feature_events')
+        if events is not None:
+            yield from events
+            return
+        events = []
+        for event in featureExtraction.iter_features(self.directory, self.use_cache, callback=callback):
+            events.append(event)
+            yield event
+        self.put('feature_events', events)
+
+
+class Session:
+    """
+    The studies the application is working on, in a bounded in-memory LRU.
+
+    study(directory) returns the resident Study for a folder as long as the
+    folder's directory_fingerprint (path, size and mtime of every .dcm file; no
+    file is opened) is unchanged, and a fresh one when files were added, removed
+    or modified. The least recently used study is dropped beyond max_studies.
+    """
+
+    def __init__(self, max_studies=DEFAULT_MAX_STUDIES, use_cache=True):
+        self.max_studies = max_studies
+        self.use_cache = use_cache
+        self._studies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def study(self, directory):
+        key = os.path.abspath(directory)
+        fingerprint = dicom_catalog.directory_fingerprint(directory)
+        with self._lock:
+            study = self._studies.get(key)
+            if study is None or study.fingerprint != fingerprint:
+                study = Study(directory, fingerprint, self.use_cache)
+                self._studies[key] = study
+            self._studies.move_to_end(key)
+            while len(self._studies) > self.max_studies:
+                self._studies.popitem(last=False)
+            return study
+
+    def forget(self, directory):
+        with self._lock:
+            self._studies.pop(os.path.abspath(directory), None)
+
+    def clear(self):
+        with self._lock:
+            self._studies.clear()
@@ -0,0 +1,82 @@
+import numpy as np
+
+from dicom_volume import as_float_array
+from resampling import ResamplePlan
+from surface_normals import sobel_normals
+
+DEFAULT_SLAB_SIZE = 32
+
+# sobel_normals uses 3-tap Sobel kernels, so each slab needs one extra plane per side.
+NORMALS_HALO = 1
+
+
+def iter_slabs(volume, slab_size=DEFAULT_SLAB_SIZE):
+    """Yield (z_start, slab) float blocks of at most slab_size axial planes."""
+    depth = volume.shape[2]
+    for start in range(0, depth, slab_size):
+        yield start, as_float_array(volume[:, :, start:start + slab_size])
+
+
+def _slab_source(source, slab_size):
+    if hasattr(source, 'shape'):
+        return iter_slabs(source, slab_size)
+    return iter(source)
+
+
+def _with_halo(slabs, halo):
+    """
+    Yield (z_start, window, core_offset, core_len) for consecutive (z_start, slab) pairs.
+
+    The window is the slab padded with up to `halo` planes from each neighbour; at the
+    first and last slab it stops at the volume edge, like the in-memory filters do.
+    """
+    tail = None
+    pending = None
+    for start, slab in slabs:
+        if pending is not None:
+            yield _window(pending, tail, slab[:, :, :halo])
+            tail = pending[1] if tail is None else np.concatenate([tail, pending[1]], axis=2)
+            tail = tail[:, :, -halo:]
+        pending = (start, slab)
+    if pending is not None:
+        yield _window(pending, tail, None)
+
+
+def _window(pending, tail, head):
+    start, slab = pending
+    parts = [p for p in (tail, slab, head) if p is not None]
+    offset = 0 if tail is None else tail.shape[2]
+    window = parts[0] if len(parts) == 1 else np.concatenate(parts, axis=2)
+    return start, window, offset, slab.shape[2]
+
+
+def stream_resample(volume, voxel_size, target_voxel_size=None, slab_size=DEFAULT_SLAB_SIZE, **plan_options):
+    """
+    Generator form of resample_volume: yields (z_start, slab) over the resampled z axis.
+
+    Each output slab reads only the input planes its z step touches and runs the
+    same per-voxel arithmetic as the in-memory path (ResamplePlan.iter_z_slabs),
+    so stacking the slabs reproduces resample_volume bit for bit.
+    """
+    workers = plan_options.pop('workers', None)
+    plan = ResamplePlan(volume.shape, voxel_size, target_voxel_size, **plan_options)
+    return plan.iter_z_slabs(volume, slab_size, workers=workers)
+
+
+def stream_surface_normals(source, slab_size=DEFAULT_SLAB_SIZE):
+    """
+    Generator form of compute_surface_normals / surface_normals.sobel_normals: yields (z_start, normals_slab).
+
+    `source` is a volume or an iterator of (z_start, slab) pairs such as
+    stream_resample, so the two stages chain without materializing either volume.
+    """
+    for start, window, offset, length in _with_halo(_slab_source(source, slab_size), NORMALS_HALO):
+        normals = sobel_normals(window)
+        yield start, normals[:, :, offset:offset + length]
+
+
+def write_slabs(slabs, out):
+    """Copy (z_start, slab) pairs into their z-range of `out` (e.g. an np.memmap) and return it."""
+    for start, slab in slabs:
+        out[:, :, start:start + slab.shape[2]] = slab
+    return out
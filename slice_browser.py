@@ -0,0 +1,153 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import preview
+from dicom_volume import DicomVolume
+
+# Rendered slices kept in memory; at the 512 px display size this is about 64 MB.
+DEFAULT_CACHE_SLICES = 256
+# Slices rendered ahead of the current one in the scroll direction.
+DEFAULT_PREFETCH = 12
+# Longer side of a rendered slice, in pixels.
+DEFAULT_DISPLAY_SIZE = 512
+# Percentiles used as the display window when the header has none.
+AUTO_WINDOW_PERCENTILES = (0.5, 99.5)
+
+
+def default_window(volume, metadata=None):
+    """
+    (vmin, vmax) to open a volume with: the header's WindowCenter/WindowWidth, or
+    the 0.5-99.5 percentile range of the intensities when the header has none.
+    """
+    if metadata is not None and metadata.get('WindowCenter') is not None and metadata.get('WindowWidth') is not None:
+        return preview.window_bounds(metadata)
+    if isinstance(volume, DicomVolume):
+        stats = volume.intensity_stats()
+        # Only 8/16-bit data has the histogram percentiles come from; others use the full range.
+        vmin, vmax = stats.percentile(AUTO_WINDOW_PERCENTILES) if stats.histograms else stats.bounds
+    else:
+        vmin, vmax = np.percentile(np.asarray(volume), AUTO_WINDOW_PERCENTILES)
+    if vmax <= vmin:
+        vmax = vmin + 1
+    return float(vmin), float(vmax)
+
+
+class SliceRenderer:
+    """
+    Windowed axial, coronal and sagittal slices of an in-memory volume, for scrolling.
+
+    image(view, index) maps the stored plane through preview.apply_window (a
+    window LUT for 8/16-bit DicomVolumes), scales it to the display size and keeps
+    it in an LRU of rendered slices keyed by (view, index, window). Every request
+    also queues the next `prefetch` slices in the direction the view was last
+    scrolled on a background thread, so a steady scroll finds its slices already
+    rendered. A newer request supersedes queued prefetches that have not started.
+    """
+
+    def __init__(self, volume, metadata=None, voxel_size=(1, 1, 1), window=None,
+                 cache_slices=DEFAULT_CACHE_SLICES, prefetch=DEFAULT_PREFETCH,
+                 display_size=DEFAULT_DISPLAY_SIZE):
+        self.volume = volume
+        self.voxel_size = tuple(float(v) for v in voxel_size)
+        self.window = tuple(window) if window is not None else default_window(volume, metadata)
+        self.cache_slices = cache_slices
+        self.prefetch = prefetch
+        self.display_size = display_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._last = {}
+        self._generation = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slice-prefetch')
+
+    def num_slices(self, view):
+        return self.volume.shape[preview.VIEW_AXES[view]]
+
+    def value_range(self):
+        """(minimum, maximum) intensity of the volume, the range a window can be dragged over."""
+        if isinstance(self.volume, DicomVolume):
+            vmin, vmax = self.volume.intensity_stats().bounds
+        else:
+            values = np.asarray(self.volume)
+            vmin, vmax = values.min(), values.max()
+        return float(vmin), float(vmax)
+
+    def set_window(self, vmin, vmax):
+        # Slices of the previous window simply age out of the LRU.
+        self.window = (float(vmin), float(vmax))
+
+    def image_size(self, view):
+        """(width, height) of a rendered slice: the plane's physical aspect ratio fitted into display_size."""
+        rows, cols, num_slices = self.volume.shape
+        row_mm, col_mm, slice_mm = self.voxel_size
+        height, width = {
+            'axial': (rows * row_mm, cols * col_mm),
+            'coronal': (rows * row_mm, num_slices * slice_mm),
+            'sagittal': (cols * col_mm, num_slices * slice_mm),
+        }[view]
+        zoom = self.display_size / max(height, width)
+        return max(1, int(round(width * zoom))), max(1, int(round(height * zoom)))
+
+    def image(self, view, index):
+        """The rendered slice `index` of a view as a PIL 'L' image; prefetches its neighbours."""
+        index = min(max(int(index), 0), self.num_slices(view) - 1)
+        key = (view, index) + self.window
+        image = self._cached(key)
+        if image is None:
+            image = self._store(key, self._render(view, index, self.window))
+
+        last = self._last.get(view)
+        self._last[view] = index
+        if last is not None and last != index and self.prefetch:
+            self._schedule(view, index, 1 if index > last else -1)
+        return image
+
+    def close(self):
+        """Stop prefetching; queued slices are dropped."""
+        self._generation += 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _cached(self, key):
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+            return image
+
+    def _store(self, key, image):
+        with self._lock:
+            self._cache[key] = image
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_slices:
+                self._cache.popitem(last=False)
+        return image
+
+    def _render(self, view, index, window):
+        plane, slope, intercept = preview.plane(self.volume, view, index)
+        pixels = preview.apply_window(plane, window[0], window[1], slope, intercept)
+        image = Image.fromarray(np.ascontiguousarray(pixels), mode='L')
+        size = self.image_size(view)
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        return image
+
+    def _schedule(self, view, index, step):
+        self._generation += 1
+        generation, window = self._generation, self.window
+        last = self.num_slices(view) - 1
+        ahead = [i for i in range(index + step, index + step * (self.prefetch + 1), step) if 0 <= i <= last]
+        try:
+            self._executor.submit(self._prefetch, generation, view, ahead, window)
+        except RuntimeError:
+            pass  # closed
+
+    def _prefetch(self, generation, view, indices, window):
+        for index in indices:
+            if generation != self._generation:
+                return
+            key = (view, index) + window
+            if self._cached(key) is None:
+                self._store(key, self._render(view, index, window))
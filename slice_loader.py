@@ -0,0 +1,159 @@
+import os
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import dicom_catalog
+from intensity_stats import summarize_slice
+
+DEFAULT_MAX_INFLIGHT_BYTES = 256 * 1024 * 1024
+
+
+def _slot(out, axis, index):
+    key = [slice(None)] * out.ndim
+    key[axis] = index
+    return tuple(key)
+
+
+def _write_slice(out, axis, index, pixel_array, slope, intercept):
+    if slope is None:
+        out[_slot(out, axis, index)] = pixel_array
+    else:
+        out[_slot(out, axis, index)] = pixel_array * slope + intercept
+
+
+def _rescale_args(slice_data, rescale):
+    if not rescale:
+        return None, None
+    return slice_data['RescaleSlope'], slice_data['RescaleIntercept']
+
+
+def _decode_into(out, axis, index, slice_data, rescale=True, stats=None):
+    pixel_array = dicom_catalog.slice_pixels(slice_data)
+    _write_slice(out, axis, index, pixel_array, *_rescale_args(slice_data, rescale))
+    if stats is not None:
+        stats.update(pixel_array, slice_data['RescaleSlope'], slice_data['RescaleIntercept'])
+
+
+def _decode_into_memmap(filename, axis, index, filepath, slope, intercept, summarize=False):
+    # Runs in a worker process: reopen the shared .npy and fill only this slice's slot.
+    out = np.lib.format.open_memmap(filename, mode='r+')
+    pixel_array = dicom_catalog.read_pixel_data(filepath)
+    _write_slice(out, axis, index, pixel_array, slope, intercept)
+    out.flush()
+    del out
+    # The slice's histogram goes back to the parent, which merges it into the running stats.
+    return summarize_slice(pixel_array) if summarize else None
+
+
+def _slice_nbytes(slice_data, out, axis):
+    bits = slice_data.get('BitsAllocated') or 16
+    decoded = slice_data['Rows'] * slice_data['Columns'] * bits // 8
+    written = out[_slot(out, axis, 0)].nbytes
+    return decoded + written
+
+
+def decode_series(slices, out, axis=-1, workers=None, executor='thread',
+                  max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES, rescale=True, stats=None):
+    """
+    Decode every slice of a series into its slot along `axis` of the preallocated `out`.
+
+    Slices are decoded on a thread ('thread') or process ('process') pool of `workers`
+    workers (default: all CPUs). Slot i always receives slices[i], so the result does
+    not depend on completion order. At most `max_inflight_bytes` worth of slices are
+    submitted at any time. Process workers write through a shared .npy memmap: `out`
+    is used directly if it is one, otherwise a temporary file is filled and copied in.
+    With rescale=False the stored values are written without RescaleSlope/Intercept.
+    An IntensityStats passed as `stats` is updated with every slice as it is decoded,
+    so min/max/histogram of the series come without another pass over `out`.
+    """
+    axis = axis % out.ndim
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1 or len(slices) <= 1:
+        for i, slice_data in enumerate(slices):
+            _decode_into(out, axis, i, slice_data, rescale, stats)
+        return out
+
+    if executor == 'process':
+        return _decode_series_processes(slices, out, axis, workers, max_inflight_bytes, rescale, stats)
+    if executor != 'thread':
+        raise ValueError(f"Unknown executor: {executor}")
+
+    max_inflight = max(1, max_inflight_bytes // _slice_nbytes(slices[0], out, axis))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        _run_bounded(slices, max_inflight, lambda i, s: pool.submit(_decode_into, out, axis, i, s, rescale, stats))
+    return out
+
+
+def _npy_filename(out):
+    # Workers can only share `out` if it is a whole, C-ordered .npy memmap they can reopen.
+    filename = getattr(out, 'filename', None)
+    if not isinstance(out, np.memmap) or not filename or not str(filename).endswith('.npy'):
+        return None
+    if not out.flags.c_contiguous or out.offset != np.lib.format.open_memmap(filename, mode='r').offset:
+        return None
+    return str(filename)
+
+
+def _decode_series_processes(slices, out, axis, workers, max_inflight_bytes, rescale, stats):
+    filename = _npy_filename(out)
+    tmp_dir = None
+    if filename is None:
+        tmp_dir = tempfile.mkdtemp(prefix='dental3d-')
+        filename = os.path.join(tmp_dir, 'volume.npy')
+        target = np.lib.format.open_memmap(filename, mode='w+', dtype=out.dtype, shape=out.shape)
+    else:
+        target = out
+        target.flush()
+
+    max_inflight = max(1, max_inflight_bytes // _slice_nbytes(slices[0], out, axis))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            def submit(i, slice_data):
+                if slice_data.get('PixelData') is not None:
+                    # Already decoded (the slice carries its PixelData); nothing to hand off.
+                    _decode_into(target, axis, i, slice_data, rescale, stats)
+                    return None
+                future = pool.submit(_decode_into_memmap, filename, axis, i, slice_data['filepath'],
+                                     *_rescale_args(slice_data, rescale), stats is not None)
+                if stats is not None:
+                    future.add_done_callback(lambda f, s=slice_data: _merge_summary(stats, f, s))
+                return future
+
+            _run_bounded(slices, max_inflight, submit)
+
+        if target is not out:
+            out[...] = target
+    finally:
+        if tmp_dir is not None:
+            del target
+            try:
+                os.remove(filename)
+                os.rmdir(tmp_dir)
+            except OSError as e:
+                logging.warning(f"Unable to remove temporary volume {filename}: {str(e)}")
+    return out
+
+
+def _merge_summary(stats, future, slice_data):
+    if future.cancelled() or future.exception() is not None:
+        return
+    stats.merge(future.result(), slice_data['RescaleSlope'], slice_data['RescaleIntercept'])
+
+
+def _run_bounded(slices, max_inflight, submit):
+    pending = set()
+    for i, slice_data in enumerate(slices):
+        if len(pending) >= max_inflight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        future = submit(i, slice_data)
+        if future is not None:
+            pending.add(future)
+    for future in wait(pending).done:
+        future.result()
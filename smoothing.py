@@ -0,0 +1,145 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.ndimage import correlate1d
+
+DEFAULT_TRUNCATE = 4.0
+
+# Planes per slab for the threaded passes.
+SLAB_SIZE = 32
+
+# The fused smooth-then-threshold re-reads a halo on both sides of each slab, so it uses larger slabs.
+FUSED_SLAB_SIZE = 64
+
+
+def gaussian_kernel(sigma, truncate=DEFAULT_TRUNCATE):
+    """1-D Gaussian weights with scipy.ndimage's radius (int(truncate * sigma + 0.5)) and normalization."""
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    weights = np.exp(-0.5 / float(sigma) ** 2 * x ** 2)
+    return weights / weights.sum()
+
+
+def _resolve_workers(workers):
+    return workers if workers is not None else (os.cpu_count() or 1)
+
+
+def _run_slabs(run, length, workers, slab_size=SLAB_SIZE):
+    ranges = [(lo, min(lo + slab_size, length)) for lo in range(0, length, slab_size)]
+    workers = max(1, min(_resolve_workers(workers), len(ranges)))
+    if workers == 1:
+        for lo, hi in ranges:
+            run(lo, hi)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(run, lo, hi) for lo, hi in ranges]:
+            future.result()
+
+
+def _pass(src, dst, weights, axis, workers):
+    # A 1-D pass along `axis` is independent across any other axis; split along the last other one.
+    split = 2 if axis != 2 else 0
+
+    def run(lo, hi):
+        index = [slice(None)] * 3
+        index[split] = slice(lo, hi)
+        index = tuple(index)
+        correlate1d(src[index], weights, axis=axis, output=dst[index], mode='nearest')
+
+    _run_slabs(run, src.shape[split], workers)
+
+
+def _sigmas(sigma):
+    return np.broadcast_to(np.asarray(sigma, dtype=np.float64), (3,))
+
+
+def gaussian_filter(volume, sigma, out=None, workers=None, truncate=DEFAULT_TRUNCATE):
+    """
+    Separable float32 Gaussian of a 3-D volume ('nearest' borders, like skimage.filters.gaussian).
+
+    Runs one 1-D pass per axis, each split into slabs across `workers` threads,
+    ping-ponging between `out` and a single scratch buffer. `out` may be given to
+    reuse an existing float32 array, including `volume` itself when it is float32.
+    """
+    volume = np.asarray(volume)
+    if volume.dtype == np.bool_:
+        volume = volume.view(np.uint8)
+    if out is None:
+        out = np.empty(volume.shape, dtype=np.float32)
+    scratch = np.empty(volume.shape, dtype=np.float32)
+
+    axes = [axis for axis, s in enumerate(_sigmas(sigma)) if s > 0]
+    if not axes:
+        out[...] = volume
+        return out
+    # Alternate buffers so the last pass lands in `out`.
+    buffers = [out, scratch] if len(axes) % 2 == 1 else [scratch, out]
+    src = volume
+    for step, axis in enumerate(axes):
+        dst = buffers[step % 2]
+        _pass(src, dst, gaussian_kernel(_sigmas(sigma)[axis], truncate), axis, workers)
+        src = dst
+    return out
+
+
+def smooth_threshold(mask, sigma, level=0.5, out=None, workers=None, truncate=DEFAULT_TRUNCATE):
+    """
+    gaussian_filter(mask, sigma) > level without keeping the smoothed volume.
+
+    Works through slabs along the last axis: each slab plus a halo of one kernel
+    radius is smoothed in float32 and thresholded straight into the boolean `out`,
+    so the only float buffers are slab sized. Results equal thresholding
+    gaussian_filter's output.
+    """
+    mask = np.asarray(mask)
+    if mask.dtype == np.bool_:
+        mask = mask.view(np.uint8)
+    if out is None:
+        out = np.empty(mask.shape, dtype=bool)
+    sigmas = _sigmas(sigma)
+    kernels = [gaussian_kernel(s, truncate) if s > 0 else None for s in sigmas]
+    halo = 0 if kernels[2] is None else len(kernels[2]) // 2
+    depth = mask.shape[2]
+
+    def run(lo, hi):
+        in_lo, in_hi = max(0, lo - halo), min(depth, hi + halo)
+        src = mask[:, :, in_lo:in_hi]
+        for axis, weights in enumerate(kernels):
+            if weights is None:
+                continue
+            dst = np.empty(src.shape, dtype=np.float32)
+            correlate1d(src, weights, axis=axis, output=dst, mode='nearest')
+            src = dst
+        np.greater(src[:, :, lo - in_lo:hi - in_lo], level, out=out[:, :, lo:hi])
+
+    _run_slabs(run, depth, workers, FUSED_SLAB_SIZE)
+    return out
+
+
+def normalize_inplace(volume, out=None, bounds=None):
+    """
+    (volume - min) / (max - min) written into `out` (default: volume itself, which must be float).
+
+    `bounds` = (min, max), e.g. IntensityStats.bounds, skips the two reduction passes.
+    """
+    if out is None:
+        out = volume
+    lo, hi = bounds if bounds is not None else (np.min(volume), np.max(volume))
+    np.subtract(volume, lo, out=out)
+    np.divide(out, hi - lo, out=out)
+    return out
+
+
+def band_mask(volume, low, high, out=None, workers=None):
+    """(volume > low) & (volume < high) into a preallocated boolean `out`, slab by slab."""
+    if out is None:
+        out = np.empty(volume.shape, dtype=bool)
+
+    def run(lo, hi):
+        planes = volume[:, :, lo:hi]
+        np.greater(planes, low, out=out[:, :, lo:hi])
+        out[:, :, lo:hi] &= planes < high
+
+    _run_slabs(run, volume.shape[2], workers)
+    return out
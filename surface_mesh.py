@@ -0,0 +1,158 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from skimage.measure import marching_cubes
+
+# Planes along axis 0 per marching-cubes chunk.
+DEFAULT_CHUNK_SIZE = 64
+
+_STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+_PLY_FACE = np.dtype([('count', 'u1'), ('indices', '<i4', (3,))])
+
+
+def _chunk_surface(mask, lo, hi, closed):
+    # Planes [lo, hi] inclusive, so neighbouring chunks share plane hi and the cubes between them.
+    window = np.asarray(mask[lo:hi + 1], dtype=np.uint8)
+    offset = np.array([lo, 0, 0], dtype=np.float64)
+    if closed:
+        # Zero padding closes the surface where the mask touches the volume edge.
+        before = 1 if lo == 0 else 0
+        after = 1 if hi + 1 >= mask.shape[0] else 0
+        window = np.pad(window, ((before, after), (1, 1), (1, 1)))
+        offset -= [before, 1, 1]
+    if window.min() == window.max():
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+    vertices, faces, _, _ = marching_cubes(window, level=0.5, allow_degenerate=False)
+    return vertices + offset, faces
+
+
+def extract_surface(mask, spacing=(1, 1, 1), chunk_size=DEFAULT_CHUNK_SIZE, workers=None, closed=True):
+    """
+    Triangle surface of a binary mask: marching cubes at level 0.5 in chunks along axis 0.
+
+    Chunks overlap by one plane and run on `workers` threads; vertices the
+    chunks share on those planes come out bit-identical, so they are welded into
+    one vertex each. closed=True pads the volume with background so the mesh is
+    watertight. Returns (vertices float32 (N, 3) scaled by spacing, faces int32 (M, 3)).
+    """
+    depth = mask.shape[0]
+    bounds = list(range(0, max(depth - 1, 1), chunk_size)) + [depth - 1]
+    ranges = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo] or [(0, depth - 1)]
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(ranges)))
+
+    if workers == 1:
+        parts = [_chunk_surface(mask, lo, hi, closed) for lo, hi in ranges]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(lambda r: _chunk_surface(mask, *r, closed), ranges))
+
+    vertices, faces, count = [], [], 0
+    for part_vertices, part_faces in parts:
+        vertices.append(part_vertices)
+        faces.append(part_faces + count)
+        count += len(part_vertices)
+    vertices = np.concatenate(vertices)
+    faces = np.concatenate(faces)
+    vertices, faces = weld(vertices, faces)
+    return (vertices * np.asarray(spacing, dtype=np.float64)).astype(np.float32), faces.astype(np.int32)
+
+
+def weld(vertices, faces):
+    """Merge vertices with identical coordinates and renumber the faces."""
+    if len(vertices) == 0:
+        return vertices, faces
+    unique, inverse = np.unique(vertices, axis=0, return_inverse=True)
+    return unique, inverse.reshape(-1)[faces]
+
+
+def _drop_degenerate(faces):
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    faces = faces[keep]
+    # Clustering can also fold two triangles onto the same three vertices.
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return faces[np.sort(first)]
+
+
+def decimate(vertices, faces, cell_size):
+    """
+    Vertex-clustering decimation: snap vertices to a grid of `cell_size` (in mesh units).
+
+    All vertices in a cell collapse to their mean; triangles that become degenerate
+    or duplicated are dropped. Cost is a couple of sorts, independent of how much
+    the mesh shrinks. Returns (vertices, faces) with unused vertices removed.
+    """
+    if len(faces) == 0:
+        return vertices, faces
+    cells = np.floor(vertices / np.float32(cell_size)).astype(np.int64)
+    _, cluster = np.unique(cells, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    num_clusters = cluster.max() + 1
+    counts = np.bincount(cluster, minlength=num_clusters)[:, None]
+    merged = np.stack([np.bincount(cluster, weights=vertices[:, axis], minlength=num_clusters)
+                       for axis in range(3)], axis=1) / counts
+
+    faces = _drop_degenerate(cluster[faces])
+    used, remap = np.unique(faces, return_inverse=True)
+    return merged[used].astype(vertices.dtype), remap.reshape(faces.shape).astype(faces.dtype)
+
+
+def face_normals(vertices, faces):
+    """Unit normal of every triangle (zero for degenerate ones)."""
+    v = vertices[faces]
+    normals = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    length[length == 0] = 1
+    return (normals / length).astype(np.float32)
+
+
+def write_stl(path, vertices, faces):
+    """Binary STL: an 80-byte header, the triangle count and one 50-byte record per triangle."""
+    records = np.zeros(len(faces), dtype=_STL_RECORD)
+    records['normal'] = face_normals(vertices, faces)
+    records['vertices'] = vertices[faces]
+    with open(path, 'wb') as f:
+        f.write(b'dental3d binary STL'.ljust(80, b'\0'))
+        f.write(np.uint32(len(faces)).tobytes())
+        records.tofile(f)
+    return path
+
+
+def write_ply(path, vertices, faces):
+    """Binary little-endian PLY with float32 vertices and int32 triangle indices (shared vertices)."""
+    header = (
+        "ply\nformat binary_little_endian 1.0\n"
+        f"element vertex {len(vertices)}\n"
+        "property float x\nproperty float y\nproperty float z\n"
+        f"element face {len(faces)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    )
+    records = np.zeros(len(faces), dtype=_PLY_FACE)
+    records['count'] = 3
+    records['indices'] = faces
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        np.ascontiguousarray(vertices, dtype='<f4').tofile(f)
+        records.tofile(f)
+    return path
+
+
+def write_mesh(path, vertices, faces):
+    """Write .stl or .ply, chosen by the file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.stl':
+        return write_stl(path, vertices, faces)
+    if extension == '.ply':
+        return write_ply(path, vertices, faces)
+    raise ValueError(f"Unsupported mesh format: {extension}")
+
+
+def export_surface(mask, path, spacing=(1, 1, 1), cell_size=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    """extract_surface, optionally decimate with cell_size, then write_mesh; returns (vertices, faces)."""
+    vertices, faces = extract_surface(mask, spacing, chunk_size, workers)
+    if cell_size:
+        vertices, faces = decimate(vertices, faces, cell_size)
+    write_mesh(path, vertices, faces)
+    return vertices, faces
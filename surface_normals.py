@@ -0,0 +1,127 @@
+import numpy as np
+from scipy.ndimage import sobel, binary_erosion
+
+from dicom_volume import as_float_array
+
+# Sobel kernels are 3 taps wide, so a region needs one extra voxel per side.
+HALO = 1
+
+ENCODINGS = ('float32', 'int8')
+INT8_SCALE = 127
+
+# Separable Sobel taps: derivative along one axis, smoothing along the others.
+_DERIVATIVE = np.array([-1.0, 0.0, 1.0], dtype=np.float32)
+_SMOOTH = np.array([1.0, 2.0, 1.0], dtype=np.float32)
+
+
+def sobel_normals(volume):
+    """Unit Sobel gradient at every voxel, shape volume.shape + (3,)."""
+    volume = as_float_array(volume)
+    dx = sobel(volume, axis=0)
+    dy = sobel(volume, axis=1)
+    dz = sobel(volume, axis=2)
+    magnitude = np.sqrt(dx**2 + dy**2 + dz**2)
+    magnitude[magnitude == 0] = 1
+    normals = np.stack((dx/magnitude, dy/magnitude, dz/magnitude), axis=-1)
+    return normals
+
+
+def _padded_region(shape, roi):
+    """Expand a tuple of slices by HALO voxels, clipped to the volume."""
+    padded, core = [], []
+    for n, sl in zip(shape, roi):
+        start, stop, _ = sl.indices(n)
+        lo, hi = max(0, start - HALO), min(n, stop + HALO)
+        padded.append(slice(lo, hi))
+        core.append(slice(start - lo, stop - lo))
+    return tuple(padded), tuple(core)
+
+
+def normals_in_roi(volume, roi):
+    """
+    Normals for a box `roi` (a tuple of three slices), shape roi_shape + (3,).
+
+    Only the box plus a one-voxel halo is read; the values equal the matching
+    part of sobel_normals(volume), including at the volume edges.
+    """
+    padded, core = _padded_region(volume.shape, roi)
+    return sobel_normals(volume[padded])[core]
+
+
+def normals_for_slice(volume, index, axis=2):
+    """Normals of one plane, e.g. the axial slice `index` for axis=2; shape plane_shape + (3,)."""
+    roi = [slice(None)] * 3
+    roi[axis] = slice(index, index + 1)
+    return np.take(normals_in_roi(volume, tuple(roi)), 0, axis=axis)
+
+
+def boundary_voxels(mask):
+    """Coordinates (N, 3) of mask voxels with at least one face neighbour outside the mask."""
+    mask = np.asarray(mask, dtype=bool)
+    return np.argwhere(mask & ~binary_erosion(mask, border_value=1))
+
+
+def boundary_normals(volume, level=None, mask=None, batch_size=65536):
+    """
+    Normals only at voxels on an iso-surface or mask boundary.
+
+    Pass either a boolean `mask` or an iso `level` (mask = volume >= level).
+    Returns (coords, normals): int (N, 3) voxel indices and float32 (N, 3) unit
+    vectors. Gradients are evaluated from each voxel's 3x3x3 neighbourhood in
+    batches, so memory follows the number of boundary voxels, not the volume size.
+    """
+    if mask is None:
+        if level is None:
+            raise ValueError("boundary_normals needs either level or mask")
+        mask = np.empty(volume.shape, dtype=bool)
+        for start in range(0, volume.shape[2], 32):
+            mask[:, :, start:start + 32] = as_float_array(volume[:, :, start:start + 32]) >= level
+    coords = boundary_voxels(mask)
+    normals = np.empty((len(coords), 3), dtype=np.float32)
+
+    offsets = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'), axis=-1).reshape(-1, 3)
+    kernels = []
+    for axis in range(3):
+        taps = [_SMOOTH] * 3
+        taps[axis] = _DERIVATIVE
+        kernels.append(np.einsum('i,j,k->ijk', *taps).ravel())
+    kernels = np.stack(kernels, axis=1)
+
+    upper = np.array(volume.shape) - 1
+    for start in range(0, len(coords), batch_size):
+        batch = coords[start:start + batch_size]
+        # Clipping to the edge matches the 'reflect' boundary mode of the full Sobel pass.
+        neighbours = np.clip(batch[:, None, :] + offsets[None], 0, upper)
+        values = _gather(volume, neighbours)
+        gradients = values @ kernels
+        magnitude = np.sqrt((gradients ** 2).sum(axis=1, keepdims=True))
+        magnitude[magnitude == 0] = 1
+        normals[start:start + len(batch)] = gradients / magnitude
+    return coords, normals
+
+
+def _gather(volume, points):
+    if isinstance(volume, np.ndarray):
+        return volume[points[..., 0], points[..., 1], points[..., 2]].astype(np.float32)
+    # Lazily rescaled volumes (DicomVolume) only support box reads; read the batch's bounding box.
+    lo = points.reshape(-1, 3).min(axis=0)
+    hi = points.reshape(-1, 3).max(axis=0) + 1
+    box = as_float_array(volume[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]])
+    local = points - lo
+    return box[local[..., 0], local[..., 1], local[..., 2]].astype(np.float32)
+
+
+def encode_normals(normals, encoding='int8'):
+    """Compact storage for unit normals: 'float32', or 'int8' (components scaled by 127)."""
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown normals encoding: {encoding}")
+    if encoding == 'float32':
+        return np.asarray(normals, dtype=np.float32)
+    return np.rint(np.asarray(normals) * INT8_SCALE).astype(np.int8)
+
+
+def decode_normals(encoded):
+    """Inverse of encode_normals, returning float32 vectors."""
+    if encoded.dtype == np.int8:
+        return encoded.astype(np.float32) / INT8_SCALE
+    return np.asarray(encoded, dtype=np.float32)
@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+import numpy as np
+
+import dicom_catalog
+from dicom_volume import DicomVolume
+from intensity_stats import IntensityStats
+
+CACHE_VERSION = 3
+DEFAULT_MAX_BYTES = int(os.environ.get('DENTAL3D_CACHE_MAX_BYTES', 8 * 1024 ** 3))
+
+
+def source_fingerprint(slices):
+    """Hash of every slice's path, size and mtime; None if a slice has no source file."""
+    digest = hashlib.sha1()
+    for slice_data in slices:
+        filepath = slice_data.get('filepath')
+        if filepath is None:
+            return None
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        digest.update(f"{os.path.abspath(filepath)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _voxel_key(target_voxel_size):
+    return '_'.join(f"{float(v):.6g}" for v in target_voxel_size)
+
+
+class VolumeCache:
+    """
+    On-disk cache of reconstructed series, one directory per SeriesInstanceUID.
+
+    Each entry holds the stored-dtype volume as raw.npy, optional resampled
+    float volumes, the intensity statistics gathered while decoding as
+    stats.npz, and meta.json (voxel size, metadata, rescale values and the
+    fingerprint of the source files). Volumes are opened with mmap_mode='r', so a
+    hit costs a few file opens. Entries whose sources changed are rebuilt, and the
+    least recently used series are evicted once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root or os.path.join(dicom_catalog.CACHE_ROOT, 'volumes')
+        self.max_bytes = max_bytes
+
+    def _entry_dir(self, series_uid):
+        name = re.sub(r'[^0-9A-Za-z.\-]', '_', str(series_uid))
+        return os.path.join(self.root, name)
+
+    def _read_meta(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != CACHE_VERSION:
+            return None
+        return meta
+
+    def _write_meta(self, entry_dir, meta):
+        tmp_path = os.path.join(entry_dir, 'meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(entry_dir, 'meta.json'))
+
+    def _touch(self, entry_dir, meta):
+        meta['last_used'] = time.time()
+        try:
+            self._write_meta(entry_dir, meta)
+        except OSError as e:
+            logging.warning(f"Unable to update volume cache entry {entry_dir}: {str(e)}")
+
+    def _lookup(self, slices):
+        fingerprint = source_fingerprint(slices)
+        if fingerprint is None:
+            return None, None
+        entry_dir = self._entry_dir(slices[0]['SeriesInstanceUID'])
+        meta = self._read_meta(entry_dir)
+        if meta is None or meta['fingerprint'] != fingerprint:
+            return entry_dir, None
+        return entry_dir, meta
+
+    def load(self, slices):
+        """Return (DicomVolume, voxel_size, metadata) for a cached series, or None on a miss."""
+        entry_dir, meta = self._lookup(slices)
+        if meta is None:
+            return None
+        try:
+            raw = np.load(os.path.join(entry_dir, 'raw.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        self._touch(entry_dir, meta)
+        logging.info(f"Volume cache hit for series {slices[0]['SeriesInstanceUID']}")
+        volume = DicomVolume(raw, meta['slope'], meta['intercept'], self._load_stats(entry_dir))
+        return volume, tuple(meta['voxel_size']), meta['metadata']
+
+    def _load_stats(self, entry_dir):
+        # Missing stats are not a miss: DicomVolume recomputes them if they are asked for.
+        try:
+            return IntensityStats.load(os.path.join(entry_dir, 'stats.npz'))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def allocate(self, slices):
+        """
+        Return an empty DicomVolume whose raw buffer is a memmap in a staging directory.
+
+        Decode into it and pass it to store(); nothing is visible to readers until then.
+        Returns None if the slices cannot be cached (no source files).
+        """
+        if source_fingerprint(slices) is None:
+            return None
+        os.makedirs(self.root, exist_ok=True)
+        staging = f"{self._entry_dir(slices[0]['SeriesInstanceUID'])}.tmp-{os.getpid()}-{time.time_ns()}"
+        os.makedirs(staging)
+        template = DicomVolume.empty(slices)
+        raw = np.lib.format.open_memmap(os.path.join(staging, 'raw.npy'), mode='w+',
+                                        dtype=template.raw.dtype, shape=template.raw.shape)
+        return DicomVolume(raw, template.slope, template.intercept)
+
+    def store(self, slices, volume, voxel_size, metadata):
+        """
+        Publish a volume filled through allocate() and return (volume, voxel_size, metadata).
+
+        The returned volume is the one just written, made read-only; it stays valid
+        whether or not publishing succeeds, so a failure to publish only costs the
+        next run a decode.
+        """
+        staging = os.path.dirname(volume.raw.filename)
+        volume.raw.flush()
+        volume.raw.flags.writeable = False
+        meta = {
+            'version': CACHE_VERSION,
+            'series_uid': slices[0]['SeriesInstanceUID'],
+            'fingerprint': source_fingerprint(slices),
+            'voxel_size': [float(v) for v in voxel_size],
+            'metadata': {key: dicom_catalog.plain_value(value) for key, value in metadata.items()},
+            'slope': volume.slope.tolist(),
+            'intercept': volume.intercept.tolist(),
+            'resampled': {},
+            'last_used': time.time(),
+        }
+        entry_dir = self._entry_dir(meta['series_uid'])
+        try:
+            if volume.stats is not None:
+                volume.stats.save(os.path.join(staging, 'stats.npz'))
+            self._write_meta(staging, meta)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            # POSIX keeps the open memmap valid across the rename; elsewhere this may fail instead.
+            os.replace(staging, entry_dir)
+        except OSError as e:
+            logging.warning(f"Unable to cache volume in {entry_dir}: {str(e)}")
+            self.discard(volume)
+        else:
+            self.evict(keep=entry_dir)
+        # Same voxel size and plain-value metadata as a later hit returns
+        return volume, tuple(meta['voxel_size']), meta['metadata']
+
+    def discard(self, volume):
+        """Drop the staging directory of a volume from allocate() that will not be stored."""
+        shutil.rmtree(os.path.dirname(volume.raw.filename), ignore_errors=True)
+
+    def load_resampled(self, slices, target_voxel_size):
+        entry_dir, meta = self._lookup(slices)
+        if meta is None:
+            return None
+        filename = meta['resampled'].get(_voxel_key(target_voxel_size))
+        if filename is None:
+            return None
+        try:
+            return np.load(os.path.join(entry_dir, filename), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    def store_resampled(self, slices, target_voxel_size, array):
+        """Add a resampled volume to an existing entry; returns it memory-mapped when stored."""
+        entry_dir, meta = self._lookup(slices)
+        if meta is None:
+            return array
+        key = _voxel_key(target_voxel_size)
+        filename = f"resampled_{key}.npy"
+        try:
+            np.save(os.path.join(entry_dir, f"{filename}.tmp.npy"), array)
+            os.replace(os.path.join(entry_dir, f"{filename}.tmp.npy"), os.path.join(entry_dir, filename))
+            meta['resampled'][key] = filename
+            self._touch(entry_dir, meta)
+        except OSError as e:
+            logging.warning(f"Unable to cache resampled volume in {entry_dir}: {str(e)}")
+            return array
+        self.evict(keep=entry_dir)
+        return np.load(os.path.join(entry_dir, filename), mmap_mode='r')
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        if not os.path.isdir(self.root):
+            return
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            if not os.path.isdir(entry_dir) or '.tmp-' in name:
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, f))
+                for f in os.listdir(entry_dir)
+                if os.path.isfile(os.path.join(entry_dir, f))
+            )
+            meta = self._read_meta(entry_dir) or {}
+            entries.append((meta.get('last_used', 0), size, entry_dir))
+            total += size
+
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_dir == keep:
+                continue
+            logging.info(f"Evicting cached volume {entry_dir}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+
+_default_cache = None
+
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = VolumeCache()
+    return _default_cache
@@ -0,0 +1,79 @@
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+def vtk_compatible(array):
+    """`array` with a dtype VTK can wrap: bool masks are viewed as uint8, other types are left alone."""
+    array = np.asarray(array)
+    if array.dtype == np.bool_:
+        return array.view(np.uint8)
+    return array
+
+
+def point_order(volume):
+    """
+    A volume indexed (x, y, z) flattened in VTK point order (x fastest).
+
+    This is a view when the volume is Fortran-contiguous (e.g. pyramid levels, or
+    DicomVolume data transposed to (column, row, slice)); anything else is copied
+    once, straight into that order.
+    """
+    volume = vtk_compatible(volume)
+    return np.asfortranarray(volume).ravel(order='F')
+
+
+def to_vtk_array(array, name=None):
+    """
+    Wrap a 1-D (or (n, components)) array as a vtkDataArray sharing its memory.
+
+    The array is copied only if it is not contiguous or VTK cannot use its
+    dtype as is. The VTK buffer keeps a reference to the NumPy data, so it
+    stays valid for as long as VTK uses it.
+    """
+    array = vtk_compatible(array)
+    if array.dtype.byteorder == '>':
+        array = array.astype(array.dtype.newbyteorder('='))
+    vtk_array = numpy_support.numpy_to_vtk(array, deep=False)
+    if name is not None:
+        vtk_array.SetName(name)
+    return vtk_array
+
+
+def from_vtk_array(vtk_array):
+    """NumPy view of a vtkDataArray's memory, holding a reference to the VTK array."""
+    return numpy_support.vtk_to_numpy(vtk_array)
+
+
+def to_image_data(volume, spacing=(1, 1, 1), origin=(0, 0, 0), name=None):
+    """vtkImageData over a volume indexed (x, y, z), with the scalars shared rather than copied when possible."""
+    volume = np.asarray(volume)
+    image_data = vtk.vtkImageData()
+    image_data.SetDimensions(volume.shape)
+    image_data.SetSpacing(spacing)
+    image_data.SetOrigin(origin)
+    image_data.GetPointData().SetScalars(to_vtk_array(point_order(volume), name))
+    return image_data
+
+
+def image_data_to_numpy(image_data, name=None):
+    """
+    Point scalars (or the point array `name`) of a vtkImageData as an (x, y, z) view.
+
+    The result is Fortran-ordered; `.transpose(2, 1, 0)` gives the C-ordered
+    (z, y, x) view of the same memory.
+    """
+    point_data = image_data.GetPointData()
+    vtk_array = point_data.GetScalars() if name is None else point_data.GetArray(name)
+    flat = from_vtk_array(vtk_array)
+    dims = image_data.GetDimensions()
+    if flat.ndim == 2:
+        return flat.reshape(dims + (flat.shape[1],), order='F')
+    return flat.reshape(dims, order='F')
+
+
+def to_pyvista(volume, spacing=(1, 1, 1), origin=(0, 0, 0), name="scalars"):
+    """pyvista.ImageData over a volume indexed (x, y, z), sharing its memory like to_image_data."""
+    import pyvista as pv
+
+    return pv.wrap(to_image_data(volume, spacing, origin, name))